@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# Rosetta task agent. Run on the computing resource right before the task container, it reserves the
+# task port triplet and reports the ip and the (base) port back to the webapp, then prints the port.
+# It then stays in background sending heartbeats to the webapp until the task container exits.
+# Usage: agent.py <task uuid> <webapp url>, or set ROSETTA_TASK_UUID and ROSETTA_WEBAPP_URL. The
+# seconds between heartbeats can be set with ROSETTA_HEARTBEAT_INTERVAL (zero to disable them).
+# This very same file is served to all the tasks, to be cached on the computing resources. Must
+# work with both Python 2 and 3, as it runs with whatever Python the computing resource provides.
+
+import os
+import sys
+import errno
+import time
+import logging
+import socket
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib import urlopen
+
+# Ephemeral ports range scanned for the port triplet
+PORT_RANGE = (49152, 65535-2)
+
+# Default seconds between heartbeats
+HEARTBEAT_INTERVAL = 60
+
+
+def allocate_ports(start_port):
+    '''Reserve three consecutive ports by binding them, scanning the range sequentially from the
+    start port. Returns the base port and the bound sockets, to be closed to release the ports.'''
+
+    port = start_port
+    scanned = 0
+    while scanned <= PORT_RANGE[1] - PORT_RANGE[0]:
+        sockets = []
+        try:
+            for i in range(3):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sockets.append(sock)
+                sock.bind(('', port+i))
+            return port, sockets
+        except socket.error:
+            for sock in sockets:
+                sock.close()
+            # Skip past the port already in use
+            scanned += i+1
+            port += i+1
+            if port > PORT_RANGE[1]:
+                port = PORT_RANGE[0]
+    return None, []
+
+
+def get_host_stats():
+    '''Get the load average (1 minute) and the memory usage percentage of the host, where available.'''
+    stats = {}
+    try:
+        stats['load'] = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        pass
+    try:
+        meminfo = {}
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0])
+        stats['mem'] = 100.0 * (meminfo['MemTotal'] - meminfo['MemAvailable']) / meminfo['MemTotal']
+    except (IOError, KeyError, ValueError, ZeroDivisionError):
+        pass
+    return stats
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def get_task_shell_pid():
+    '''Get the pid of the shell running the agent, which then runs the task container in its place (exec).
+    The agent might run in a subshell of it (a fork, with the same command line), which is skipped.'''
+
+    def get_cmdline(pid):
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            return f.read()
+
+    def get_parent_pid(pid):
+        with open('/proc/{}/stat'.format(pid)) as f:
+            stat = f.read()
+        return int(stat[stat.rindex(')')+2:].split()[1])
+
+    pid = os.getppid()
+    try:
+        while True:
+            parent_pid = get_parent_pid(pid)
+            if parent_pid <= 1 or get_cmdline(parent_pid) != get_cmdline(pid):
+                return pid
+            pid = parent_pid
+    except (IOError, OSError, ValueError):
+        return pid
+
+
+def send_heartbeats(task_uuid, webapp_url, watched_pid, interval):
+    '''Send heartbeats to the webapp until the watched process exits (or the webapp does not want them).'''
+    while True:
+        time.sleep(interval)
+        if not is_alive(watched_pid):
+            return
+        url = '{}/api/v1/base/agent/heartbeat/?task_uuid={}'.format(webapp_url, task_uuid)
+        for stat, value in sorted(get_host_stats().items()):
+            url += '&{}={:.2f}'.format(stat, value)
+        try:
+            response_content = urlopen(url).read().decode('utf-8')
+        except Exception:
+            # Webapp not reachable, just try again later
+            continue
+        if response_content != 'OK':
+            return
+
+
+def main():
+
+    # Setup logging
+    logger = logging.getLogger('Agent')
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        task_uuid = sys.argv[1] if len(sys.argv) > 1 else os.environ['ROSETTA_TASK_UUID']
+        webapp_url = sys.argv[2] if len(sys.argv) > 2 else os.environ['ROSETTA_WEBAPP_URL']
+    except KeyError:
+        logger.error('Usage: agent.py <task uuid> <webapp url>')
+        sys.exit(1)
+
+    # Log
+    logger.info('Reporting for task uuid: "{}"'.format(task_uuid))
+
+    # Get IP
+    ip = socket.gethostbyname(socket.gethostname())
+    logger.info(' - ip: "{}"'.format(ip))
+
+    # Get ports. The triplet is reserved by binding it (and holding the sockets until the container is about
+    # to start), starting from a per-task point so that tasks landing on the same node do not scan the same ports.
+    allocation_start_t = time.time()
+    start_port = PORT_RANGE[0] + int(task_uuid.replace('-', ''), 16) % (PORT_RANGE[1] - PORT_RANGE[0] + 1)
+    port, sockets = allocate_ports(start_port)
+    if not sockets:
+        logger.error('No available ephemeral port triplet found, exiting with status code =1')
+        sys.exit(1)
+    allocation_time = time.time() - allocation_start_t
+    logger.info(' - ports: "{},{},{}" (allocated in {:.3f}s)'.format(port, port+1, port+2, allocation_time))
+
+    response = urlopen('{}/api/v1/base/agent/?task_uuid={}&action=set_ip_port&ip={}&port={}&allocation_time={:.3f}'.format(webapp_url, task_uuid, ip, port, allocation_time))
+    response_content = response.read().decode('utf-8')
+    if response_content != 'OK':
+        logger.error(response_content)
+        logger.info('Not everything OK, exiting with status code =1')
+        sys.exit(1)
+    else:
+        logger.info('Everything OK')
+
+    # Release the ports for the container, which starts right after
+    for sock in sockets:
+        sock.close()
+
+    # Stay in background sending heartbeats, until the task container exits (watched by the pid of the
+    # shell running the agent, as the container replaces it).
+    try:
+        heartbeat_interval = int(os.environ.get('ROSETTA_HEARTBEAT_INTERVAL', HEARTBEAT_INTERVAL))
+    except ValueError:
+        heartbeat_interval = HEARTBEAT_INTERVAL
+    if heartbeat_interval > 0:
+        watched_pid = get_task_shell_pid()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            # Detach, and let go of the output so that the launch command does not wait for it
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in range(3):
+                os.dup2(devnull, fd)
+            try:
+                send_heartbeats(task_uuid, webapp_url, watched_pid, heartbeat_interval)
+            finally:
+                os._exit(0)
+
+    print(port)
+
+
+if __name__ == '__main__':
+    main()
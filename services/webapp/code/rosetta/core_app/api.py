@@ -1,3 +1,4 @@
+import uuid
 import logging
 from django.http import HttpResponse
 from django.utils import timezone
@@ -7,8 +8,12 @@ from django.conf import settings
 from rest_framework.response import Response
 from rest_framework import status, serializers, viewsets
 from rest_framework.views import APIView
-from .utils import format_exception, send_email
+from rest_framework.pagination import CursorPagination
+from .utils import format_exception
 from .models import Profile, Task, TaskStatuses
+from .auth_tokens import authenticate_token
+from .outbox import queue_email
+from .heartbeats import heartbeat_buffer
  
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -75,12 +80,12 @@ def rosetta_authenticate(request):
 
     # Try auth toekn authentication 
     elif authtoken:
-        try:
-            profile = Profile.objects.get(authtoken=authtoken)
-        except Profile.DoesNotExist:
+        # Stateless: the user is just attached to the request, no sessions involved
+        user = authenticate_token(authtoken)
+        if not user:
             return error400('Wrong auth token')
-        login(request, profile.user)
-        return profile.user
+        request.user = user
+        return user
     else:
         return error401('This is a private API. Login or provide username/password or auth token')
 
@@ -202,93 +207,67 @@ class UserViewSet(viewsets.ModelViewSet):
             model = User
             fields = ('url', 'username', 'email', 'groups')
 
+    class UserCursorPagination(CursorPagination):
+        # Keyset pagination on the join date, so that deep pages cost as much as the first one
+        ordering = ('-date_joined', '-id')
+        page_size_query_param = 'page_size'
+        max_page_size = 1000
+
     queryset = User.objects.all().order_by('-date_joined')    
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
 
 
 class agent_api(PublicGETAPI):
     
     def _get(self, request):
         try:
-            
+
+            from django.core.exceptions import ValidationError
+
+            action = request.GET.get('action', None)
             task_uuid = request.GET.get('task_uuid', None)
+
+            if not action:
+                # Return the agent code, the same for all the tasks and cacheable by its version
+                from .utils import get_agent_code, get_agent_version
+                agent_code = get_agent_code()
+                agent_version = get_agent_version()
+                etag = '"{}"'.format(agent_version)
+
+                if task_uuid:
+                    # Legacy (per-task) agent download, run without arguments: set them
+                    try:
+                        task = Task.objects.get(uuid=task_uuid)
+                    except (Task.DoesNotExist, ValidationError):
+                        return HttpResponse('Unknown task uuid "{}"'.format(task_uuid))
+                    from .utils import get_webapp_conn_string
+                    agent_code = 'import sys\nsys.argv[1:] = sys.argv[1:] or ["{}", "{}"]\n'.format(task.uuid, get_webapp_conn_string()) + agent_code
+                    etag = None
+
+                if etag and request.META.get('HTTP_IF_NONE_MATCH') == etag:
+                    response = HttpResponse(status=304)
+                else:
+                    response = HttpResponse(agent_code, content_type='text/x-python')
+                if etag:
+                    response['ETag'] = etag
+                    if request.GET.get('version', None) == agent_version:
+                        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+                    else:
+                        response['Cache-Control'] = 'no-cache'
+                else:
+                    response['Cache-Control'] = 'no-store'
+                return response
+
             if not task_uuid:
                 return HttpResponse('MISSING task_uuid')
     
-            from django.core.exceptions import ValidationError
-    
             try:
                 task = Task.objects.get(uuid=task_uuid)
             except (Task.DoesNotExist, ValidationError):
                 return HttpResponse('Unknown task uuid "{}"'.format(task_uuid))
 
-
-            from.utils import get_webapp_conn_string
-            webapp_conn_string = get_webapp_conn_string()
-            
-            action = request.GET.get('action', None)
-            
-            if not action:
-                # Return the agent code
-                agent_code='''
-import logging
-import socket
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
-
-# Setup logging
-logger = logging.getLogger('Agent')
-logging.basicConfig(level=logging.INFO)
-
-hostname = socket.gethostname()
-
-# Task id set by the API
-task_uuid = "'''+ task_uuid  +'''"
-
-# Log
-logger.info('Reporting for task uuid: "{}"'.format(task_uuid))
-
-# Get IP
-ip = socket.gethostbyname(hostname)
-logger.info(' - ip: "{}"'.format(ip))
-
-# Get port
-from random import randint
-while True:
-
-    # Get a random ephimeral port
-    port = randint(49152, 65535-2)
-
-    # Check port is available
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    result1 = sock.connect_ex(('127.0.0.1', port))
-    result2 = sock.connect_ex(('127.0.0.1', port+1))
-    result3 = sock.connect_ex(('127.0.0.1', port+2))
-    if (result1 == 0) or (result2 == 0) or (result3 == 0):
-        logger.info('Found not available ephemeral port triplet ({},{},{}) , choosing another one...'.format(port,port+1,port+2))
-        import time
-        time.sleep(1)
-    else:
-        break
-logger.info(' - ports: "{},{},{}"'.format(port, port+1, port+2))
-
-response = urlopen("'''+webapp_conn_string+'''/api/v1/base/agent/?task_uuid={}&action=set_ip_port&ip={}&port={}".format(task_uuid, ip, port))
-response_content = response.read() 
-if response_content != 'OK':
-    logger.error(response_content)
-    logger.info('Not everything OK, exiting with status code =1')
-    sys.exit(1)
-else:
-    logger.info('Everything OK')
-print(port)
-'''
-        
-                return HttpResponse(agent_code)
-    
-    
-            elif action=='set_ip_port':
+            if action=='set_ip_port':
                 
                 task_ip   = request.GET.get('ip', None)
                 if not task_ip:
@@ -304,21 +283,21 @@ print(port)
                     return HttpResponse('Port not valid (got "{}")'.format(task_port))
                   
                 # Set fields
-                logger.info('Setting task "{}" to ip "{}" and port "{}"'.format(task.uuid, task_ip, task_port))
+                logger.info('Setting task "{}" to ip "{}" and port "{}" (allocated in {}s)'.format(task.uuid, task_ip, task_port, request.GET.get('allocation_time', 'n.a.')))
                 task.status = TaskStatuses.running
                 task.ip     = task_ip
                 if task.container.supports_dynamic_ports:
                     task.port = int(task_port)
                 task.save()
                         
-                # Notify the user that the task called back home
-                logger.info('Sending task ready mail notification to "{}"'.format(task.user.email))
+                # Notify the user that the task called back home (in background, not to keep the agent waiting)
+                logger.info('Queuing task ready mail notification to "{}"'.format(task.user.email))
                 mail_subject = 'Your Task "{}" is up and running'.format(task.container.name)
                 mail_text = 'Hello,\n\nyour Task "{}" on {} is up and running: {}/tasks/?uuid={}\n\nThe Rosetta notifications bot.'.format(task.container.name, task.computing, settings.DJANGO_PUBLIC_HTTP_HOST, task.uuid)
                 try:
-                    send_email(to=task.user.email, subject=mail_subject, text=mail_text)
+                    queue_email(to=task.user.email, subject=mail_subject, text=mail_text)
                 except Exception as e:
-                    logger.error('Cannot send task ready email: "{}"'.format(e))
+                    logger.error('Cannot queue task ready email: "{}"'.format(e))
                 return HttpResponse('OK')
                 
     
@@ -331,6 +310,39 @@ print(port)
 
 
 
+class agent_heartbeat_api(PublicGETAPI):
+    '''Heartbeats of the task agents, buffered and written to the database in batches (see heartbeats.py).'''
+
+    def _get(self, request):
+
+        task_uuid = request.GET.get('task_uuid', None)
+        try:
+            task_uuid = uuid.UUID(task_uuid)
+        except (TypeError, ValueError):
+            return HttpResponse('Task uuid not valid (got "{}")'.format(task_uuid))
+
+        # Load and memory usage of the host, optional
+        stats = {}
+        for stat in ['load', 'mem']:
+            value = request.GET.get(stat, None)
+            if value:
+                try:
+                    stats[stat] = float(value)
+                except ValueError:
+                    return HttpResponse('{} not valid (got "{}")'.format(stat.capitalize(), value))
+
+        # Only for the running tasks, so that the agents of the others stop sending them (a primary key lookup)
+        task_status = Task.objects.filter(uuid=task_uuid).values_list('status', flat=True).first()
+        if not task_status:
+            return HttpResponse('Unknown task uuid "{}"'.format(task_uuid))
+        if task_status != TaskStatuses.running:
+            return HttpResponse('Task not running (got status "{}")'.format(task_status))
+
+        heartbeat_buffer.add(task_uuid, **stats)
+        return HttpResponse('OK')
+
+
+
 
 
 
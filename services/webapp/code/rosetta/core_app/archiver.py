@@ -0,0 +1,62 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Task, TaskStatuses, TaskHistory
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Conf
+TERMINAL_STATUSES = [TaskStatuses.stopped, TaskStatuses.exited]
+
+
+def archive_task_batch(created_before, batch_size):
+    '''Move a batch of terminal tasks created before a given time to the history table. Returns how many.'''
+
+    with transaction.atomic():
+        tasks = list(Task.objects.filter(status__in=TERMINAL_STATUSES, created__lt=created_before)
+                     .select_related('computing', 'container').select_for_update(skip_locked=True, of=('self',))
+                     .order_by('created')[:batch_size])
+        if not tasks:
+            return 0
+
+        archived = timezone.now()
+        TaskHistory.objects.bulk_create([TaskHistory(uuid = task.uuid,
+                                                     user_id = task.user_id,
+                                                     tid = task.tid,
+                                                     name = task.name,
+                                                     status = task.status,
+                                                     created = task.created,
+                                                     archived = archived,
+                                                     computing = task.computing,
+                                                     computing_name = task.computing.name,
+                                                     computing_type = task.computing.type,
+                                                     container = task.container,
+                                                     container_name = task.container.name,
+                                                     container_image = task.container.image,
+                                                     computing_options = task.computing_options) for task in tasks])
+
+        # Their tunnels, port allocations and launches go with them
+        Task.objects.filter(uuid__in=[task.uuid for task in tasks]).delete()
+
+    return len(tasks)
+
+
+def archive_tasks(max_age=None, batch_size=None):
+    '''Move the terminal tasks older than max_age days to the history table, in batches
+    (each in its own transaction) so that the Task table is never locked for long.
+    Returns the number of tasks archived.'''
+
+    max_age = max_age if max_age is not None else settings.TASK_ARCHIVE_AGE
+    batch_size = batch_size if batch_size else settings.TASK_ARCHIVE_BATCH_SIZE
+    created_before = timezone.now() - timedelta(days=max_age)
+
+    archived_count = 0
+    while True:
+        batch_count = archive_task_batch(created_before, batch_size)
+        archived_count += batch_count
+        if batch_count < batch_size:
+            break
+    return archived_count
@@ -0,0 +1,70 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .models import Profile
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AuthTokenCache(object):
+    '''In-process LRU cache of the users by auth token, whose entries expire after a TTL. Tokens changed
+    here are invalidated right away, in other processes (i.e. from the admin) once their entries expire.'''
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size if max_size else settings.AUTH_TOKEN_CACHE_SIZE
+        self.ttl = ttl if ttl else settings.AUTH_TOKEN_CACHE_TTL
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            try:
+                user, expires = self.entries[token]
+            except KeyError:
+                return None
+            if expires < time.time():
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+        # Each request gets its own copy, so that nobody changes the cached one
+        return copy.copy(user)
+
+    def set(self, token, user):
+        with self.lock:
+            self.entries[token] = (user, time.time() + self.ttl)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        '''Drop the entries of a user (whatever the token, as the old one might not be known anymore).'''
+        with self.lock:
+            for token in [token for token, (cached_user, _) in self.entries.items() if cached_user.id == user_id]:
+                del self.entries[token]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def authenticate_token(authtoken):
+    '''Get the (active) user owning an auth token, from the cache or with a single (indexed) query. None if not valid.'''
+    user = authtoken_cache.get(authtoken)
+    if user:
+        return user
+    try:
+        user = Profile.objects.select_related('user').get(authtoken=authtoken).user
+    except Profile.DoesNotExist:
+        return None
+    if not user.is_active:
+        return None
+    authtoken_cache.set(authtoken, user)
+    return copy.copy(user)
+
+
+# Auth token cache (per process)
+authtoken_cache = AuthTokenCache()
@@ -0,0 +1,80 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _get_catalog_cache_keys(model, user_id):
+    model_name = model.__name__.lower()
+    return 'catalog_{}_{}'.format(model_name, user_id), 'catalog_{}_version'.format(model_name)
+
+
+def _get_visible(model, user):
+    '''Get the objects of a model visible to a user (the platform ones and the user's own), from
+    the cache if there and still valid, or with a single query. Platform ones come first.'''
+    from django.db.models import Q
+
+    cache_key, version_cache_key = _get_catalog_cache_keys(model, user.id)
+    cached = cache.get_many([cache_key, version_cache_key])
+    version = cached.get(version_cache_key, None)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(version_cache_key, version, None)
+
+    # Cached lists are tied to the version of the platform objects they were built with
+    try:
+        cached_version, objects = cached[cache_key]
+        if cached_version == version:
+            return objects
+    except KeyError:
+        pass
+
+    objects = sorted(model.objects.filter(Q(user=None) | Q(user=user)).select_related('user'),
+                     key=lambda obj: (obj.user_id is not None, obj.name))
+    cache.set(cache_key, (version, objects), settings.CATALOG_CACHE_TIMEOUT)
+    return objects
+
+
+def _get_visible_one(model, user, obj_uuid):
+    for obj in _get_visible(model, user):
+        if str(obj.uuid) == str(obj_uuid):
+            return obj
+    return None
+
+
+def get_containers(user):
+    '''Get the containers visible to a user.'''
+    from .models import Container
+    return _get_visible(Container, user)
+
+
+def get_computings(user):
+    '''Get the computing resources visible to a user.'''
+    from .models import Computing
+    return _get_visible(Computing, user)
+
+
+def get_container(user, container_uuid):
+    '''Get a container by uuid, if visible to the user (None otherwise).'''
+    from .models import Container
+    return _get_visible_one(Container, user, container_uuid)
+
+
+def get_computing(user, computing_uuid):
+    '''Get a computing resource by uuid, if visible to the user (None otherwise).'''
+    from .models import Computing
+    return _get_visible_one(Computing, user, computing_uuid)
+
+
+def invalidate_catalog(obj):
+    '''Invalidate the cached lists including a (just added, changed or deleted) container or computing
+    resource: only its user's one, or everyone's if a platform one. Other processes will see the
+    change at most CATALOG_CACHE_TIMEOUT seconds later.'''
+    cache_key, version_cache_key = _get_catalog_cache_keys(obj.__class__, obj.user_id)
+    if obj.user_id:
+        cache.delete(cache_key)
+    else:
+        cache.set(version_cache_key, uuid.uuid4().hex, None)
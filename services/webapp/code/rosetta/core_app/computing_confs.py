@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_sys_conf_cache_key(computing_uuid):
+    return 'computing_sys_conf_{}'.format(computing_uuid)
+
+
+def get_user_conf_cache_key(computing_uuid, user_id):
+    return 'computing_user_conf_{}_{}'.format(computing_uuid, user_id)
+
+
+def _get_conf_data(cache_key, ConfModel, **filters):
+    # Conf data is wrapped, so that missing confs (None) get cached as well
+    cached_conf = cache.get(cache_key)
+    if cached_conf is None:
+        try:
+            data = ConfModel.objects.get(**filters).data
+        except ConfModel.DoesNotExist:
+            data = None
+        cached_conf = {'data': data}
+        cache.set(cache_key, cached_conf, settings.COMPUTING_CONF_CACHE_TIMEOUT)
+    return cached_conf['data']
+
+
+def get_sys_conf_data(computing):
+    '''Get the sys conf data of a computing, from the cache if there.'''
+    from .models import ComputingSysConf
+    return _get_conf_data(get_sys_conf_cache_key(computing.uuid), ComputingSysConf, computing=computing)
+
+
+def get_user_conf_data(computing, user):
+    '''Get the conf data of a user for a computing, from the cache if there.'''
+    from .models import ComputingUserConf
+    return _get_conf_data(get_user_conf_cache_key(computing.uuid, user.id if user else None), ComputingUserConf, computing=computing, user=user)
+
+
+def attach_user_conf_data(computings, user):
+    '''Attach the conf data of a user to a list of computings at once, reading the ones
+    not in the cache with a single query (rather than one per computing).'''
+    from .models import ComputingUserConf
+    computings = list(computings)
+    for computing in computings:
+        if computing.user_id and computing.user_id != user.id:
+            raise Exception('Cannot attach a conf data for another user (my user="{}", another user="{}"'.format(computing.user, user))
+
+    cache_keys = {computing.uuid: get_user_conf_cache_key(computing.uuid, user.id) for computing in computings}
+    cached_confs = cache.get_many(list(cache_keys.values()))
+
+    missing_uuids = [computing_uuid for computing_uuid, cache_key in cache_keys.items() if cache_key not in cached_confs]
+    if missing_uuids:
+        confs_data = {conf.computing_id: conf.data for conf in ComputingUserConf.objects.filter(computing__in=missing_uuids, user=user).only('computing', 'data')}
+        missing_confs = {cache_keys[computing_uuid]: {'data': confs_data.get(computing_uuid, None)} for computing_uuid in missing_uuids}
+        cache.set_many(missing_confs, settings.COMPUTING_CONF_CACHE_TIMEOUT)
+        cached_confs.update(missing_confs)
+
+    for computing in computings:
+        computing._user_conf_data = cached_confs[cache_keys[computing.uuid]]['data']
+
+
+def attach_tasks_user_conf_data(tasks):
+    '''Attach to the computing of each task the conf data of the task user, with a query per user at most.'''
+    tasks_by_user = {}
+    for task in tasks:
+        tasks_by_user.setdefault(task.user_id, []).append(task)
+    for user_tasks in tasks_by_user.values():
+        attach_user_conf_data([task.computing for task in user_tasks], user_tasks[0].user)
+
+
+def invalidate_conf_data(computing_uuid, user_id=None, sys=False):
+    '''Drop the cached sys conf data of a computing, or the one of a user. Other processes
+    will see the change at most COMPUTING_CONF_CACHE_TIMEOUT seconds later.'''
+    if sys:
+        cache.delete(get_sys_conf_cache_key(computing_uuid))
+    else:
+        cache.delete(get_user_conf_cache_key(computing_uuid, user_id))
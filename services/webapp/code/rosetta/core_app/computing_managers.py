@@ -1,5 +1,10 @@
+import base64
+from django.conf import settings
 from .models import TaskStatuses, KeyPair, Task
-from .utils import os_shell
+from .tunnels import tunnel_registry
+from .launch_queue import cancel_task_launch
+from .docker_client import docker_client, DockerAPIError
+from .ssh_pool import ssh_pool
 from .exceptions import ErrorMessage, ConsistencyException
 
 # Setup logging
@@ -8,10 +13,18 @@ logger = logging.getLogger(__name__)
 
 # Conf
 TASK_DATA_DIR = "/data"
+LOCAL_TASKS_NETWORK = "rosetta_default"
+
+# Slurm job states (see the "JOB STATE CODES" in the squeue man page)
+SLURM_PENDING_STATES = ['PENDING', 'CONFIGURING', 'REQUEUED', 'REQUEUE_HOLD', 'REQUEUE_FED', 'RESIZING']
+SLURM_ACTIVE_STATES = ['RUNNING', 'COMPLETING', 'SUSPENDED', 'STOPPED', 'SIGNALING', 'STAGE_OUT']
 
 
 class ComputingManager(object):
-    
+
+    # Whether task logs can be read from a byte offset, or only their tail can
+    supports_log_offsets = True
+
     def start_task(self, task, **kwargs):
         
         # Check for run task logic implementation
@@ -24,6 +37,25 @@ class ComputingManager(object):
         self._start_task(task, **kwargs)
 
 
+    def start_tasks(self, tasks, **kwargs):
+        '''Start a set of identical tasks (same user, container, computing and options). Where supported
+        (i.e. as a Slurm job array) they are started all at once, otherwise one by one.'''
+
+        # Check for start tasks logic implementation, or start them one by one
+        try:
+            self._start_tasks
+        except AttributeError:
+            for task in tasks:
+                self.start_task(task, **kwargs)
+            return
+
+        # Call actual start tasks logic (a single task does not need it)
+        if len(tasks) == 1:
+            self.start_task(tasks[0], **kwargs)
+        else:
+            self._start_tasks(tasks, **kwargs)
+
+
     def stop_task(self, task, **kwargs):
         
         # Check for stop task logic implementation
@@ -32,36 +64,23 @@ class ComputingManager(object):
         except AttributeError:
             raise NotImplementedError('Not implemented')
         
-        # Call actual stop task logic
-        self._stop_task(task, **kwargs)
+        # Call actual stop task logic, unless the task was still queued for launch
+        if not cancel_task_launch(task):
+            self._stop_task(task, **kwargs)
         
         # Ok, save status as deleted
         task.status = 'stopped'
         task.save()
         
-        # Check if the tunnel is active and if so kill it
-        logger.debug('Checking if task "{}" has a running tunnel'.format(task.tid))
-        check_command = 'ps -ef | grep ":'+str(task.tunnel_port)+':'+str(task.ip)+':'+str(task.port)+'" | grep -v grep | awk \'{print $2}\''
-        logger.debug(check_command)
-        out = os_shell(check_command, capture=True)
-        logger.debug(out)
-        if out.exit_code == 0:
-            logger.debug('Task "{}" has a running tunnel, killing it'.format(task.tid))
-            tunnel_pid = out.stdout
-            # Kill Tunnel command
-            kill_tunnel_command= 'kill -9 {}'.format(tunnel_pid)
-        
-            # Log
-            logger.debug('Killing tunnel with command: {}'.format(kill_tunnel_command))
-        
-            # Execute
-            os_shell(kill_tunnel_command, capture=True)
-            if out.exit_code != 0:
-                raise Exception(out.stderr)
+        # Close the tunnel, if any
+        tunnel_registry.close(task)
 
 
-    def get_task_log(self, task, **kwargs):
-        
+    def get_task_log(self, task, offset=0, tail=None, **kwargs):
+        '''Get the log of a task from a byte offset or, if "tail" is set, its last "tail" lines. Returns
+        a (log, size) tuple, where size is the log size in bytes (the offset to read from next time).
+        If the log got truncated (size lower than the offset), the log is returned empty.'''
+
         # Check for get task log logic implementation
         try:
             self._get_task_log
@@ -69,23 +88,108 @@ class ComputingManager(object):
             raise NotImplementedError('Not implemented')
         
         # Call actual get task log logic
-        return self._get_task_log(task, **kwargs)
+        return self._get_task_log(task, offset=offset, tail=tail, **kwargs)
 
 
+    def follow_task_log(self, task, offset=0, **kwargs):
+        '''Follow the log of a task from a byte offset. Returns a stream (with the readline and close
+        methods) of the new log lines, ending when the log cannot be followed anymore.'''
 
-class LocalComputingManager(ComputingManager):
-    
-    def _start_task(self, task):
+        # Check for follow task log logic implementation
+        try:
+            self._follow_task_log
+        except AttributeError:
+            raise NotImplementedError('Not implemented')
 
-        # Init run command #--cap-add=NET_ADMIN --cap-add=NET_RAW
-        run_command  = 'sudo docker run  --network=rosetta_default --name rosetta-task-{}'.format( task.id)
+        # Call actual follow task log logic
+        return self._follow_task_log(task, offset=offset, **kwargs)
 
-        # Pass if any
-        if task.auth_pass:
-            run_command += ' -eAUTH_PASS={} '.format(task.auth_pass)
 
-        # Data volume
-        run_command += ' -v {}/task-{}:/data'.format(TASK_DATA_DIR, task.id)
+    def reconcile_tasks(self, tasks, **kwargs):
+        '''Check the real status of a set of (non-terminal) tasks on the same computing, and
+        return the new statuses of the changed ones as a {task uuid: status} dict.'''
+
+        # Check for reconcile tasks logic implementation
+        try:
+            self._reconcile_tasks
+        except AttributeError:
+            raise NotImplementedError('Not implemented')
+
+        # Call actual reconcile tasks logic
+        return self._reconcile_tasks(tasks, **kwargs)
+
+
+    def _get_log_read_command(self, log_file, offset=0, tail=None):
+
+        # Script printing the log file size, then the log from the offset (or its tail) up to that size
+        # (it might be still growing), then a "#" as the executor strips the last newline of the output.
+        script  = 'LOG_FILE="{}"\n'.format(log_file)
+        script += 'SIZE=$(stat -c %s "$LOG_FILE") || exit 1\n'
+        script += 'echo $SIZE\n'
+        if tail:
+            script += 'head -c $SIZE "$LOG_FILE" | tail -n {}\n'.format(int(tail))
+        else:
+            script += 'if [ $SIZE -gt {} ]; then tail -c +{} "$LOG_FILE" | head -c $(($SIZE - {})); fi\n'.format(int(offset), int(offset)+1, int(offset))
+        script += 'echo "#"\n'
+
+        # Base64-encode it, so that it can go through any level of shell quoting
+        return 'echo {} | base64 -d | /bin/bash'.format(base64.b64encode(script.encode('utf-8')).decode('utf-8'))
+
+
+    def _get_log_follow_command(self, log_file, offset=0):
+
+        # Script following the log file from the offset, until the SSH session gets closed: the session
+        # stdin (saved as fd 3, as the script comes from a pipe) reaches EOF, the script exits and so
+        # does tail, which is bound to its pid. Base64-encoded as for the log read command.
+        script  = 'LOG_FILE="{}"\n'.format(log_file)
+        script += 'tail -c +{} -F "$LOG_FILE" --pid=$$ 2> /dev/null &\n'.format(int(offset)+1)
+        script += 'cat <&3 > /dev/null\n'
+        return 'exec 3<&0; echo {} | base64 -d | /bin/bash'.format(base64.b64encode(script.encode('utf-8')).decode('utf-8'))
+
+
+    def _parse_log_read_output(self, out, offset=0, tail=None):
+        if out.exit_code != 0:
+            raise Exception(out.stderr)
+        size, log = out.stdout.split('\n', 1)
+        size = int(size)
+        if not log.endswith('#'):
+            raise Exception('Incomplete log read output (truncated?)')
+        log = log[:-1]
+        if not tail and size < offset:
+            log = ''
+        return log, size
+
+
+    def _get_agent_commands(self, task_uuid, webapp_conn_string, home='\\$HOME'):
+
+        # Commands for downloading the agent, only if its current version is not already on the host (i.e. in
+        # the user home, which on clusters is usually shared across the nodes), and for running it for the task.
+        from .utils import get_agent_version
+        agent_version = get_agent_version()
+        agent_file = '{}/.rosetta/agent_{}.py'.format(home, agent_version)
+        download_command  = '[ -f {} ] || (mkdir -p {}/.rosetta && '.format(agent_file, home)
+        download_command += 'wget {}/api/v1/base/agent/?version={} -O {}.{} &> /dev/null && '.format(webapp_conn_string, agent_version, agent_file, task_uuid)
+        download_command += 'mv {}.{} {})'.format(agent_file, task_uuid, agent_file)
+        run_command = 'ROSETTA_HEARTBEAT_INTERVAL={} python {} {} {}'.format(settings.TASK_HEARTBEAT_INTERVAL, agent_file, task_uuid, webapp_conn_string)
+        return download_command, run_command
+
+
+    def _get_ssh_connection(self, task, host, user, user_keys):
+
+        # Get the pooled (persistent) SSH connection for this computing, user and keys
+        return ssh_pool.get_connection(computing = task.computing,
+                                       host = host,
+                                       user = user,
+                                       key_file = user_keys.private_key_file)
+
+
+
+class LocalComputingManager(ComputingManager):
+
+    # The Docker API can only tail the logs (the follow starts from the end anyway)
+    supports_log_offsets = False
+
+    def _start_task(self, task):
 
         # Set registry string
         if task.container.registry == 'local':
@@ -93,67 +197,116 @@ class LocalComputingManager(ComputingManager):
         else:
             registry_string  = ''
 
-        # Host name, image entry command
-        run_command += ' -h task-{} -d -t {}{}'.format(task.id, registry_string, task.container.image)
+        # Container configuration, as for "docker run --network=rosetta_default --name rosetta-task-{id}
+        # -e AUTH_PASS={pass} -v {data dir}/task-{id}:/data -h task-{id} -d -t {image}"
+        container_name = 'rosetta-task-{}'.format(task.id)
+        container_config = {'Hostname': 'task-{}'.format(task.id),
+                            'Tty': True,
+                            'HostConfig': {'NetworkMode': LOCAL_TASKS_NETWORK,
+                                           'Binds': ['{}/task-{}:/data'.format(TASK_DATA_DIR, task.id)]}}
+
+        # Pass if any
+        if task.auth_pass:
+            container_config['Env'] = ['AUTH_PASS={}'.format(task.auth_pass)]
 
         # Debug
-        logger.debug('Running new task with command="{}"'.format(run_command))
-        
-        # Run the task 
-        out = os_shell(run_command, capture=True)
-        if out.exit_code != 0:
-            raise Exception(out.stderr)
+        logger.debug('Running new task with name="{}" and config="{}"'.format(container_name, container_config))
+
+        # Run the task (create, start and inspect)
+        container_info = docker_client.run_container(registry_string + task.container.image, name=container_name, **container_config)
+        task_tid = container_info['Id']
+        logger.debug('Created task with id: "{}"'.format(task_tid))
+
+        # Get task IP address, on the tasks network if there
+        networks = container_info['NetworkSettings']['Networks']
+        if LOCAL_TASKS_NETWORK in networks:
+            task_ip = networks[LOCAL_TASKS_NETWORK]['IPAddress']
         else:
-            task_tid = out.stdout
-            logger.debug('Created task with id: "{}"'.format(task_tid))
-
-            # Get task IP address
-            out = os_shell('sudo docker inspect --format \'{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}\' ' + task_tid + ' | tail -n1', capture=True)
-            if out.exit_code != 0:
-                raise Exception('Error: ' + out.stderr)
-            task_ip = out.stdout
-
-            # Set fields
-            task.tid    = task_tid
-            task.status = TaskStatuses.running
-            task.ip     = task_ip
-            task.port   = int(task.container.ports.split(',')[0])
-
-            # Save
-            task.save()
+            task_ips = [network['IPAddress'] for network in networks.values() if network['IPAddress']]
+            if not task_ips:
+                # Remove the container, or it would clash by name with the one of the next attempt
+                try:
+                    docker_client.remove_container(task_tid, force=True)
+                except DockerAPIError as e:
+                    logger.error('Error in removing the container of task "{}": "{}"'.format(task, e))
+                raise Exception('Cannot get the IP address of the task container (not attached to any network?)')
+            task_ip = task_ips[-1]
+
+        # Set fields
+        task.tid    = task_tid
+        task.status = TaskStatuses.running
+        task.ip     = task_ip
+        task.port   = int(task.container.ports.split(',')[0])
+
+        # Save
+        task.save()
 
 
     def _stop_task(self, task):
 
         # Delete the Docker container
         standby_supported = False
-        if standby_supported:
-            stop_command = 'sudo docker stop {}'.format(task.tid)
-        else:
-            stop_command = 'sudo docker stop {} && sudo docker rm {}'.format(task.tid,task.tid)
-    
-        out = os_shell(stop_command, capture=True)
-        if out.exit_code != 0:
-            if 'No such container' in out.stderr:
-                pass
-            else:
-                raise Exception(out.stderr)
+        try:
+            docker_client.stop_container(task.tid)
+            if not standby_supported:
+                docker_client.remove_container(task.tid)
+        except DockerAPIError as e:
+            # No such container
+            if e.status_code != 404:
+                raise
  
         # Set task as stopped
         task.status = TaskStatuses.stopped
         task.save()
 
     
-    def _get_task_log(self, task, **kwargs):
+    def _get_task_log(self, task, offset=0, tail=None, **kwargs):
 
-        # View the Docker container log (attach)
-        view_log_command = 'sudo docker logs {}'.format(task.tid,)
-        logger.debug(view_log_command)
-        out = os_shell(view_log_command, capture=True)
-        if out.exit_code != 0:
-            raise Exception(out.stderr)
-        else:
-            return out.stdout
+        # View the Docker container log. The API has no byte offsets, only tails: just the tail is
+        # read when asked for, and its size taken as the offset (see "supports_log_offsets").
+        if tail:
+            log = docker_client.container_logs(task.tid, tail=tail)
+            return log, len(log.encode('utf-8'))
+
+        # From an offset, get it all and slice it here (at least this is a local socket read)
+        log = docker_client.container_logs(task.tid)
+        log_data = log.encode('utf-8')
+        if len(log_data) < offset:
+            return '', len(log_data)
+        return log_data[offset:].decode('utf-8', errors='replace'), len(log_data)
+
+
+    def _follow_task_log(self, task, offset=0, **kwargs):
+
+        # Follow the Docker container log. There are no byte offsets in the API: start from
+        # its end, as the offset is expected to be the current log size anyway.
+        return docker_client.follow_container_logs(task.tid, tail=0)
+
+
+    def _reconcile_tasks(self, tasks, **kwargs):
+
+        # Only tasks with a container id can be checked
+        tasks = [task for task in tasks if task.tid]
+        if not tasks:
+            return {}
+
+        # List all the containers at once (the ones which do not exist anymore are just not listed)
+        container_states = {container['Id']: container['State'] for container in docker_client.list_containers(ids=[task.tid for task in tasks])}
+
+        new_statuses = {}
+        for task in tasks:
+            state = container_states.get(task.tid, None)
+            if state == 'running':
+                status = TaskStatuses.running
+            elif state in [None, 'exited', 'dead']:
+                status = TaskStatuses.exited
+            else:
+                # Created, restarting, paused etc.
+                status = task.status
+            if status != task.status:
+                new_statuses[task.uuid] = status
+
+        return new_statuses
 
 
 
@@ -205,9 +358,9 @@ class RemoteComputingManager(ComputingManager):
                 else:
                     binds += ',{}'.format(task.extra_binds)
             
-            run_command  = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} '.format(user_keys.private_key_file, user, host)
-            run_command += '/bin/bash -c \'"rm -rf /tmp/{}_data && mkdir -p /tmp/{}_data/tmp && mkdir -p /tmp/{}_data/home && chmod 700 /tmp/{}_data && '.format(task.uuid, task.uuid, task.uuid, task.uuid) 
-            run_command += 'wget {}/api/v1/base/agent/?task_uuid={} -O /tmp/{}_data/agent.py &> /dev/null && export BASE_PORT=\$(python /tmp/{}_data/agent.py 2> /tmp/{}_data/task.log) && '.format(webapp_conn_string, task.uuid, task.uuid, task.uuid, task.uuid)
+            run_command  = '/bin/bash -c \'"rm -rf /tmp/{}_data && mkdir -p /tmp/{}_data/tmp && mkdir -p /tmp/{}_data/home && chmod 700 /tmp/{}_data && '.format(task.uuid, task.uuid, task.uuid, task.uuid) 
+            agent_download_command, agent_run_command = self._get_agent_commands(task.uuid, webapp_conn_string)
+            run_command += '{} && export BASE_PORT=\$({} 2> /tmp/{}_data/task.log) && '.format(agent_download_command, agent_run_command, task.uuid)
             run_command += 'export SINGULARITY_NOHTTPS=true && export SINGULARITYENV_BASE_PORT=\$BASE_PORT && {} '.format(authstring)
             run_command += 'exec nohup singularity run {} --pid --writable-tmpfs --no-home --home=/home/metauser --workdir /tmp/{}_data/tmp -B/tmp/{}_data/home:/home --containall --cleanenv '.format(binds, task.uuid, task.uuid)
             
@@ -227,7 +380,7 @@ class RemoteComputingManager(ComputingManager):
         else:
             raise NotImplementedError('Container {} not supported'.format(task.container.type))
 
-        out = os_shell(run_command, capture=True)
+        out = self._get_ssh_connection(task, host, user, user_keys).run(run_command)
         if out.exit_code != 0:
             raise Exception(out.stderr)
         
@@ -262,8 +415,8 @@ class RemoteComputingManager(ComputingManager):
         user = task.computing.get_conf_param('user')
 
         # Stop the task remotely
-        stop_command = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} \'/bin/bash -c "kill -9 {}"\''.format(user_keys.private_key_file, user, host, task.pid)
-        out = os_shell(stop_command, capture=True)
+        stop_command = '\'/bin/bash -c "kill -9 {}"\''.format(task.pid)
+        out = self._get_ssh_connection(task, host, user, user_keys).run(stop_command)
         if out.exit_code != 0:
             if not 'No such process' in out.stderr:
                 raise Exception(out.stderr)
@@ -273,7 +426,7 @@ class RemoteComputingManager(ComputingManager):
         task.save()
 
 
-    def _get_task_log(self, task, **kwargs):
+    def _get_task_log(self, task, offset=0, tail=None, **kwargs):
         
         # Get user keys
         if task.computing.requires_user_keys:
@@ -285,35 +438,71 @@ class RemoteComputingManager(ComputingManager):
         host = task.computing.get_conf_param('host')
         user = task.computing.get_conf_param('user')
 
-        # View log remotely
-        view_log_command = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} \'/bin/bash -c "cat /tmp/{}_data/task.log"\''.format(user_keys.private_key_file, user, host, task.uuid)
+        # View log remotely (only the new bytes or the tail)
+        view_log_command = '\'/bin/bash -c "{}"\''.format(self._get_log_read_command('/tmp/{}_data/task.log'.format(task.uuid), offset, tail))
 
-        out = os_shell(view_log_command, capture=True)
-        if out.exit_code != 0:
-            raise Exception(out.stderr)
-        else:
-            return out.stdout
+        out = self._get_ssh_connection(task, host, user, user_keys).run(view_log_command)
+        return self._parse_log_read_output(out, offset, tail)
 
 
+    def _follow_task_log(self, task, offset=0, **kwargs):
 
-class SlurmComputingManager(ComputingManager):
-    
-    def _start_task(self, task, **kwargs):
-        logger.debug('Starting a remote task "{}"'.format(task.computing))
+        # Get user keys
+        if task.computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=task.user, default=True)
+        else:
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
 
         # Get computing host
-        host = task.computing.get_conf_param('master')
+        host = task.computing.get_conf_param('host')
         user = task.computing.get_conf_param('user')
-        
+
+        # Follow log remotely
+        follow_log_command = '\'/bin/bash -c "{}"\''.format(self._get_log_follow_command('/tmp/{}_data/task.log'.format(task.uuid), offset))
+        return self._get_ssh_connection(task, host, user, user_keys).stream(follow_log_command)
+
+
+    def _reconcile_tasks(self, tasks, **kwargs):
+
+        # Only tasks with a pid can be checked
+        tasks = [task for task in tasks if task.pid]
+        if not tasks:
+            return {}
+
+        # Use the first task to get the credentials to access the host
+        reference_task = tasks[0]
+        computing = reference_task.computing
+        computing.attach_user_conf_data(reference_task.user)
+
+        # Get computing host
+        host = computing.get_conf_param('host')
+        user = computing.get_conf_param('user')
+
         # Get user keys
-        if task.computing.requires_user_keys:
-            user_keys = KeyPair.objects.get(user=task.user, default=True)
+        if computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=reference_task.user, default=True)
         else:
             raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
 
-        # Get webapp conn string
-        from.utils import get_webapp_conn_string
-        webapp_conn_string = get_webapp_conn_string()
+        # Check all the processes at once (ps exits with 1 if none of them is alive)
+        check_command = '\'/bin/bash -c "ps -o pid= -p {}"\''.format(','.join([str(task.pid) for task in tasks]))
+        out = self._get_ssh_connection(reference_task, host, user, user_keys).run(check_command)
+        if out.exit_code not in [0, 1]:
+            raise Exception(out.stderr)
+        alive_pids = [int(pid) for pid in out.stdout.split()]
+
+        new_statuses = {}
+        for task in tasks:
+            if task.pid not in alive_pids:
+                new_statuses[task.uuid] = TaskStatuses.exited
+
+        return new_statuses
+
+
+
+class SlurmComputingManager(ComputingManager):
+
+    def _get_sbatch_args(self, task):
 
         # Initialize sbatch args (force 1 task for now)
         sbatch_args = '-N1 '
@@ -332,7 +521,67 @@ class SlurmComputingManager(ComputingManager):
             if task_memory:
                 sbatch_args += '--mem {} '.format(task_memory)
 
-        # Set output and error files
+        return sbatch_args
+
+
+    def _get_binds(self, task):
+
+        # Set binds, only from sys config if the resource is not owned by the user
+        if task.computing.user != task.user:
+            binds = task.computing.get_conf_param('binds', from_sys_only=True )
+        else:
+            binds = task.computing.get_conf_param('binds')
+        if not binds:
+            binds = ''
+        else:
+            binds = '-B {}'.format(binds)
+
+        # Manage task extra binds
+        if task.extra_binds:
+            if not binds:
+                binds = '-B {}'.format(task.extra_binds)
+            else:
+                binds += ',{}'.format(task.extra_binds)
+
+        return binds
+
+
+    def _get_registry(self, task):
+        if task.container.registry == 'docker_local':
+            # Get local Docker registry conn string
+            from.utils import get_local_docker_registry_conn_string
+            local_docker_registry_conn_string = get_local_docker_registry_conn_string()
+            return 'docker://{}/'.format(local_docker_registry_conn_string)
+        elif task.container.registry == 'docker_hub':
+            return 'docker://'
+        else:
+            raise NotImplementedError('Registry {} not supported'.format(task.container.registry))
+
+
+    def _get_job_id(self, task):
+        # Tasks started as part of a job array have their array element job id (i.e. "42_3") as task id
+        return task.tid if task.tid else str(task.pid)
+
+    
+    def _start_task(self, task, **kwargs):
+        logger.debug('Starting a remote task "{}"'.format(task.computing))
+
+        # Get computing host
+        host = task.computing.get_conf_param('master')
+        user = task.computing.get_conf_param('user')
+        
+        # Get user keys
+        if task.computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=task.user, default=True)
+        else:
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
+
+        # Get webapp conn string
+        from.utils import get_webapp_conn_string
+        webapp_conn_string = get_webapp_conn_string()
+
+        # Set sbatch args, and output and error files
+        sbatch_args = self._get_sbatch_args(task)
         sbatch_args += ' --output=\$HOME/{}.log --error=\$HOME/{}.log '.format(task.uuid, task.uuid)
 
         # Submit the job
@@ -347,25 +596,11 @@ class SlurmComputingManager(ComputingManager):
             else:
                 authstring = ''
 
-            # Set binds, only from sys config if the resource is not owned by the user
-            if task.computing.user != task.user:
-                binds = task.computing.get_conf_param('binds', from_sys_only=True )
-            else:
-                binds = task.computing.get_conf_param('binds')
-            if not binds:
-                binds = ''
-            else:
-                binds = '-B {}'.format(binds)
+            # Set binds
+            binds = self._get_binds(task)
 
-            # Manage task extra binds
-            if task.extra_binds:
-                if not binds:
-                    binds = '-B {}'.format(task.extra_binds)
-                else:
-                    binds += ',{}'.format(task.extra_binds)
-
-            run_command = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} '.format(user_keys.private_key_file, user, host)
-            run_command += '\'bash -c "echo \\"#!/bin/bash\nwget {}/api/v1/base/agent/?task_uuid={} -O \$HOME/agent_{}.py &> \$HOME/{}.log && export BASE_PORT=\\\\\\$(python \$HOME/agent_{}.py 2> \$HOME/{}.log) && '.format(webapp_conn_string, task.uuid, task.uuid, task.uuid, task.uuid, task.uuid)
+            agent_download_command, agent_run_command = self._get_agent_commands(task.uuid, webapp_conn_string)
+            run_command = '\'bash -c "echo \\"#!/bin/bash\n{} && export BASE_PORT=\\\\\\$({} 2> \$HOME/{}.log) && '.format(agent_download_command, agent_run_command, task.uuid)
             run_command += 'export SINGULARITY_NOHTTPS=true && export SINGULARITYENV_BASE_PORT=\\\\\\$BASE_PORT && {} '.format(authstring)
             run_command += 'rm -rf /tmp/{}_data && mkdir -p /tmp/{}_data/tmp &>> \$HOME/{}.log && mkdir -p /tmp/{}_data/home &>> \$HOME/{}.log && chmod 700 /tmp/{}_data && '.format(task.uuid, task.uuid, task.uuid, task.uuid, task.uuid, task.uuid)
             run_command += 'exec nohup singularity run {} --pid --writable-tmpfs --no-home --home=/home/metauser --workdir /tmp/{}_data/tmp -B/tmp/{}_data/home:/home --containall --cleanenv '.format(binds, task.uuid, task.uuid)
@@ -373,15 +608,7 @@ class SlurmComputingManager(ComputingManager):
             # Double to escape for Pythom, six for shell (double times three as \\\ escapes a single slash in shell)
 
             # Set registry
-            if task.container.registry == 'docker_local':
-                # Get local Docker registry conn string
-                from.utils import get_local_docker_registry_conn_string
-                local_docker_registry_conn_string = get_local_docker_registry_conn_string()
-                registry = 'docker://{}/'.format(local_docker_registry_conn_string)
-            elif task.container.registry == 'docker_hub':
-                registry = 'docker://'
-            else:
-                raise NotImplementedError('Registry {} not supported'.format(task.container.registry))
+            registry = self._get_registry(task)
     
             run_command+='{}{} &> \$HOME/{}.log\\" > \$HOME/{}.sh && sbatch {} \$HOME/{}.sh"\''.format(registry, task.container.image, task.uuid, task.uuid, sbatch_args, task.uuid)
 
@@ -389,7 +616,7 @@ class SlurmComputingManager(ComputingManager):
         else:
             raise NotImplementedError('Container {} not supported'.format(task.container.type))
 
-        out = os_shell(run_command, capture=True)
+        out = self._get_ssh_connection(task, host, user, user_keys).run(run_command)
         if out.exit_code != 0:
             raise Exception(out.stderr)
 
@@ -418,6 +645,74 @@ class SlurmComputingManager(ComputingManager):
         task.save()
 
 
+    def _start_tasks(self, tasks, **kwargs):
+        logger.debug('Starting {} remote tasks as a job array on "{}"'.format(len(tasks), tasks[0].computing))
+
+        # All the tasks are the same but for their uuid, so use the first one as the reference
+        task = tasks[0]
+
+        # Get computing host
+        host = task.computing.get_conf_param('master')
+        user = task.computing.get_conf_param('user')
+
+        # Get user keys
+        if task.computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=task.user, default=True)
+        else:
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
+
+        # Get webapp conn string
+        from.utils import get_webapp_conn_string
+        webapp_conn_string = get_webapp_conn_string()
+
+        if task.container.type != 'singularity':
+            raise NotImplementedError('Container {} not supported'.format(task.container.type))
+
+        # Job script, running the task of the array element: same as for a single task (see above), with the task uuid
+        # picked from the array. The output goes to the task log file, as sbatch cannot name it after the task uuid.
+        agent_download_command, agent_run_command = self._get_agent_commands('$TASK_UUID', webapp_conn_string, home='$HOME')
+        script  = '#!/bin/bash\n'
+        script += 'TASK_UUIDS=({})\n'.format(' '.join([str(array_task.uuid) for array_task in tasks]))
+        script += 'TASK_UUID=${TASK_UUIDS[$SLURM_ARRAY_TASK_ID]}\n'
+        script += 'exec &>> $HOME/$TASK_UUID.log\n'
+        script += '{} || exit 1\n'.format(agent_download_command)
+        script += 'BASE_PORT=$({}) || exit 1\n'.format(agent_run_command)
+        script += 'export SINGULARITY_NOHTTPS=true && export SINGULARITYENV_BASE_PORT=$BASE_PORT\n'
+        if task.auth_pass:
+            script += 'export SINGULARITYENV_AUTH_PASS={}\n'.format(task.auth_pass)
+        script += 'rm -rf /tmp/${TASK_UUID}_data && mkdir -p /tmp/${TASK_UUID}_data/tmp && mkdir -p /tmp/${TASK_UUID}_data/home && chmod 700 /tmp/${TASK_UUID}_data\n'
+        script += 'exec nohup singularity run {} --pid --writable-tmpfs --no-home --home=/home/metauser --workdir /tmp/${{TASK_UUID}}_data/tmp -B/tmp/${{TASK_UUID}}_data/home:/home --containall --cleanenv '.format(self._get_binds(task))
+        script += '{}{}\n'.format(self._get_registry(task), task.container.image)
+
+        # Write it and submit the array at once, in a single SSH round trip. Base64-encoded as for the log read command.
+        sbatch_args = self._get_sbatch_args(task)
+        sbatch_args += '--array=0-{} --output=/dev/null --error=/dev/null '.format(len(tasks)-1)
+        run_command = '\'bash -c "echo {} | base64 -d > \\$HOME/{}_array.sh && sbatch {} \\$HOME/{}_array.sh"\''.format(base64.b64encode(script.encode('utf-8')).decode('utf-8'),
+                                                                                                              task.uuid, sbatch_args, task.uuid)
+        out = self._get_ssh_connection(task, host, user, user_keys).run(run_command)
+        if out.exit_code != 0:
+            raise Exception(out.stderr)
+
+        # Log
+        logger.debug('Shell exec output: "{}"'.format(out))
+
+        # Parse sbatch output. Example: Output(stdout='Submitted batch job 3', stderr='', exit_code=0)
+        job_id = out.stdout.split(' ')[-1]
+        try:
+            int(job_id)
+        except:
+            raise Exception('Cannot find int job id from output string "{}"'.format(out.stdout))
+
+        # Save the array job id as task pid and the array element job id as task id, all at once
+        for i, array_task in enumerate(tasks):
+            array_task.pid = job_id
+            array_task.tid = '{}_{}'.format(job_id, i)
+        Task.objects.bulk_update(tasks, ['pid', 'tid'])
+
+        # Set status (only if we get here before the agents which set the status as running via the API)
+        Task.objects.filter(uuid__in=[array_task.uuid for array_task in tasks]).exclude(status=TaskStatuses.running).update(status=TaskStatuses.sumbitted)
+
+
     def _stop_task(self, task, **kwargs):
         
         # Get user keys
@@ -431,8 +726,8 @@ class SlurmComputingManager(ComputingManager):
         user = task.computing.get_conf_param('user')
 
         # Stop the task remotely
-        stop_command = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} \'/bin/bash -c "scancel {}"\''.format(user_keys.private_key_file, user, host, task.pid)
-        out = os_shell(stop_command, capture=True)
+        stop_command = '\'/bin/bash -c "scancel {}"\''.format(self._get_job_id(task))
+        out = self._get_ssh_connection(task, host, user, user_keys).run(stop_command)
         if out.exit_code != 0:
             raise Exception(out.stderr)
         
@@ -441,7 +736,7 @@ class SlurmComputingManager(ComputingManager):
         task.save()
 
 
-    def _get_task_log(self, task, **kwargs):
+    def _get_task_log(self, task, offset=0, tail=None, **kwargs):
         
         # Get user keys
         if task.computing.requires_user_keys:
@@ -453,14 +748,103 @@ class SlurmComputingManager(ComputingManager):
         host = task.computing.get_conf_param('master')
         user = task.computing.get_conf_param('user')
 
-        # View log remotely
-        view_log_command = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} \'/bin/bash -c "cat \$HOME/{}.log"\''.format(user_keys.private_key_file, user, host, task.uuid)
+        # View log remotely (only the new bytes or the tail)
+        view_log_command = '\'/bin/bash -c "{}"\''.format(self._get_log_read_command('$HOME/{}.log'.format(task.uuid), offset, tail))
 
-        out = os_shell(view_log_command, capture=True)
-        if out.exit_code != 0:
-            raise Exception(out.stderr)
+        out = self._get_ssh_connection(task, host, user, user_keys).run(view_log_command)
+        return self._parse_log_read_output(out, offset, tail)
+
+
+    def _follow_task_log(self, task, offset=0, **kwargs):
+
+        # Get user keys
+        if task.computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=task.user, default=True)
         else:
-            return out.stdout
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
+
+        # Get computing host
+        host = task.computing.get_conf_param('master')
+        user = task.computing.get_conf_param('user')
+
+        # Follow log remotely
+        follow_log_command = '\'/bin/bash -c "{}"\''.format(self._get_log_follow_command('$HOME/{}.log'.format(task.uuid), offset))
+        return self._get_ssh_connection(task, host, user, user_keys).stream(follow_log_command)
+
+
+    def _reconcile_tasks(self, tasks, **kwargs):
+
+        # Only tasks with a job id can be checked
+        tasks = [task for task in tasks if task.pid]
+        if not tasks:
+            return {}
+
+        # Use the first task to get the credentials to access the cluster. A single squeue/sacct
+        # query covers all the jobs (of any user) as job states are not private by default.
+        reference_task = tasks[0]
+        computing = reference_task.computing
+        computing.attach_user_conf_data(reference_task.user)
+
+        # Get computing host
+        host = computing.get_conf_param('master')
+        user = computing.get_conf_param('user')
+
+        # Get user keys
+        if computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=reference_task.user, default=True)
+        else:
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
+
+        # Query all the jobs at once. Jobs no longer known to the controller are not listed by
+        # squeue, in which case the accounting (sacct) is used, if available.
+        # squeue lists the job array elements one by one, as sacct does.
+        job_ids = ','.join([self._get_job_id(task) for task in tasks])
+        reconcile_command = '\'squeue -h -r -o "%i %T" -j {}; echo "#$?"; sacct -X -n -P -o JobID,State -j {} 2> /dev/null\''.format(job_ids, job_ids)
+        out = self._get_ssh_connection(reference_task, host, user, user_keys).run(reconcile_command)
+
+        # Parse the output
+        squeue_states = {}
+        sacct_states = {}
+        squeue_exit_code = None
+        for line in out.stdout.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                squeue_exit_code = int(line[1:])
+            elif squeue_exit_code is None:
+                job_id, state = line.split(' ', 1)
+                squeue_states[job_id] = state
+            else:
+                job_id, state = line.split('|', 1)
+                # Example: "CANCELLED by 1000"
+                sacct_states[job_id] = state.split(' ')[0]
+
+        # If squeue failed for other reasons than unknown job ids (i.e. controller down) do not touch anything
+        if squeue_exit_code != 0 and not 'Invalid job id' in out.stderr:
+            raise Exception('Cannot query Slurm job states: "{}"'.format(out.stderr))
+
+        # Compute the new statuses
+        new_statuses = {}
+        for task in tasks:
+            job_id = self._get_job_id(task)
+            state = squeue_states.get(job_id, sacct_states.get(job_id, None))
+
+            if state in SLURM_PENDING_STATES:
+                # I.e. requeued after a preemption
+                status = TaskStatuses.sumbitted
+            elif state in SLURM_ACTIVE_STATES:
+                # Running jobs are set as running by the agent, once it reports the ip and port
+                status = task.status
+            else:
+                # Finished, failed, cancelled, preempted etc. or even no longer known at all
+                status = TaskStatuses.exited
+
+            if status != task.status:
+                logger.debug('Slurm job "{}" for task "{}" is in state "{}", setting status "{}"'.format(job_id, task.uuid, state, status))
+                new_statuses[task.uuid] = status
+
+        return new_statuses
 
 
 
@@ -518,11 +902,11 @@ class RemotehopComputingManager(ComputingManager):
                 else:
                     binds += ',{}'.format(task.extra_binds)
 
-            run_command  = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} '.format(user_keys.private_key_file, first_user, first_host)
-            run_command += '"ssh -4 -o StrictHostKeyChecking=no {}@{} /bin/bash -c \''.format(second_user, second_host)
+            run_command  = '"ssh -4 -o StrictHostKeyChecking=no {}@{} /bin/bash -c \''.format(second_user, second_host)
             
             if use_agent:
-                run_command += '\'wget {}/api/v1/base/agent/?task_uuid={} -O \$HOME/agent_{}.py &> /dev/null && export BASE_PORT=\$(python \$HOME/agent_{}.py 2> \$HOME/{}.log) && '.format(webapp_conn_string, task.uuid, task.uuid, task.uuid, task.uuid)
+                agent_download_command, agent_run_command = self._get_agent_commands(task.uuid, webapp_conn_string)
+                run_command += '\'{} && export BASE_PORT=\$({} 2> \$HOME/{}.log) && '.format(agent_download_command, agent_run_command, task.uuid)
                 if setup_command:
                     run_command += setup_command + ' && '
                 run_command += '\'export SINGULARITY_NOHTTPS=true && export SINGULARITYENV_BASE_PORT=\$BASE_PORT && {} '.format(authstring)
@@ -553,7 +937,7 @@ class RemotehopComputingManager(ComputingManager):
         else:
             raise NotImplementedError('Container {} not supported'.format(task.container.type))
 
-        out = os_shell(run_command, capture=True)
+        out = self._get_ssh_connection(task, first_host, first_user, user_keys).run(run_command)
         if out.exit_code != 0:
             raise Exception(out.stderr)
         
@@ -592,11 +976,10 @@ class RemotehopComputingManager(ComputingManager):
         second_user = task.computing.get_conf_param('second_user')
 
         # Stop the task remotely
-        stop_command  = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} '.format(user_keys.private_key_file, first_user, first_host)
-        stop_command += '"ssh -4 -o StrictHostKeyChecking=no {}@{} '.format(second_user, second_host)
+        stop_command  = '"ssh -4 -o StrictHostKeyChecking=no {}@{} '.format(second_user, second_host)
         stop_command += 'kill -9 {}"'.format(task.pid)
 
-        out = os_shell(stop_command, capture=True)
+        out = self._get_ssh_connection(task, first_host, first_user, user_keys).run(stop_command)
         if out.exit_code != 0:
             if not 'No such process' in out.stderr:
                 raise Exception(out.stderr)
@@ -606,7 +989,7 @@ class RemotehopComputingManager(ComputingManager):
         task.save()
 
 
-    def _get_task_log(self, task, **kwargs):
+    def _get_task_log(self, task, offset=0, tail=None, **kwargs):
         
         # Get user keys
         if task.computing.requires_user_keys:
@@ -620,16 +1003,72 @@ class RemotehopComputingManager(ComputingManager):
         second_host = task.computing.get_conf_param('second_host')
         second_user = task.computing.get_conf_param('second_user')
 
-        # View log remotely
-        view_log_command  = 'ssh -i {} -4 -o StrictHostKeyChecking=no {}@{} '.format(user_keys.private_key_file, first_user, first_host)
-        view_log_command += '"ssh -4 -o StrictHostKeyChecking=no {}@{} '.format(second_user, second_host)
-        view_log_command += 'cat \\\\\\$HOME/{}.log"'.format(task.uuid)
+        # View log remotely (only the new bytes or the tail)
+        view_log_command  = '"ssh -4 -o StrictHostKeyChecking=no {}@{} '.format(second_user, second_host)
+        view_log_command += '\'{}\'"'.format(self._get_log_read_command('$HOME/{}.log'.format(task.uuid), offset, tail))
 
-        out = os_shell(view_log_command, capture=True)
-        if out.exit_code != 0:
-            raise Exception(out.stderr)
+        out = self._get_ssh_connection(task, first_host, first_user, user_keys).run(view_log_command)
+        return self._parse_log_read_output(out, offset, tail)
+
+
+    def _follow_task_log(self, task, offset=0, **kwargs):
+
+        # Get user keys
+        if task.computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=task.user, default=True)
+        else:
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
+
+        # Get computing params
+        first_host = task.computing.get_conf_param('first_host')
+        first_user = task.computing.get_conf_param('first_user')
+        second_host = task.computing.get_conf_param('second_host')
+        second_user = task.computing.get_conf_param('second_user')
+
+        # Follow log remotely
+        follow_log_command  = '"ssh -4 -o StrictHostKeyChecking=no {}@{} '.format(second_user, second_host)
+        follow_log_command += '\'{}\'"'.format(self._get_log_follow_command('$HOME/{}.log'.format(task.uuid), offset))
+        return self._get_ssh_connection(task, first_host, first_user, user_keys).stream(follow_log_command)
+
+
+    def _reconcile_tasks(self, tasks, **kwargs):
+
+        # Only tasks with a pid can be checked
+        tasks = [task for task in tasks if task.pid]
+        if not tasks:
+            return {}
+
+        # Use the first task to get the credentials to access the hosts
+        reference_task = tasks[0]
+        computing = reference_task.computing
+        computing.attach_user_conf_data(reference_task.user)
+
+        # Get user keys
+        if computing.requires_user_keys:
+            user_keys = KeyPair.objects.get(user=reference_task.user, default=True)
         else:
-            return out.stdout
+            raise NotImplementedError('Remote tasks not requiring keys are not yet supported')
+
+        # Get computing params
+        first_host = computing.get_conf_param('first_host')
+        first_user = computing.get_conf_param('first_user')
+        second_host = computing.get_conf_param('second_host')
+        second_user = computing.get_conf_param('second_user')
+
+        # Check all the processes at once (ps exits with 1 if none of them is alive)
+        check_command  = '"ssh -4 -o StrictHostKeyChecking=no {}@{} '.format(second_user, second_host)
+        check_command += 'ps -o pid= -p {}"'.format(','.join([str(task.pid) for task in tasks]))
+        out = self._get_ssh_connection(reference_task, first_host, first_user, user_keys).run(check_command)
+        if out.exit_code not in [0, 1]:
+            raise Exception(out.stderr)
+        alive_pids = [int(pid) for pid in out.stdout.split()]
+
+        new_statuses = {}
+        for task in tasks:
+            if task.pid not in alive_pids:
+                new_statuses[task.uuid] = TaskStatuses.exited
+
+        return new_statuses
 
 
 
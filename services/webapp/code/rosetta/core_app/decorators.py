@@ -2,7 +2,7 @@
 import inspect
 from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from .utils import format_exception, log_user_activity
 from .exceptions import ErrorMessage, ConsistencyException
 
@@ -26,7 +26,7 @@ def public_view(wrapped_view):
             # Try to get the templates from view kwargs
             # Todo: Python3 compatibility: https://stackoverflow.com/questions/2677185/how-can-i-read-a-functions-signature-including-default-argument-values
 
-            argSpec=inspect.getargspec(wrapped_view)
+            argSpec=inspect.getfullargspec(wrapped_view)
 
             if 'template' in argSpec.args:
                 template = argSpec.defaults[0]
@@ -36,7 +36,7 @@ def public_view(wrapped_view):
             # Call wrapped view
             data = wrapped_view(request, *argv, **kwargs)
 
-            if not isinstance(data, HttpResponse):
+            if not isinstance(data, (HttpResponse, StreamingHttpResponse)):
                 if template:
                     #logger.debug('using template + data ("{}","{}")'.format(template,data))
                     return render(request, template, {'data': data})
@@ -86,7 +86,7 @@ def private_view(wrapped_view):
                 # Try to get the templates from view kwargs
                 # Todo: Python3 compatibility: https://stackoverflow.com/questions/2677185/how-can-i-read-a-functions-signature-including-default-argument-values
 
-                argSpec=inspect.getargspec(wrapped_view)
+                argSpec=inspect.getfullargspec(wrapped_view)
 
                 if 'template' in argSpec.args:
                     template = argSpec.defaults[0]
@@ -96,7 +96,7 @@ def private_view(wrapped_view):
                 # Call wrapped view
                 data = wrapped_view(request, *argv, **kwargs)
 
-                if not isinstance(data, HttpResponse):
+                if not isinstance(data, (HttpResponse, StreamingHttpResponse)):
                     if template:
                         #logger.debug('using template + data ("{}","{}")'.format(template,data))
                         return render(request, template, {'data': data})
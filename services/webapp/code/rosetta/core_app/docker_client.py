@@ -0,0 +1,258 @@
+import json
+import socket
+import threading
+import http.client
+from urllib.parse import urlencode, quote
+from django.conf import settings
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DockerAPIError(Exception):
+
+    def __init__(self, message, status_code=None):
+        super(DockerAPIError, self).__init__(message)
+        self.status_code = status_code
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''HTTP connection over a unix socket.'''
+
+    def __init__(self, socket_path, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+
+class DockerClient(object):
+    '''Minimal Docker Engine API client over the unix socket. Each thread keeps its own
+    connection alive, so that sequences of calls (i.e. create, start and inspect) do not
+    pay for a new connection, and much less for a "sudo docker" process, each time.'''
+
+    def __init__(self, socket_path=None, api_version=None, timeout=None):
+        self.socket_path = socket_path if socket_path else settings.DOCKER_SOCKET_PATH
+        self._api_version = api_version if api_version else settings.DOCKER_API_VERSION
+        self.timeout = timeout if timeout else settings.DOCKER_TIMEOUT
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return str('Docker client on "{}" (API v{})'.format(self.socket_path, self._api_version if self._api_version else 'negotiated'))
+
+    @property
+    def api_version(self):
+        # Negotiate the API version with the daemon if not set, once. Daemons accept a range of versions
+        # (old ones get dropped over time), and the one they report as current is always in it.
+        with self.lock:
+            if not self._api_version:
+                status, content = self.request('GET', '/version', versioned=False)
+                if status != 200:
+                    raise DockerAPIError('Cannot get the Docker daemon version: {}'.format(content.decode('utf-8', errors='replace')), status_code=status)
+                self._api_version = json.loads(content.decode('utf-8'))['ApiVersion']
+                logger.debug('Negotiated Docker API version {}'.format(self._api_version))
+            return self._api_version
+
+    @property
+    def connection(self):
+        try:
+            return self.local.connection
+        except AttributeError:
+            self.local.connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+            return self.local.connection
+
+    def close(self):
+        try:
+            self.local.connection.close()
+            del self.local.connection
+        except AttributeError:
+            pass
+
+    def request(self, method, path, params=None, data=None, timeout=None, versioned=True):
+        '''Perform an API request and return the (status, body) tuple, with the body as bytes.'''
+
+        url = '/v{}{}'.format(self.api_version, path) if versioned else path
+        if params:
+            url += '?' + urlencode(params)
+        body = json.dumps(data) if data is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+
+        # Retry once on a fresh connection, as the kept-alive one might have been closed by the daemon
+        for attempt in [1, 2]:
+            connection = self.connection
+            if timeout:
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt == 2:
+                    raise
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                raise DockerAPIError('Cannot talk to the Docker daemon on "{}": {}'.format(self.socket_path, e))
+            finally:
+                if timeout and connection.sock:
+                    connection.sock.settimeout(self.timeout)
+                connection.timeout = self.timeout
+
+        logger.debug('Docker API: {} {} -> {}'.format(method, url, response.status))
+        return response.status, content
+
+    def _json(self, method, path, params=None, data=None, ok_statuses=[200, 201, 204], timeout=None):
+        status, content = self.request(method, path, params=params, data=data, timeout=timeout)
+        if status not in ok_statuses:
+            try:
+                message = json.loads(content.decode('utf-8'))['message']
+            except Exception:
+                message = content.decode('utf-8', errors='replace')
+            raise DockerAPIError(message, status_code=status)
+        return json.loads(content.decode('utf-8')) if content else None
+
+    #-----------------
+    #  Images
+    #-----------------
+
+    def pull_image(self, image):
+        if ':' in image.split('/')[-1]:
+            image, tag = image.rsplit(':', 1)
+        else:
+            tag = 'latest'
+        status, content = self.request('POST', '/images/create', params={'fromImage': image, 'tag': tag}, timeout=max(self.timeout, 3600))
+        if status != 200:
+            raise DockerAPIError(content.decode('utf-8', errors='replace'), status_code=status)
+        # The pull progress is streamed as JSON lines, and errors are reported there as well
+        for line in content.decode('utf-8', errors='replace').split('\n'):
+            if '"error"' in line:
+                raise DockerAPIError(json.loads(line)['error'])
+
+    #-----------------
+    #  Containers
+    #-----------------
+
+    def create_container(self, image, name=None, **config):
+        '''Create a container. Extra config is passed as-is (i.e. Hostname, Env, Tty, HostConfig).'''
+        data = dict(config, Image=image)
+        params = {'name': name} if name else None
+        try:
+            return self._json('POST', '/containers/create', params=params, data=data)['Id']
+        except DockerAPIError as e:
+            if e.status_code != 404:
+                raise
+        # Image not found locally, pull it and retry (as "docker run" does)
+        logger.debug('Pulling image "{}"'.format(image))
+        self.pull_image(image)
+        return self._json('POST', '/containers/create', params=params, data=data)['Id']
+
+    def start_container(self, container_id):
+        # 304 means already started
+        self._json('POST', '/containers/{}/start'.format(quote(container_id)), ok_statuses=[204, 304])
+
+    def inspect_container(self, container_id):
+        return self._json('GET', '/containers/{}/json'.format(quote(container_id)))
+
+    def run_container(self, image, name=None, **config):
+        '''Create, start and inspect a container. Returns the inspect data.'''
+        container_id = self.create_container(image, name=name, **config)
+        self.start_container(container_id)
+        return self.inspect_container(container_id)
+
+    def stop_container(self, container_id, timeout=10):
+        # 304 means already stopped
+        self._json('POST', '/containers/{}/stop'.format(quote(container_id)), params={'t': timeout},
+                   ok_statuses=[204, 304], timeout=self.timeout + timeout)
+
+    def remove_container(self, container_id, force=False):
+        self._json('DELETE', '/containers/{}'.format(quote(container_id)), params={'force': int(force)})
+
+    def list_containers(self, ids=None, all=True):
+        '''List containers, optionally only the given ones, in a single call.'''
+        params = {'all': int(all)}
+        if ids is not None:
+            params['filters'] = json.dumps({'id': list(ids)})
+        return self._json('GET', '/containers/json', params=params)
+
+    def follow_container_logs(self, container_id, tail=0):
+        '''Follow the logs of a container, from its last "tail" lines. Returns a stream to be read
+        line by line and then closed. Uses its own connection, as it stays open.'''
+        connection = UnixHTTPConnection(self.socket_path, timeout=None)
+        params = {'stdout': 1, 'stderr': 1, 'follow': 1, 'tail': tail}
+        try:
+            connection.request('GET', '/v{}/containers/{}/logs?{}'.format(self.api_version, quote(container_id), urlencode(params)))
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise DockerAPIError('Cannot talk to the Docker daemon on "{}": {}'.format(self.socket_path, e))
+        if response.status != 200:
+            content = response.read()
+            connection.close()
+            raise DockerAPIError(content.decode('utf-8', errors='replace'), status_code=response.status)
+        return DockerLogStream(connection, response)
+
+    def container_logs(self, container_id, tail=None):
+        params = {'stdout': 1, 'stderr': 1}
+        if tail:
+            params['tail'] = tail
+        status, content = self.request('GET', '/containers/{}/logs'.format(quote(container_id)), params=params)
+        if status != 200:
+            raise DockerAPIError(content.decode('utf-8', errors='replace'), status_code=status)
+        return demultiplex_stream(content).decode('utf-8', errors='replace')
+
+
+
+class DockerLogStream(object):
+    '''Followed logs of a container (using a TTY, so not multiplexed), to be read line by line and then closed.'''
+
+    def __init__(self, connection, response):
+        self.connection = connection
+        self.response = response
+
+    def readline(self):
+        try:
+            return self.response.readline()
+        except (OSError, ValueError, http.client.HTTPException):
+            # Closed in the meantime
+            return b''
+
+    def close(self):
+        # Shut the socket down first, which also unblocks any pending readline
+        try:
+            self.connection.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        self.connection.close()
+
+
+
+def demultiplex_stream(content):
+    '''Strip the stream headers from the logs of containers not using a TTY, where stdout and
+    stderr are multiplexed in frames with an 8 bytes header (stream type, 0, 0, 0, size).'''
+    output = bytearray()
+    position = 0
+    while position + 8 <= len(content):
+        header = content[position:position+8]
+        if header[0] not in [0, 1, 2] or header[1:4] != b'\x00\x00\x00':
+            # Not multiplexed (TTY)
+            return bytes(content)
+        size = int.from_bytes(header[4:8], 'big')
+        output.extend(content[position+8:position+8+size])
+        position += 8 + size
+    if position != len(content):
+        return bytes(content)
+    return bytes(output)
+
+
+# Client instance (per process)
+docker_client = DockerClient()
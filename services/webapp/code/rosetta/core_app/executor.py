@@ -0,0 +1,267 @@
+import os
+import time
+import signal
+import asyncio
+import selectors
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CommandResult(object):
+    '''Result of a command execution. Compatible with the os_shell output (stdout, stderr, exit_code).'''
+
+    def __init__(self, command, host=None, stdout='', stderr='', exit_code=None, timed_out=False, cancelled=False,
+                 stdout_truncated=False, stderr_truncated=False, duration=None):
+        self.command = command
+        self.host = host
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+        self.stdout_truncated = stdout_truncated
+        self.stderr_truncated = stderr_truncated
+        self.duration = duration
+
+    def __str__(self):
+        return str('CommandResult(stdout="{}", stderr="{}", exit_code={}, timed_out={}, cancelled={}, duration={:.3f}s)'.format(self.stdout, self.stderr, self.exit_code, self.timed_out, self.cancelled, self.duration if self.duration else 0))
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+
+
+class CommandHandle(object):
+    '''Handle to a submitted command. Can be waited on (result), awaited (asyncio) or cancelled.'''
+
+    def __init__(self, command, host=None, semaphore=None):
+        self.command = command
+        self.host = host
+        self.semaphore = semaphore
+        self.future = None
+        self.process = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        '''Cancel the command: if not yet started it will never run, otherwise its process group gets killed.'''
+        with self.lock:
+            self.cancelled = True
+            if self.future and self.future.cancel():
+                return True
+            if self.process and self.process.poll() is None:
+                _kill_process_group(self.process)
+        return True
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+
+
+class CommandStream(object):
+    '''Output stream of a long-running command (i.e. "tail -F"), to be read line by line and then closed.
+    The (already acquired) semaphores limiting it, if any, are held until it gets closed.'''
+
+    def __init__(self, command, host=None, semaphores=[]):
+        self.command = command
+        self.host = host
+        self.semaphores = list(semaphores)
+        self.lock = threading.Lock()
+        # Stdin is kept open (and never written) until closing, so that the command can tell when it is over
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        stdin=subprocess.PIPE, shell=True, start_new_session=True)
+
+    def readline(self):
+        return self.process.stdout.readline()
+
+    def close(self):
+        # Kill the whole process group, which also unblocks any pending readline
+        if self.process.poll() is None:
+            _kill_process_group(self.process)
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        # Release the semaphores, once
+        with self.lock:
+            semaphores, self.semaphores = self.semaphores, []
+        for semaphore in semaphores:
+            semaphore.release()
+
+
+
+class _NoSemaphore(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, *args):
+        pass
+
+_no_semaphore = _NoSemaphore()
+
+
+def _kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+
+class CommandExecutor(object):
+    '''Execute shell commands with timeouts, cancellation, capped output capture and a bounded
+    concurrency per target host (commands with no target host are local, and not limited). Commands
+    can be run blocking (run) or submitted to a worker pool (submit), in which case the returned
+    handle can also be awaited.'''
+
+    def __init__(self, max_workers=None, max_per_host=None, default_timeout=None, max_output_bytes=None):
+        self.max_workers = max_workers if max_workers else settings.EXECUTOR_MAX_WORKERS
+        self.max_per_host = max_per_host if max_per_host else settings.EXECUTOR_MAX_PER_HOST
+        self.default_timeout = default_timeout if default_timeout else settings.EXECUTOR_DEFAULT_TIMEOUT
+        self.max_output_bytes = max_output_bytes if max_output_bytes else settings.EXECUTOR_MAX_OUTPUT_BYTES
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def pool(self):
+        # Create the worker pool lazily, so that processes which never submit do not spawn threads
+        with self.lock:
+            if not self._pool:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='executor')
+            return self._pool
+
+    def get_host_semaphore(self, host):
+        with self.lock:
+            try:
+                return self.host_semaphores[host]
+            except KeyError:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+                return self.host_semaphores[host]
+
+    def run(self, command, host=None, timeout=None, max_output_bytes=None, semaphore=None):
+        '''Run a command and wait for its result. An extra semaphore (i.e. for the sessions
+        over an SSH connection) can be given to further limit concurrency.'''
+        return self._execute(CommandHandle(command, host, semaphore), timeout, max_output_bytes)
+
+    def submit(self, command, host=None, timeout=None, max_output_bytes=None, semaphore=None):
+        '''Submit a command to the worker pool and return its handle.'''
+        handle = CommandHandle(command, host, semaphore)
+        handle.future = self.pool.submit(self._execute, handle, timeout, max_output_bytes)
+        return handle
+
+    def stream(self, command, host=None, semaphores=[], wait_timeout=10):
+        '''Start a long-running command and return its output stream. Streams are not subject
+        to timeouts nor to the per-host limits, as they are meant to stay open, but they can be
+        given semaphores (i.e. for the sessions over an SSH connection) to be held while open.
+        If these cannot be acquired within the wait timeout the stream is not started.'''
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                if not semaphore.acquire(timeout=wait_timeout):
+                    raise Exception('Too many concurrent sessions to start streaming command "{}"'.format(command))
+                acquired.append(semaphore)
+            logger.debug('Streaming command on host "{}": "{}"'.format(host, command))
+            return CommandStream(command, host, semaphores=acquired)
+        except:
+            for semaphore in acquired:
+                semaphore.release()
+            raise
+
+    def _execute(self, handle, timeout=None, max_output_bytes=None):
+
+        timeout = timeout if timeout else self.default_timeout
+        max_output_bytes = max_output_bytes if max_output_bytes else self.max_output_bytes
+
+        # Apply the extra concurrency limit first if any (i.e. for the sessions over an SSH connection, which is the
+        # narrower one), so that commands waiting on it do not hold the slots of the host, then the per-host one.
+        host_semaphore = self.get_host_semaphore(handle.host) if handle.host else _no_semaphore
+
+        with (handle.semaphore if handle.semaphore else _no_semaphore), host_semaphore:
+
+            # Log command
+            logger.debug('Executing command on host "{}": "{}"'.format(handle.host, handle.command))
+
+            start_t = time.time()
+
+            with handle.lock:
+                if handle.cancelled:
+                    return CommandResult(handle.command, handle.host, stderr='Command cancelled', cancelled=True, duration=0)
+
+                # Start the process in its own process group, so that we can kill all of its children
+                handle.process = subprocess.Popen(handle.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                  shell=True, start_new_session=True)
+            process = handle.process
+
+            # Read stdout and stderr as they come, keeping at most max_output_bytes for each
+            outputs = {process.stdout: bytearray(), process.stderr: bytearray()}
+            truncated = {process.stdout: False, process.stderr: False}
+            timed_out = False
+
+            with selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ)
+                selector.register(process.stderr, selectors.EVENT_READ)
+
+                while selector.get_map():
+                    remaining = timeout - (time.time() - start_t)
+                    if remaining <= 0:
+                        timed_out = True
+                        _kill_process_group(process)
+                        break
+                    for key, _ in selector.select(timeout=remaining):
+                        chunk = os.read(key.fd, 65536)
+                        if not chunk:
+                            selector.unregister(key.fileobj)
+                            continue
+                        buffer = outputs[key.fileobj]
+                        free = max_output_bytes - len(buffer)
+                        if free > 0:
+                            buffer.extend(chunk[:free])
+                        if len(chunk) > free:
+                            truncated[key.fileobj] = True
+
+            process.stdout.close()
+            process.stderr.close()
+            exit_code = process.wait()
+
+            # Convert to str (Python 3)
+            stdout = outputs[process.stdout].decode(encoding='UTF-8', errors='replace')
+            stderr = outputs[process.stderr].decode(encoding='UTF-8', errors='replace')
+
+            # Formatting..
+            stdout = stdout[:-1] if (stdout and stdout[-1] == '\n') else stdout
+            stderr = stderr[:-1] if (stderr and stderr[-1] == '\n') else stderr
+
+            if timed_out:
+                stderr += '\nCommand timed out after {}s'.format(timeout) if stderr else 'Command timed out after {}s'.format(timeout)
+            elif handle.cancelled:
+                stderr += '\nCommand cancelled' if stderr else 'Command cancelled'
+
+            return CommandResult(command = handle.command,
+                                 host = handle.host,
+                                 stdout = stdout,
+                                 stderr = stderr,
+                                 exit_code = exit_code,
+                                 timed_out = timed_out,
+                                 cancelled = handle.cancelled,
+                                 stdout_truncated = truncated[process.stdout],
+                                 stderr_truncated = truncated[process.stderr],
+                                 duration = time.time() - start_t)
+
+
+# Executor instance (per process)
+executor = CommandExecutor()
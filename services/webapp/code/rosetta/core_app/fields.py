@@ -1,13 +1,81 @@
 import json
-from django.db.models import Field
+from django.db.models import Field, Transform
+from django.db.models.query_utils import DeferredAttribute
+
+
+class JSONText(str):
+    '''JSON as loaded from the database, not decoded yet.'''
+    pass
+
+
+class LazyJSONAttribute(DeferredAttribute):
+    '''Model attribute for a JSONField, decoding its value only on first access (and just once).'''
+
+    def __init__(self, field):
+        super(LazyJSONAttribute, self).__init__(field.attname)
+        self.field = field
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super(LazyJSONAttribute, self).__get__(instance, cls)
+        if isinstance(value, JSONText):
+            value = self.field.to_python(value)
+            instance.__dict__[self.field_name] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field_name] = value
+
+
+class KeyTransform(Transform):
+    '''Value of a key of a JSON object, extracted on the database side by SQLite's JSON1
+    extension (i.e. "computing_options__partition"). Can be chained for nested keys.'''
+
+    output_field = Field()
+
+    def __init__(self, key_name, *args, **kwargs):
+        super(KeyTransform, self).__init__(*args, **kwargs)
+        self.key_name = str(key_name)
+
+    def as_sql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        if self.key_name.isdigit():
+            path = '$[{}]'.format(self.key_name)
+        else:
+            path = '$."{}"'.format(self.key_name.replace('"', '\\"'))
+        return 'json_extract({}, %s)'.format(lhs), list(params) + [path]
+
+    def get_transform(self, name):
+        transform = super(KeyTransform, self).get_transform(name)
+        return transform if transform else KeyTransformFactory(name)
+
+
+class KeyTransformFactory(object):
+
+    def __init__(self, key_name):
+        self.key_name = key_name
+
+    def __call__(self, *args, **kwargs):
+        return KeyTransform(self.key_name, *args, **kwargs)
+
 
 class JSONField(Field):
+    '''JSON field for SQLite, stored through the JSON1 extension (which validates and minifies it) and
+    supporting key lookups as the Postgres one. Values are decoded lazily, on first attribute access,
+    so that rows loaded and never looking at the field do not pay for it. Note that values() and
+    values_list() return the undecoded JSON (as JSONText), better to load model instances instead.'''
+
     def db_type(self, connection):
         return 'text'
 
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(JSONField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, LazyJSONAttribute(self))
+
     def from_db_value(self, value, expression, connection):
-        if value is not None:
-            return self.to_python(value)
+        if isinstance(value, str):
+            return JSONText(value)
         return value
 
     def to_python(self, value):
@@ -18,12 +86,29 @@ class JSONField(Field):
                 return value
         return value
 
+    def pre_save(self, model_instance, add):
+        # Values never accessed are saved as they are, without decoding them
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super(JSONField, self).pre_save(model_instance, add)
+
     def get_prep_value(self, value):
+        if isinstance(value, JSONText):
+            return str(value)
         if value is not None:
             return str(json.dumps(value))
         return value
 
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor == 'sqlite':
+            return 'json(%s)'
+        return '%s'
+
+    def get_transform(self, name):
+        transform = super(JSONField, self).get_transform(name)
+        return transform if transform else KeyTransformFactory(name)
+
     def value_to_string(self, obj):
         return self.value_from_object(obj)
 
-# Credits: https://medium.com/@philamersune/using-postgresql-jsonfield-in-sqlite-95ad4ad2e5f1
\ No newline at end of file
+# Credits: https://medium.com/@philamersune/using-postgresql-jsonfield-in-sqlite-95ad4ad2e5f1
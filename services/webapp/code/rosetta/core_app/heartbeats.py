@@ -0,0 +1,80 @@
+import atexit
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import Task, TaskStatuses
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatBuffer(object):
+    '''Heartbeats received from the task agents, kept in memory and written to the database in batches
+    (a single query per flush) every flush interval, by a timer thread, or as soon as there are too many.'''
+
+    def __init__(self, flush_interval=None, max_size=None):
+        self.flush_interval = flush_interval if flush_interval else settings.TASK_HEARTBEAT_FLUSH_INTERVAL
+        self.max_size = max_size if max_size else settings.TASK_HEARTBEAT_FLUSH_MAX_SIZE
+        self.heartbeats = {}
+        self.lock = threading.Lock()
+        self.timer = None
+        self.stopped = threading.Event()
+
+    def add(self, task_uuid, load=None, mem=None):
+        '''Add the heartbeat of a task (replacing the one buffered for it, if any), flushing if too many.'''
+        with self.lock:
+            self.heartbeats[task_uuid] = (timezone.now(), load, mem)
+            flush_due = len(self.heartbeats) >= self.max_size
+
+            # Start the timer on the first heartbeat (processes which never get any do not need it)
+            if not self.timer:
+                self.timer = threading.Thread(target=self.run_timer, name='heartbeats_flush', daemon=True)
+                self.timer.start()
+
+        if flush_due:
+            self.flush()
+
+    def run_timer(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Error in flushing the heartbeats: "{}"'.format(e))
+            finally:
+                # Database connections are per thread
+                connection.close()
+
+    def flush(self):
+        '''Write the buffered heartbeats to the database. Returns how many were written.'''
+        with self.lock:
+            heartbeats, self.heartbeats = self.heartbeats, {}
+        if not heartbeats:
+            return 0
+        tasks = [Task(uuid=task_uuid, last_heartbeat=heartbeat_dt, heartbeat_load=load, heartbeat_mem=mem)
+                 for task_uuid, (heartbeat_dt, load, mem) in heartbeats.items()]
+        # Only for the running tasks (heartbeats of unknown or terminated tasks are just dropped)
+        Task.objects.filter(status=TaskStatuses.running).bulk_update(tasks, ['last_heartbeat', 'heartbeat_load', 'heartbeat_mem'])
+        logger.debug('Flushed {} heartbeats'.format(len(tasks)))
+        return len(tasks)
+
+
+def get_heartbeat_cutoff(timeout=None):
+    '''Get the time before which the last heartbeat of a task is too old to tell if it is still running.'''
+    timeout = timeout if timeout else settings.TASK_HEARTBEAT_TIMEOUT
+    return timezone.now() - timedelta(seconds=timeout)
+
+
+# Heartbeats buffer of this process
+heartbeat_buffer = HeartbeatBuffer()
+
+
+def _flush_on_exit():
+    try:
+        heartbeat_buffer.flush()
+    except Exception as e:
+        logger.error('Error in flushing the heartbeats on exit: "{}"'.format(e))
+
+atexit.register(_flush_on_exit)
@@ -0,0 +1,202 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q, Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Task, TaskStatuses, TaskLaunch, TaskLaunchStatuses
+from .computing_confs import attach_tasks_user_conf_data
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def enqueue_task_launch(task):
+    '''Queue the launch of a task, to be executed by the launcher workers.'''
+    return TaskLaunch.objects.create(task=task, computing=task.computing)
+
+
+def enqueue_task_launches(tasks):
+    '''Queue the launch of a set of identical tasks on the same computing. If its computing manager
+    supports it (i.e. with Slurm job arrays) they are launched all at once, otherwise one by one.'''
+    batch = uuid.uuid4() if hasattr(tasks[0].computing.manager, '_start_tasks') else None
+    return [TaskLaunch.objects.create(task=task, computing=task.computing, batch=batch) for task in tasks]
+
+
+def cancel_task_launch(task):
+    '''Cancel the launch of a task, if not started yet. Returns True if cancelled.'''
+    return TaskLaunch.objects.filter(task=task, status=TaskLaunchStatuses.queued).delete()[0] > 0
+
+
+
+class TaskLauncher(object):
+    '''Pool of workers executing the queued task launches, with a limit on the concurrent launches
+    per computing (across all the launchers) and retries with exponential backoff on failures.
+    Launches of the same batch are claimed and executed together, and count as a single one.'''
+
+    def __init__(self, workers=None, max_per_computing=None, max_attempts=None, retry_delay=None, timeout=None):
+        self.workers = workers if workers else settings.TASK_LAUNCH_WORKERS
+        self.max_per_computing = max_per_computing if max_per_computing else settings.TASK_LAUNCH_MAX_PER_COMPUTING
+        self.max_attempts = max_attempts if max_attempts else settings.TASK_LAUNCH_MAX_ATTEMPTS
+        self.retry_delay = retry_delay if retry_delay else settings.TASK_LAUNCH_RETRY_DELAY
+        self.timeout = timeout if timeout else settings.TASK_LAUNCH_TIMEOUT
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.running = set()
+        self.lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def pool(self):
+        if not self._pool:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='launcher')
+        return self._pool
+
+    def requeue_stale(self):
+        '''Put back in the queue the launches whose worker died (the task was not started). The ones
+        still being executed by this launcher are not, however long they are taking.'''
+        with self.lock:
+            running_keys = list(self.running)
+        stale_launches = (TaskLaunch.objects.filter(status=TaskLaunchStatuses.running,
+                                                    started__lt=timezone.now() - timedelta(seconds=self.timeout),
+                                                    task__status=TaskStatuses.created)
+                          .exclude(Q(worker=self.name) & (Q(uuid__in=running_keys) | Q(batch__in=running_keys))))
+        requeued_count = stale_launches.update(status=TaskLaunchStatuses.queued, worker=None)
+        if requeued_count:
+            logger.warning('Requeued {} stale task launches'.format(requeued_count))
+        return requeued_count
+
+    def claim(self):
+        '''Claim as many launches (or batches of) as the free workers, within the per-computing limits.'''
+
+        with self.lock:
+            free_workers = self.workers - len(self.running)
+        if free_workers <= 0:
+            return []
+
+        # Launches (or batches of) running on each computing, by any launcher
+        running_per_computing = dict(TaskLaunch.objects.filter(status=TaskLaunchStatuses.running)
+                                     .values_list('computing').annotate(running_count=Count(Coalesce('batch', 'uuid'), distinct=True)).order_by())
+
+        claimed_launches = []
+        claimed_count = 0
+        queued_launches = (TaskLaunch.objects.filter(status=TaskLaunchStatuses.queued, next_attempt_at__lte=timezone.now())
+                           .select_related('task', 'task__user', 'task__container', 'computing'))
+
+        for launch in queued_launches[:free_workers*10]:
+            if running_per_computing.get(launch.computing_id, 0) >= self.max_per_computing:
+                continue
+
+            # Claim it (or its whole batch), unless someone else did it in the meantime
+            now = timezone.now()
+            if launch.batch:
+                if not TaskLaunch.objects.filter(batch=launch.batch, status=TaskLaunchStatuses.queued).update(status=TaskLaunchStatuses.running,
+                                                                                                            worker=self.name, started=now,
+                                                                                                            attempts=F('attempts')+1):
+                    continue
+                claimed_launches.extend(TaskLaunch.objects.filter(batch=launch.batch, status=TaskLaunchStatuses.running, worker=self.name, started=now)
+                                        .select_related('task', 'task__user', 'task__container', 'computing'))
+            else:
+                if not TaskLaunch.objects.filter(uuid=launch.uuid, status=TaskLaunchStatuses.queued).update(status=TaskLaunchStatuses.running,
+                                                                                                            worker=self.name, started=now,
+                                                                                                            attempts=F('attempts')+1):
+                    continue
+                launch.status = TaskLaunchStatuses.running
+                launch.attempts += 1
+                claimed_launches.append(launch)
+            running_per_computing[launch.computing_id] = running_per_computing.get(launch.computing_id, 0) + 1
+            claimed_count += 1
+            if claimed_count >= free_workers:
+                break
+
+        # Load the user confs all at once (the workers then get them from the cache)
+        attach_tasks_user_conf_data([launch.task for launch in claimed_launches])
+
+        return claimed_launches
+
+    def execute(self, launch):
+        '''Execute a (claimed) launch, i.e. start its task.'''
+        self.execute_batch([launch])
+
+    def execute_batch(self, launches):
+        '''Execute a batch of (claimed) launches, i.e. start their tasks all at once.'''
+
+        # Skip the tasks not to be started anymore, i.e. already started by a stale launch which got requeued
+        created_uuids = set(Task.objects.filter(uuid__in=[launch.task_id for launch in launches], status=TaskStatuses.created)
+                            .values_list('uuid', flat=True))
+        skipped_uuids = [launch.uuid for launch in launches if launch.task_id not in created_uuids]
+        if skipped_uuids:
+            logger.warning('Skipping {} task launches, as their tasks are not to be started anymore'.format(len(skipped_uuids)))
+            TaskLaunch.objects.filter(uuid__in=skipped_uuids).update(status=TaskLaunchStatuses.done, error=None)
+            launches = [launch for launch in launches if launch.task_id in created_uuids]
+            if not launches:
+                return
+
+        tasks = [launch.task for launch in launches]
+        attempts = launches[0].attempts
+        launch_uuids = [launch.uuid for launch in launches]
+        if len(tasks) == 1:
+            tasks_str = 'task "{}"'.format(tasks[0])
+        else:
+            tasks_str = '{} tasks of batch "{}"'.format(len(tasks), launches[0].batch)
+        try:
+            logger.debug('Launching {} (attempt {})'.format(tasks_str, attempts))
+            for task in tasks:
+                task.computing.attach_user_conf_data(task.user)
+            tasks[0].computing.manager.start_tasks(tasks)
+
+        except Exception as e:
+            if attempts < self.max_attempts:
+                retry_delay = self.retry_delay * 2**(attempts-1)
+                logger.warning('Error in launching {}, retrying in {}s: "{}"'.format(tasks_str, retry_delay, e))
+                TaskLaunch.objects.filter(uuid__in=launch_uuids).update(status=TaskLaunchStatuses.queued, worker=None, error=str(e),
+                                                                        next_attempt_at=timezone.now() + timedelta(seconds=retry_delay))
+            else:
+                logger.error('Error in launching {}, giving up after {} attempts: "{}"'.format(tasks_str, attempts, e))
+                TaskLaunch.objects.filter(uuid__in=launch_uuids).update(status=TaskLaunchStatuses.failed, error=str(e))
+                Task.objects.filter(uuid__in=[task.uuid for task in tasks], status=TaskStatuses.created).update(status=TaskStatuses.exited)
+        else:
+            TaskLaunch.objects.filter(uuid__in=launch_uuids).update(status=TaskLaunchStatuses.done, error=None)
+
+    def _run(self, key, launches):
+        try:
+            self.execute_batch(launches)
+        except Exception as e:
+            logger.error('Error in executing launch "{}": "{}"'.format(key, e))
+        finally:
+            with self.lock:
+                self.running.discard(key)
+            # Database connections are per thread
+            connection.close()
+
+    def process(self):
+        '''Claim the launches which can run and submit them (by batch) to the workers. Returns how many.'''
+        claimed_launches = self.claim()
+        launches_by_key = OrderedDict()
+        for launch in claimed_launches:
+            launches_by_key.setdefault(launch.batch or launch.uuid, []).append(launch)
+        for key, launches in launches_by_key.items():
+            with self.lock:
+                self.running.add(key)
+            self.pool.submit(self._run, key, launches)
+        return len(claimed_launches)
+
+    def run_forever(self, poll_interval=None):
+        poll_interval = poll_interval if poll_interval else settings.TASK_LAUNCH_POLL_INTERVAL
+        last_requeue_t = 0
+        while True:
+            try:
+                if time.time() - last_requeue_t > self.timeout:
+                    self.requeue_stale()
+                    last_requeue_t = time.time()
+                self.process()
+            except Exception as e:
+                logger.error('Error in processing the task launch queue: "{}"'.format(e))
+            time.sleep(poll_interval)
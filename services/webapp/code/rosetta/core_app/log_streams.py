@@ -0,0 +1,205 @@
+import re
+import queue
+import threading
+from django.conf import settings
+from .task_logs import get_task_log
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Conf
+SUBSCRIPTION_QUEUE_SIZE = 10000
+KEEPALIVE_INTERVAL = 15
+
+
+class TaskLogSubscription(object):
+    '''Subscription of a viewer to a task log stream. Starts with the backlog (the last part of the
+    log) and then gets the new lines as they come, until the stream or the subscription ends.'''
+
+    def __init__(self, stream, backlog):
+        self.stream = stream
+        self.backlog = backlog
+        self.queue = queue.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        self.ended = False
+
+    def get(self, timeout=None):
+        '''Get the next line, or None if no lines came within the timeout or if the subscription ended.'''
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def end(self):
+        self.ended = True
+        try:
+            # Wake up the viewer
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def close(self):
+        self.stream.unsubscribe(self)
+
+
+
+class TaskLogStream(object):
+    '''A single upstream reader of a task log, fanning out the new lines to all of its subscribers.
+    The upstream is closed as soon as the last subscriber leaves.'''
+
+    def __init__(self, task, on_close=None):
+        self.task_uuid = task.uuid
+        self.on_close = on_close
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.closed = False
+
+        # Start from the (cached) last part of the log, and follow it from there
+        self.backlog, offset = get_task_log(task)
+        self.upstream = task.computing.manager.follow_task_log(task, offset=offset)
+        logger.debug('Started log stream for task "{}" from offset {}'.format(self.task_uuid, offset))
+
+        self.thread = threading.Thread(target=self.run, name='log_stream_{}'.format(self.task_uuid), daemon=True)
+        self.thread.start()
+
+    def subscribe(self):
+        '''Subscribe to the stream. Returns None if the stream is already closed.'''
+        with self.lock:
+            if self.closed:
+                return None
+            subscription = TaskLogSubscription(self, self.backlog)
+            self.subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+            if self.subscriptions:
+                return
+        self.close()
+
+    def run(self):
+        try:
+            while True:
+                line = self.upstream.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', errors='replace')
+                with self.lock:
+                    # Keep the backlog up to date for the next subscribers, within limits
+                    self.backlog = (self.backlog + line)[-settings.TASK_LOG_CACHE_MAX_BYTES:]
+                    for subscription in list(self.subscriptions):
+                        try:
+                            subscription.queue.put_nowait(line)
+                        except queue.Full:
+                            # Too slow a viewer, drop it
+                            self.subscriptions.discard(subscription)
+                            subscription.end()
+        except Exception as e:
+            logger.error('Error in reading log stream for task "{}": "{}"'.format(self.task_uuid, e))
+        finally:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            subscriptions = list(self.subscriptions)
+            self.subscriptions = set()
+        logger.debug('Closing log stream for task "{}"'.format(self.task_uuid))
+        self.upstream.close()
+        for subscription in subscriptions:
+            subscription.end()
+        if self.on_close:
+            self.on_close(self)
+
+
+
+class TaskLogStreams(object):
+    '''Registry of the task log streams, one per task. Streams are started outside of the registry lock,
+    as it takes calls to the computing resources: in the meantime their task gets a placeholder (an
+    event, set once done) for the other viewers of the same task to wait on.'''
+
+    def __init__(self):
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, task):
+        '''Subscribe to the log stream of a task, starting it if not already running.'''
+        while True:
+            with self.lock:
+                stream = self.streams.get(task.uuid, None)
+                if not stream:
+                    started = threading.Event()
+                    self.streams[task.uuid] = started
+                    break
+
+            if isinstance(stream, threading.Event):
+                # Being started by another viewer: wait for it, then try again
+                stream.wait()
+                continue
+
+            subscription = stream.subscribe()
+            if subscription:
+                return subscription
+
+            # Closed in the meantime, replace it
+            with self.lock:
+                if self.streams.get(task.uuid, None) is stream:
+                    del self.streams[task.uuid]
+
+        try:
+            stream = TaskLogStream(task, on_close=self._remove)
+            with self.lock:
+                self.streams[task.uuid] = stream
+        except:
+            with self.lock:
+                del self.streams[task.uuid]
+            raise
+        finally:
+            started.set()
+
+        subscription = stream.subscribe()
+        if not subscription:
+            # The log cannot be followed (anymore), just serve the backlog
+            subscription = TaskLogSubscription(stream, stream.backlog)
+            subscription.end()
+        return subscription
+
+    def _remove(self, stream):
+        with self.lock:
+            if self.streams.get(stream.task_uuid, None) is stream:
+                del self.streams[stream.task_uuid]
+
+
+
+def format_event(data, event=None):
+    '''Format a server-sent event (each line of data goes in a "data" field).'''
+    message = 'event: {}\n'.format(event) if event else ''
+    for line in re.split('\r\n|\r|\n', data):
+        message += 'data: {}\n'.format(line)
+    return message + '\n'
+
+
+def stream_events(subscription):
+    '''Generate the server-sent events for a subscription: a "backlog" event with the log so
+    far, then a "message" for each new line and finally an "end" event if the stream ends.'''
+    try:
+        yield format_event(subscription.backlog, event='backlog')
+        while True:
+            line = subscription.get(timeout=KEEPALIVE_INTERVAL)
+            if line is None:
+                if subscription.ended:
+                    yield format_event('', event='end')
+                    return
+                # Comments keep the connection alive, and let us know if the viewer went away
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(line[:-1] if line.endswith('\n') else line)
+    finally:
+        subscription.close()
+
+
+# Streams registry (per process)
+task_log_streams = TaskLogStreams()
@@ -0,0 +1,31 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...archiver import archive_tasks
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Moves the terminal tasks older than a given age to the task history table, periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.TASK_ARCHIVE_INTERVAL, help='Seconds between archivals')
+        parser.add_argument('--age', type=int, default=settings.TASK_ARCHIVE_AGE, help='Days after which terminal tasks are archived')
+        parser.add_argument('--once', action='store_true', help='Archive only once and exit')
+
+    def handle(self, *args, **options):
+
+        while True:
+            start_t = time.time()
+            try:
+                archived_count = archive_tasks(max_age=options['age'])
+                logger.info('Archived {} tasks in {:.2f}s'.format(archived_count, time.time()-start_t))
+            except Exception as e:
+                logger.error('Error in archiving tasks: "{}"'.format(e))
+
+            if options['once']:
+                break
+
+            time.sleep(max(0, options['interval'] - (time.time()-start_t)))
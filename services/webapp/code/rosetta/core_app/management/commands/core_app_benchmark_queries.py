@@ -0,0 +1,99 @@
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from ...models import Profile, LoginToken, KeyPair, Task, TaskStatuses, Container, Computing, TunnelPort
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the hot-path queries (with their query plans) on generated data, which is rolled back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=100000, help='Number of tasks to generate')
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to generate (the tasks are spread across them)')
+        parser.add_argument('--repeat', type=int, default=100, help='Number of times each query is run')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options['tasks'], options['users'])
+                self.benchmark(options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def populate(self, tasks_count, users_count):
+        start_t = time.time()
+        users = User.objects.bulk_create([User(username='benchmark_user_{}'.format(i)) for i in range(users_count)])
+        users = list(User.objects.filter(username__startswith='benchmark_user_'))
+        Profile.objects.bulk_create([Profile(user=user, authtoken=str(uuid.uuid4())) for user in users])
+        LoginToken.objects.bulk_create([LoginToken(user=user, token=str(uuid.uuid4())) for user in users])
+        KeyPair.objects.bulk_create([KeyPair(user=user, private_key_file='/dev/null', public_key_file='/dev/null', default=default)
+                                     for user in users for default in [False, True]])
+        container = Container.objects.create(name='BenchmarkContainer', image='benchmark', type='docker', registry='docker_hub')
+        computing = Computing.objects.create(name='BenchmarkComputing', type='local')
+
+        now = timezone.now()
+        statuses = [TaskStatuses.exited]*8 + [TaskStatuses.stopped, TaskStatuses.running]
+        for batch_start in range(0, tasks_count, 10000):
+            tasks = []
+            tunnel_ports = []
+            for i in range(batch_start, min(batch_start+10000, tasks_count)):
+                task_uuid = uuid.uuid4()
+                status = statuses[i % len(statuses)]
+                tunnel_port = 7000 + i if status == TaskStatuses.running else None
+                task = Task(uuid=task_uuid, short_id=str(task_uuid), user=users[i % users_count], name='task{}'.format(i),
+                            status=status, created=now-timedelta(minutes=i), computing=computing, container=container,
+                            tunnel_port=tunnel_port)
+                tasks.append(task)
+                if tunnel_port:
+                    tunnel_ports.append(TunnelPort(port=tunnel_port, task=task))
+            Task.objects.bulk_create(tasks)
+            TunnelPort.objects.bulk_create(tunnel_ports)
+        self.stdout.write('Generated {} tasks for {} users in {:.1f}s\n'.format(tasks_count, users_count, time.time()-start_t))
+
+    def benchmark(self, repeat):
+        user = User.objects.filter(username__startswith='benchmark_user_').order_by('username').last()
+        profile = Profile.objects.get(user=user)
+        login_token = LoginToken.objects.get(user=user)
+        task = Task.objects.filter(user=user).first()
+
+        # The tasks list as the view gets it, a page at a time with keyset pagination (see "paginate_by_keyset"),
+        # filtered by status or not. The second page starts after a task some way down the list.
+        page_size = settings.TASKS_PAGE_SIZE
+        cursor_task = Task.objects.filter(user=user).order_by('-created', '-uuid')[page_size-1]
+        def tasks_page(after=None, **filters):
+            tasks = Task.objects.filter(user=user, **filters).select_related('container', 'computing')
+            if after:
+                tasks = tasks.filter(Q(created__lt=after.created) | Q(created=after.created, uuid__lt=after.uuid))
+            return tasks.order_by('-created', '-uuid')[:page_size+1]
+
+        queries = [('Tasks list', lambda: tasks_page()),
+                   ('Tasks list (next page)', lambda: tasks_page(after=cursor_task)),
+                   ('Tasks list (by status)', lambda: tasks_page(status=TaskStatuses.running)),
+                   ('Auth token', lambda: Profile.objects.filter(authtoken=profile.authtoken)),
+                   ('Login token', lambda: LoginToken.objects.filter(token=login_token.token)),
+                   ('Default keys', lambda: KeyPair.objects.filter(user=user, default=True)),
+                   ('Used tunnel ports', lambda: TunnelPort.objects.values_list('port', flat=True)),
+                   ('Sharable link', lambda: Task.objects.filter(short_id=task.short_id))]
+
+        for name, get_queryset in queries:
+            start_t = time.time()
+            for _ in range(repeat):
+                list(get_queryset())
+            elapsed = (time.time()-start_t) / repeat
+            self.stdout.write('\n{}: {:.3f} ms\n'.format(name, elapsed*1000))
+            self.stdout.write('  {}\n'.format(get_queryset().explain().replace('\n', '\n  ')))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...launch_queue import TaskLauncher
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Executes the queued task launches, with a pool of workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.TASK_LAUNCH_WORKERS, help='Number of workers')
+        parser.add_argument('--poll-interval', type=float, default=settings.TASK_LAUNCH_POLL_INTERVAL, help='Seconds between queue polls')
+
+    def handle(self, *args, **options):
+        logger.info('Starting task launcher with {} workers'.format(options['workers']))
+        TaskLauncher(workers=options['workers']).run_forever(poll_interval=options['poll_interval'])
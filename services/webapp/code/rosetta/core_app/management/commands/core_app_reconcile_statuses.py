@@ -0,0 +1,30 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...reconciler import reconcile_task_statuses
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Reconciles the task statuses with their real status on the computing resources, periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.TASK_STATUS_RECONCILE_INTERVAL, help='Seconds between reconciliations')
+        parser.add_argument('--once', action='store_true', help='Reconcile only once and exit')
+
+    def handle(self, *args, **options):
+
+        while True:
+            start_t = time.time()
+            try:
+                changed_count = reconcile_task_statuses()
+                logger.info('Reconciled task statuses in {:.2f}s, {} changed'.format(time.time()-start_t, changed_count))
+            except Exception as e:
+                logger.error('Error in reconciling task statuses: "{}"'.format(e))
+
+            if options['once']:
+                break
+
+            time.sleep(max(0, options['interval'] - (time.time()-start_t)))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...outbox import EmailSender
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Sends the emails queued in the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=float, default=settings.EMAIL_SEND_RATE, help='Maximum number of emails sent per second')
+        parser.add_argument('--poll-interval', type=float, default=settings.EMAIL_SEND_POLL_INTERVAL, help='Seconds between outbox polls')
+
+    def handle(self, *args, **options):
+        logger.info('Starting email sender with a rate limit of {} emails per second'.format(options['rate']))
+        EmailSender(rate=options['rate']).run_forever(poll_interval=options['poll_interval'])
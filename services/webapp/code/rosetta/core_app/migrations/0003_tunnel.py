@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-18 18:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0002_container_protocol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tunnel',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created on')),
+                ('port', models.IntegerField(verbose_name='Tunnel port')),
+                ('spec', models.CharField(max_length=255, verbose_name='Tunnel spec')),
+                ('control_path', models.CharField(max_length=4096, verbose_name='SSH control path')),
+                ('master_pid', models.IntegerField(blank=True, null=True, verbose_name='SSH master pid')),
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tunnel', to='core_app.Task')),
+            ],
+        ),
+    ]
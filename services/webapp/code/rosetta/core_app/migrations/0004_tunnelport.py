@@ -0,0 +1,41 @@
+# Generated by Django 2.2.1 on 2026-10-18 18:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def allocate_active_tunnel_ports(apps, schema_editor):
+
+    # Register the tunnel ports already in use by the active tasks
+    Task = apps.get_model('core_app', 'Task')
+    TunnelPort = apps.get_model('core_app', 'TunnelPort')
+    allocated_ports = set()
+    for task in Task.objects.filter(tunnel_port__isnull=False).exclude(status__in=['stopped', 'exited']).order_by('created'):
+        if task.tunnel_port not in allocated_ports:
+            TunnelPort.objects.create(port=task.tunnel_port, task=task)
+            allocated_ports.add(task.tunnel_port)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0003_tunnel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tunnel',
+            name='port',
+            field=models.IntegerField(db_index=True, verbose_name='Tunnel port'),
+        ),
+        migrations.CreateModel(
+            name='TunnelPort',
+            fields=[
+                ('port', models.IntegerField(primary_key=True, serialize=False, verbose_name='Tunnel port')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created on')),
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tunnel_port_allocation', to='core_app.Task')),
+            ],
+        ),
+        migrations.RunPython(allocate_active_tunnel_ports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.1 on 2026-10-18 18:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0004_tunnelport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLaunch',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(default='queued', max_length=36, verbose_name='Launch status')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created on')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt on')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Last error')),
+                ('worker', models.CharField(blank=True, max_length=255, null=True, verbose_name='Worker')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Started on')),
+                ('computing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core_app.Computing')),
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='launch', to='core_app.Task')),
+            ],
+            options={
+                'ordering': ['created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tasklaunch',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='core_app_ta_status_a740f6_idx'),
+        ),
+    ]
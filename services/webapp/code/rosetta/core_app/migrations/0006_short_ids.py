@@ -0,0 +1,64 @@
+# Generated by Django 2.2.1 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+SHORT_ID_LENGTHS = [8, 13, 18, 23, 36]
+SHORT_ID_MODELS = ['Computing', 'ComputingSysConf', 'ComputingUserConf', 'Container', 'KeyPair', 'Task']
+
+
+def set_short_ids(apps, schema_editor):
+
+    # Set the short IDs of the existing rows, the oldest ones (when known) keeping the shortest ones
+    for model_name in SHORT_ID_MODELS:
+        Model = apps.get_model('core_app', model_name)
+        field_names = [field.name for field in Model._meta.get_fields()]
+        ordering = 'created' if 'created' in field_names else 'uuid'
+        taken_short_ids = set()
+        for uuid in Model.objects.order_by(ordering).values_list('uuid', flat=True):
+            for length in SHORT_ID_LENGTHS:
+                short_id = str(uuid)[:length]
+                if short_id not in taken_short_ids:
+                    break
+            taken_short_ids.add(short_id)
+            Model.objects.filter(uuid=uuid).update(short_id=short_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0005_tasklaunch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='computing',
+            name='short_id',
+            field=models.CharField(blank=True, editable=False, max_length=36, null=True, unique=True, verbose_name='Short ID'),
+        ),
+        migrations.AddField(
+            model_name='computingsysconf',
+            name='short_id',
+            field=models.CharField(blank=True, editable=False, max_length=36, null=True, unique=True, verbose_name='Short ID'),
+        ),
+        migrations.AddField(
+            model_name='computinguserconf',
+            name='short_id',
+            field=models.CharField(blank=True, editable=False, max_length=36, null=True, unique=True, verbose_name='Short ID'),
+        ),
+        migrations.AddField(
+            model_name='container',
+            name='short_id',
+            field=models.CharField(blank=True, editable=False, max_length=36, null=True, unique=True, verbose_name='Short ID'),
+        ),
+        migrations.AddField(
+            model_name='keypair',
+            name='short_id',
+            field=models.CharField(blank=True, editable=False, max_length=36, null=True, unique=True, verbose_name='Short ID'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='short_id',
+            field=models.CharField(blank=True, editable=False, max_length=36, null=True, unique=True, verbose_name='Short ID'),
+        ),
+        migrations.RunPython(set_short_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.1 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0006_short_ids'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logintoken',
+            name='token',
+            field=models.CharField(max_length=36, unique=True, verbose_name='Login token'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='authtoken',
+            field=models.CharField(blank=True, max_length=36, null=True, unique=True, verbose_name='User auth token'),
+        ),
+        migrations.AddIndex(
+            model_name='keypair',
+            index=models.Index(condition=models.Q(default=True), fields=['user'], name='core_app_keypair_default_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'created'], name='core_app_ta_user_id_d8d8a7_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.1 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'status', 'created'], name='core_app_ta_user_id_e5b4e3_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:03
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core_app', '0008_task_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskHistory',
+            fields=[
+                ('uuid', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('tid', models.CharField(blank=True, max_length=64, null=True, verbose_name='Task ID')),
+                ('name', models.CharField(max_length=36, verbose_name='Task name')),
+                ('status', models.CharField(blank=True, max_length=36, null=True, verbose_name='Task status')),
+                ('created', models.DateTimeField(verbose_name='Created on')),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Archived on')),
+                ('computing_name', models.CharField(max_length=255, verbose_name='Computing name')),
+                ('computing_type', models.CharField(max_length=255, verbose_name='Computing type')),
+                ('container_name', models.CharField(max_length=255, verbose_name='Container name')),
+                ('container_image', models.CharField(max_length=255, verbose_name='Container image')),
+                ('computing_options', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('computing', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core_app.Computing')),
+                ('container', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core_app.Container')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='taskhistory',
+            index=models.Index(fields=['user', 'created'], name='core_app_ta_user_id_717f1c_idx'),
+        ),
+    ]
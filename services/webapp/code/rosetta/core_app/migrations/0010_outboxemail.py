@@ -0,0 +1,38 @@
+# Generated by Django 2.2.1 on 2026-10-18 18:47
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0009_taskhistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('to', models.CharField(max_length=255, verbose_name='To')),
+                ('subject', models.CharField(max_length=255, verbose_name='Subject')),
+                ('text', models.TextField(verbose_name='Text')),
+                ('status', models.CharField(default='queued', max_length=36, verbose_name='Delivery status')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created on')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt on')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Last error')),
+                ('sender', models.CharField(blank=True, max_length=255, null=True, verbose_name='Sender')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Started on')),
+            ],
+            options={
+                'ordering': ['created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='core_app_ou_status_514237_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0010_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='last_heartbeat',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last heartbeat on'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat_load',
+            field=models.FloatField(blank=True, null=True, verbose_name='Host load average'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat_mem',
+            field=models.FloatField(blank=True, null=True, verbose_name='Host memory usage (%)'),
+        ),
+    ]
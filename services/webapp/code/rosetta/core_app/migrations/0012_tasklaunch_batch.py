@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0011_task_heartbeats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasklaunch',
+            name='batch',
+            field=models.UUIDField(blank=True, db_index=True, null=True, verbose_name='Launch batch'),
+        ),
+    ]
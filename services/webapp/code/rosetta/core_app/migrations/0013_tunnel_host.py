@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0012_tasklaunch_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tunnel',
+            name='host',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='SSH host'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_app', '0013_tunnel_host'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='task',
+            name='core_app_ta_user_id_d8d8a7_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='core_app_ta_user_id_e5b4e3_idx',
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'created', 'uuid'], name='core_app_ta_user_id_ed5871_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'status', 'created', 'uuid'], name='core_app_ta_user_id_188419_idx'),
+        ),
+    ]
@@ -1,10 +1,11 @@
 import uuid
 import json
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 from django.utils import timezone
-from .utils import os_shell, color_map, hash_string_to_int
+from .utils import color_map, hash_string_to_int
 
 if 'sqlite' in settings.DATABASES['default']['ENGINE']:
     from .fields import JSONField
@@ -23,6 +24,46 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+#=========================
+#  Short IDs
+#=========================
+
+# Lengths of the UUID prefixes (up to the dashes) used as short IDs, the shortest unique one wins
+SHORT_ID_LENGTHS = [8, 13, 18, 23, 36]
+
+class ShortIdModel(models.Model):
+    '''Model with a stored, uniquely indexed short ID (the first part of its UUID), so that
+    it can be looked up by it (i.e. in sharable links) as a point lookup.'''
+
+    short_id = models.CharField('Short ID', max_length=36, unique=True, editable=False, blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+
+    @property
+    def id(self):
+        return self.short_id if self.short_id else str(self.uuid).split('-')[0]
+
+
+    def save(self, *args, **kwargs):
+        if self.short_id or not self._state.adding:
+            return super(ShortIdModel, self).save(*args, **kwargs)
+
+        # Use the shortest UUID prefix not already taken
+        for length in SHORT_ID_LENGTHS:
+            self.short_id = str(self.uuid)[:length]
+            try:
+                with transaction.atomic():
+                    return super(ShortIdModel, self).save(*args, **kwargs)
+            except IntegrityError:
+                if not self.__class__.objects.filter(short_id=self.short_id).exists():
+                    self.short_id = None
+                    raise
+                logger.debug('Short ID "{}" already taken, using a longer one'.format(self.short_id))
+
+
+
 # Task statuses
 class TaskStatuses(object):
     created = 'created'
@@ -42,13 +83,22 @@ class Profile(models.Model):
     uuid      = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user      = models.OneToOneField(User, on_delete=models.CASCADE)
     timezone  = models.CharField('User Timezone', max_length=36, default='UTC')
-    authtoken = models.CharField('User auth token', max_length=36, blank=True, null=True)
+    authtoken = models.CharField('User auth token', max_length=36, blank=True, null=True, unique=True)
 
 
     def save(self, *args, **kwargs):
         if not self.authtoken:
             self.authtoken = str(uuid.uuid4())
         super(Profile, self).save(*args, **kwargs)
+        # The auth token might have changed
+        from .auth_tokens import authtoken_cache
+        authtoken_cache.invalidate(self.user_id)
+
+
+    def delete(self, *args, **kwargs):
+        super(Profile, self).delete(*args, **kwargs)
+        from .auth_tokens import authtoken_cache
+        authtoken_cache.invalidate(self.user_id)
 
 
     def __unicode__(self):
@@ -56,6 +106,24 @@ class Profile(models.Model):
 
 
 
+#=========================
+#  Cached models
+#=========================
+
+class CachedModelQuerySet(models.QuerySet):
+    '''QuerySet of the models whose objects are cached (see the cache invalidation at the bottom). Bulk
+    updates invalidate the cache of the updated objects, as they do not send the post_save signal.'''
+
+    def update(self, **kwargs):
+        objs = list(self)
+        updated_count = super(CachedModelQuerySet, self).update(**kwargs)
+        # Both as they were and as they are, as they might have been moved (i.e. to another user)
+        for obj in objs + list(self.model.objects.filter(pk__in=[obj.pk for obj in objs])):
+            invalidate_cache(obj)
+        return updated_count
+
+
+
 #=========================
 #  Login Token 
 #=========================
@@ -64,14 +132,14 @@ class LoginToken(models.Model):
 
     uuid  = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user  = models.OneToOneField(User, on_delete=models.CASCADE)
-    token = models.CharField('Login token', max_length=36)
+    token = models.CharField('Login token', max_length=36, unique=True)
 
 
 
 #=========================
 #  Containers
 #=========================
-class Container(models.Model):
+class Container(ShortIdModel):
 
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, blank=True, null=True)  
@@ -89,6 +157,8 @@ class Container(models.Model):
     supports_user_auth = models.BooleanField(default=False)
     supports_pass_auth = models.BooleanField(default=False)
 
+    objects = CachedModelQuerySet.as_manager()
+
 
     class Meta:
         ordering = ['name']
@@ -98,10 +168,6 @@ class Container(models.Model):
         return str('Container "{}" of type "{}" with image "{}" and  ports "{}" from registry "{}" of user "{}"'.format(self.name, self.type, self.image, self.ports, self.registry, self.user))
 
 
-    @property
-    def id(self):
-        return str(self.uuid).split('-')[0]
-
     @ property
     def color(self):
         string_int_hash = hash_string_to_int(self.name + self.type + self.image)
@@ -130,7 +196,7 @@ class Container(models.Model):
 #  Computing resources
 #=========================
 
-class Computing(models.Model):
+class Computing(ShortIdModel):
 
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, blank=True, null=True)
@@ -146,6 +212,8 @@ class Computing(models.Model):
     supports_docker  = models.BooleanField(default=False)
     supports_singularity  = models.BooleanField(default=False)
 
+    objects = CachedModelQuerySet.as_manager()
+
 
     class Meta:
         ordering = ['name']
@@ -158,17 +226,15 @@ class Computing(models.Model):
             return str('Computing "{}"'.format(self.name))
 
 
-    @property
-    def id(self):
-        return str(self.uuid).split('-')[0]
-
-
     @property    
     def sys_conf_data(self):
+        # Loaded once per instance, and cached across requests (see computing_confs)
         try:
-            return ComputingSysConf.objects.get(computing=self).data
-        except ComputingSysConf.DoesNotExist:
-            return None
+            return self._sys_conf_data
+        except AttributeError:
+            from .computing_confs import get_sys_conf_data
+            self._sys_conf_data = get_sys_conf_data(self)
+            return self._sys_conf_data
 
 
     @property    
@@ -192,10 +258,8 @@ class Computing(models.Model):
     def attach_user_conf_data(self, user):
         if self.user and self.user != user:
             raise Exception('Cannot attach a conf data for another user (my user="{}", another user="{}"'.format(self.user, user)) 
-        try:
-            self._user_conf_data = ComputingUserConf.objects.get(computing=self, user=user).data
-        except ComputingUserConf.DoesNotExist:
-            self._user_conf_data = None
+        from .computing_confs import get_user_conf_data
+        self._user_conf_data = get_user_conf_data(self, user)
 
 
     def get_conf_param(self, param, from_sys_only=False):
@@ -234,16 +298,13 @@ class Computing(models.Model):
 
 
 
-class ComputingSysConf(models.Model):
+class ComputingSysConf(ShortIdModel):
 
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     computing = models.ForeignKey(Computing, related_name='+', on_delete=models.CASCADE)
     data = JSONField(blank=True, null=True)
 
-
-    @property
-    def id(self):
-        return str(self.uuid).split('-')[0]
+    objects = CachedModelQuerySet.as_manager()
 
 
     def __str__(self):
@@ -251,16 +312,17 @@ class ComputingSysConf(models.Model):
 
 
 
-class ComputingUserConf(models.Model):
+class ComputingUserConf(ShortIdModel):
 
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=True)
     computing = models.ForeignKey(Computing, related_name='+', on_delete=models.CASCADE)
     data = JSONField(blank=True, null=True)
 
+    objects = CachedModelQuerySet.as_manager()
 
-    @property
-    def id(self):
+
+    def __str__(self):
         return str('Computing user conf for {} with id "{}" of user "{}"'.format(self.computing, self.id, self.user))
 
 
@@ -269,7 +331,7 @@ class ComputingUserConf(models.Model):
 #  Tasks 
 #=========================
 
-class Task(models.Model):
+class Task(ShortIdModel):
 
     uuid      = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user      = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
@@ -295,8 +357,16 @@ class Task(models.Model):
     # Computing options
     computing_options = JSONField(blank=True, null=True)
 
+    # Heartbeats sent by the agent while the task is running, with the load and memory usage of its host
+    last_heartbeat = models.DateTimeField('Last heartbeat on', blank=True, null=True)
+    heartbeat_load = models.FloatField('Host load average', blank=True, null=True)
+    heartbeat_mem  = models.FloatField('Host memory usage (%)', blank=True, null=True)
+
     class Meta:
         ordering = ['-created']
+        # With the uuid, for the keyset pagination of the tasks list (see "paginate_by_keyset")
+        indexes = [models.Index(fields=['user', 'created', 'uuid']),
+                   models.Index(fields=['user', 'status', 'created', 'uuid'])]
 
     def save(self, *args, **kwargs):
         
@@ -308,32 +378,20 @@ class Task(models.Model):
         # Call parent save
         super(Task, self).save(*args, **kwargs)
 
-    def update_status(self):
-        if self.computing == 'local':
-            
-            check_command = 'sudo docker inspect --format \'{{.State.Status}}\' ' + self.tid # or, .State.Running
-            out = os_shell(check_command, capture=True)
-            logger.debug('Status: "{}"'.format(out.stdout))
-            if out.exit_code != 0: 
-                if (('No such' in out.stderr) and (self.tid in out.stderr)):
-                    logger.debug('Task "{}" is not running in reality'.format(self.tid))
-                self.status = TaskStatuses.exited
-            else:
-                if out.stdout == 'running':
-                    self.status = TaskStatuses.running
-                    
-                elif out.stdout == 'exited':
-                    self.status = TaskStatuses.exited
-                    
-                else:
-                    raise Exception('Unknown task status: "{}"'.format(out.stdout))
-                
-            self.save()                   
-
-    @property
-    def id(self):
-        return str(self.uuid).split('-')[0]
+        # Free the tunnel port, if any, once over
+        if self.tunnel_port and self.status in [TaskStatuses.stopped, TaskStatuses.exited]:
+            TunnelPort.objects.filter(task=self).delete()
 
+    def update_status(self):
+        '''Check the real status of the task on its computing and update it, if changed. Task statuses
+        are kept up to date in background by the reconciler (see "core_app_reconcile_statuses").'''
+        try:
+            new_statuses = self.computing.manager.reconcile_tasks([self])
+        except NotImplementedError:
+            return
+        if self.uuid in new_statuses:
+            self.status = new_statuses[self.uuid]
+            self.save(update_fields=['status'])
 
     def __str__(self):
         return str('Task "{}" of user "{}" running on "{}" in status "{}" created at "{}"'.format(self.name, self.user, self.computing, self.status, self.created))
@@ -350,11 +408,131 @@ class Task(models.Model):
 
 
 
+#=========================
+#  Task history
+#=========================
+
+class TaskHistory(models.Model):
+    '''Archived (terminal) task, moved here from the Task table by the archiver. Keeps what is
+    useful for accounting, including the computing and container names in case they get deleted.'''
+
+    uuid      = models.UUIDField(primary_key=True, editable=False)
+    user      = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    tid       = models.CharField('Task ID', max_length=64, blank=True, null=True)
+    name      = models.CharField('Task name', max_length=36, blank=False, null=False)
+    status    = models.CharField('Task status', max_length=36, blank=True, null=True)
+    created   = models.DateTimeField('Created on')
+    archived  = models.DateTimeField('Archived on', default=timezone.now)
+
+    # Links (and what they were)
+    computing = models.ForeignKey(Computing, related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    computing_name = models.CharField('Computing name', max_length=255)
+    computing_type = models.CharField('Computing type', max_length=255)
+    container = models.ForeignKey('Container', related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    container_name = models.CharField('Container name', max_length=255)
+    container_image = models.CharField('Container image', max_length=255)
+
+    # Computing options
+    computing_options = JSONField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [models.Index(fields=['user', 'created'])]
+
+
+    @property
+    def id(self):
+        return str(self.uuid).split('-')[0]
+
+
+    def __str__(self):
+        return str('Archived task "{}" of user "{}" ran on "{}" with status "{}" created at "{}"'.format(self.name, self.user_id, self.computing_name, self.status, self.created))
+
+
+
+#=========================
+#  Task launches
+#=========================
+
+class TaskLaunchStatuses(object):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class TaskLaunch(models.Model):
+    '''A task launch job, queued on the database and executed by the launcher workers.'''
+
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task = models.OneToOneField(Task, related_name='launch', on_delete=models.CASCADE)
+    computing = models.ForeignKey(Computing, related_name='+', on_delete=models.CASCADE)
+    status = models.CharField('Launch status', max_length=36, default=TaskLaunchStatuses.queued)
+
+    # Launches of the same batch are executed all at once (i.e. as a Slurm job array)
+    batch = models.UUIDField('Launch batch', blank=True, null=True, db_index=True)
+    created = models.DateTimeField('Created on', default=timezone.now)
+
+    # Retries
+    attempts = models.IntegerField('Attempts', default=0)
+    next_attempt_at = models.DateTimeField('Next attempt on', default=timezone.now)
+    error = models.TextField('Last error', blank=True, null=True)
+
+    # Worker currently executing it
+    worker = models.CharField('Worker', max_length=255, blank=True, null=True)
+    started = models.DateTimeField('Started on', blank=True, null=True)
+
+    class Meta:
+        ordering = ['created']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+
+    def __str__(self):
+        return str('Launch of task "{}" in status "{}" ({} attempts)'.format(self.task_id, self.status, self.attempts))
+
+
+
+#=========================
+#  Tunnels
+#=========================
+
+class Tunnel(models.Model):
+
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task = models.OneToOneField(Task, related_name='tunnel', on_delete=models.CASCADE)
+    created = models.DateTimeField('Created on', default=timezone.now)
+
+    # Forwarding spec (in the "-L" format) and the SSH master connection it runs over
+    port = models.IntegerField('Tunnel port', db_index=True)
+    spec = models.CharField('Tunnel spec', max_length=255)
+    control_path = models.CharField('SSH control path', max_length=4096)
+    master_pid = models.IntegerField('SSH master pid', blank=True, null=True)
+    host = models.CharField('SSH host', max_length=255, blank=True, null=True)
+
+
+    def __str__(self):
+        return str('Tunnel "{}" for task "{}"'.format(self.spec, self.task_id))
+
+
+
+class TunnelPort(models.Model):
+    '''Allocation of a tunnel port to a (non-terminal) task. Ports are unique, so claiming one is atomic.'''
+
+    port = models.IntegerField('Tunnel port', primary_key=True)
+    task = models.OneToOneField(Task, related_name='tunnel_port_allocation', on_delete=models.CASCADE)
+    created = models.DateTimeField('Created on', default=timezone.now)
+
+
+    def __str__(self):
+        return str('Tunnel port {} allocated to task "{}"'.format(self.port, self.task_id))
+
+
+
 #=========================
 #  KeyPair 
 #=========================
 
-class KeyPair(models.Model):
+class KeyPair(ShortIdModel):
 
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=False)  
@@ -365,19 +543,76 @@ class KeyPair(models.Model):
     default = models.BooleanField('Default keys?', default=False)
 
 
+    class Meta:
+        # Partial index, where supported (and a plain one elsewhere)
+        indexes = [models.Index(fields=['user'], condition=models.Q(default=True), name='core_app_keypair_default_idx')]
+
+
     def __str__(self):
         return str('KeyPair with id "{}" of user "{}"'.format(self.id, self.user))
 
 
-    @property
-    def id(self):
-        return str(self.uuid).split('-')[0]
 
+#=========================
+#  Email outbox
+#=========================
 
+class OutboxEmailStatuses(object):
+    queued = 'queued'
+    sending = 'sending'
+    failed = 'failed'
 
 
+class OutboxEmail(models.Model):
+    '''An email queued for delivery, sent (and then deleted) by the email sender in background.'''
 
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    to = models.CharField('To', max_length=255)
+    subject = models.CharField('Subject', max_length=255)
+    text = models.TextField('Text')
+    status = models.CharField('Delivery status', max_length=36, default=OutboxEmailStatuses.queued)
+    created = models.DateTimeField('Created on', default=timezone.now)
 
+    # Retries
+    attempts = models.IntegerField('Attempts', default=0)
+    next_attempt_at = models.DateTimeField('Next attempt on', default=timezone.now)
+    error = models.TextField('Last error', blank=True, null=True)
 
+    # Sender currently delivering it
+    sender = models.CharField('Sender', max_length=255, blank=True, null=True)
+    started = models.DateTimeField('Started on', blank=True, null=True)
 
+    class Meta:
+        ordering = ['created']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+
+    def __str__(self):
+        return str('Email to "{}" with subject "{}" in status "{}" ({} attempts)'.format(self.to, self.subject, self.status, self.attempts))
+
+
+
+#=========================
+#  Cache invalidation
+#=========================
 
+def invalidate_cache(obj):
+    '''Invalidate the cached data including a (just added, changed or deleted) object, if any.'''
+    from .catalog import invalidate_catalog
+    from .computing_confs import invalidate_conf_data
+    if isinstance(obj, (Container, Computing)):
+        invalidate_catalog(obj)
+    elif isinstance(obj, ComputingSysConf):
+        invalidate_conf_data(obj.computing_id, sys=True)
+    elif isinstance(obj, ComputingUserConf):
+        invalidate_conf_data(obj.computing_id, user_id=obj.user_id)
+
+
+def _invalidate_cache_on_signal(sender, instance, **kwargs):
+    invalidate_cache(instance)
+
+# Using the signals rather than the save and delete methods, as these are not called by the bulk
+# and cascade deletes (i.e. the ones from the admin, or of the objects of a deleted user).
+for model in [Container, Computing, ComputingSysConf, ComputingUserConf]:
+    post_save.connect(_invalidate_cache_on_signal, sender=model, dispatch_uid='invalidate_cache_on_save_{}'.format(model.__name__))
+    post_delete.connect(_invalidate_cache_on_signal, sender=model, dispatch_uid='invalidate_cache_on_delete_{}'.format(model.__name__))
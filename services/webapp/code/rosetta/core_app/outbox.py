@@ -0,0 +1,106 @@
+import os
+import time
+import socket
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import OutboxEmail, OutboxEmailStatuses
+from .utils import send_email
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def queue_email(to, subject, text):
+    '''Queue an email in the outbox, to be sent by the email sender in background.'''
+    return OutboxEmail.objects.create(to=to, subject=subject, text=text)
+
+
+
+class EmailSender(object):
+    '''Sender of the emails queued in the outbox, taken in batches and sent within a rate limit,
+    with retries with exponential backoff on failures. Sent emails are removed from the outbox.'''
+
+    def __init__(self, batch_size=None, rate=None, max_attempts=None, retry_delay=None, timeout=None):
+        self.batch_size = batch_size if batch_size else settings.EMAIL_SEND_BATCH_SIZE
+        self.rate = rate if rate else settings.EMAIL_SEND_RATE
+        self.max_attempts = max_attempts if max_attempts else settings.EMAIL_SEND_MAX_ATTEMPTS
+        self.retry_delay = retry_delay if retry_delay else settings.EMAIL_SEND_RETRY_DELAY
+        self.timeout = timeout if timeout else settings.EMAIL_SEND_TIMEOUT
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.last_send_t = 0
+
+    def requeue_stale(self):
+        '''Put back in the outbox the emails whose sender died while sending them.'''
+        requeued_count = OutboxEmail.objects.filter(status=OutboxEmailStatuses.sending,
+                                                    started__lt=timezone.now() - timedelta(seconds=self.timeout)).update(status=OutboxEmailStatuses.queued, sender=None)
+        if requeued_count:
+            logger.warning('Requeued {} stale emails'.format(requeued_count))
+        return requeued_count
+
+    def claim(self):
+        '''Claim a batch of the emails due to be sent (skipping the ones claimed by other senders in the meantime).'''
+        due_uuids = list(OutboxEmail.objects.filter(status=OutboxEmailStatuses.queued, next_attempt_at__lte=timezone.now())
+                         .values_list('uuid', flat=True)[:self.batch_size])
+        if not due_uuids:
+            return []
+        now = timezone.now()
+        OutboxEmail.objects.filter(uuid__in=due_uuids, status=OutboxEmailStatuses.queued).update(status=OutboxEmailStatuses.sending,
+                                                                                                 sender=self.name, started=now,
+                                                                                                 attempts=F('attempts')+1)
+        return list(OutboxEmail.objects.filter(uuid__in=due_uuids, status=OutboxEmailStatuses.sending, sender=self.name, started=now))
+
+    def send(self, email):
+        '''Send a (claimed) email, waiting as needed to stay within the rate limit.'''
+
+        wait_time = self.last_send_t + 1.0/self.rate - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        self.last_send_t = time.time()
+
+        try:
+            send_email(to=email.to, subject=email.subject, text=email.text)
+
+        except Exception as e:
+            if email.attempts < self.max_attempts:
+                retry_delay = self.retry_delay * 2**(email.attempts-1)
+                logger.warning('Error in sending email to "{}", retrying in {}s: "{}"'.format(email.to, retry_delay, e))
+                OutboxEmail.objects.filter(uuid=email.uuid).update(status=OutboxEmailStatuses.queued, sender=None, error=str(e),
+                                                                   next_attempt_at=timezone.now() + timedelta(seconds=retry_delay))
+            else:
+                logger.error('Error in sending email to "{}", giving up after {} attempts: "{}"'.format(email.to, email.attempts, e))
+                OutboxEmail.objects.filter(uuid=email.uuid).update(status=OutboxEmailStatuses.failed, error=str(e))
+            return False
+
+        else:
+            OutboxEmail.objects.filter(uuid=email.uuid).delete()
+            return True
+
+    def process(self):
+        '''Claim a batch of emails and send them. Returns how many were claimed.'''
+        claimed_emails = self.claim()
+        sent_count = 0
+        for email in claimed_emails:
+            if self.send(email):
+                sent_count += 1
+        if claimed_emails:
+            logger.info('Sent {} emails out of {}'.format(sent_count, len(claimed_emails)))
+        return len(claimed_emails)
+
+    def run_forever(self, poll_interval=None):
+        poll_interval = poll_interval if poll_interval else settings.EMAIL_SEND_POLL_INTERVAL
+        last_requeue_t = 0
+        while True:
+            claimed_count = 0
+            try:
+                if time.time() - last_requeue_t > self.timeout:
+                    self.requeue_stale()
+                    last_requeue_t = time.time()
+                claimed_count = self.process()
+            except Exception as e:
+                logger.error('Error in processing the email outbox: "{}"'.format(e))
+            # Go on right away if there might be more emails to send
+            if claimed_count < self.batch_size:
+                time.sleep(poll_interval)
@@ -0,0 +1,54 @@
+from django.db.models import Q
+from .models import Task, TaskStatuses
+from .tunnels import release_tunnel_ports
+from .heartbeats import get_heartbeat_cutoff
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Conf
+NON_TERMINAL_STATUSES = [TaskStatuses.created, TaskStatuses.sumbitted, TaskStatuses.running]
+
+
+def reconcile_task_statuses():
+    '''Reconcile the status of all the non-terminal tasks with their real status on the computing
+    resources. Tasks are grouped by computing, and each computing manager checks all of its tasks
+    at once, so that the cost grows with the number of computings and not with the number of tasks.
+    Running tasks with recent heartbeats (from their agent) are not checked, as they are alive: the ones
+    whose heartbeats stopped are, as this might be as well because of an outage of the webapp (or of
+    the network) rather than of the task. Returns the number of tasks which changed status.'''
+
+    changed_count = 0
+
+    # Group non-terminal tasks which were actually started (have a pid or a tid) by computing
+    tasks_by_computing = {}
+    for task in (Task.objects.filter(Q(pid__isnull=False) | Q(tid__isnull=False), status__in=NON_TERMINAL_STATUSES)
+                 .exclude(status=TaskStatuses.running, last_heartbeat__gte=get_heartbeat_cutoff()).select_related('computing', 'user').iterator()):
+        tasks_by_computing.setdefault(task.computing.uuid, []).append(task)
+
+    for computing_tasks in tasks_by_computing.values():
+        computing = computing_tasks[0].computing
+        try:
+            new_statuses = computing.manager.reconcile_tasks(computing_tasks)
+        except NotImplementedError:
+            continue
+        except Exception as e:
+            logger.error('Error in reconciling task statuses for computing "{}": "{}"'.format(computing, e))
+            continue
+
+        # Bulk update only the changed ones, one query per new status. Do not touch
+        # tasks which reached a terminal status (i.e. stopped by the user) in the meantime.
+        uuids_by_status = {}
+        for task_uuid, status in new_statuses.items():
+            uuids_by_status.setdefault(status, []).append(task_uuid)
+        for status, task_uuids in uuids_by_status.items():
+            changed_count += Task.objects.filter(uuid__in=task_uuids, status__in=NON_TERMINAL_STATUSES).update(status=status)
+
+            # Free the tunnel ports of the tasks which are over (bulk updates do not go through Task.save)
+            if status not in NON_TERMINAL_STATUSES:
+                release_tunnel_ports(task_uuids)
+
+        logger.debug('Reconciled {} tasks for computing "{}", {} changed status'.format(len(computing_tasks), computing, len(new_statuses)))
+
+    return changed_count
@@ -0,0 +1,214 @@
+import os
+import re
+import time
+import threading
+from django.conf import settings
+from .utils import get_md5
+from .executor import executor
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SSHConnection(object):
+    '''A persistent SSH connection to a host, multiplexed using OpenSSH master mode (ControlMaster).
+    The master connection is authenticated once and kept alive for "idle_timeout" seconds after
+    the last session, while commands and port forwardings are run over it as mux sessions. As
+    forwardings do not count as sessions, the masters carrying them must be persistent (kept
+    alive until explicitly closed), or they would drop all of them once idle.'''
+
+    # How often (in seconds) the master connection is checked for being still alive
+    master_check_interval = 30
+
+    def __init__(self, host, user=None, key_file=None, control_path=None, idle_timeout=600, max_sessions=8, max_streams=4, persistent=False):
+        self.host = host
+        self.user = user
+        self.key_file = key_file
+        self.control_path = control_path
+        self.idle_timeout = idle_timeout
+        self.persistent = persistent
+
+        # Limit the number of concurrent sessions over the master connection (sshd defaults to MaxSessions=10).
+        # Streams count as sessions for as long as they are open, and can take only some of them, so that
+        # they can never leave the commands without.
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+        self.streams = threading.BoundedSemaphore(min(max_streams, max_sessions))
+        self.lock = threading.Lock()
+        self.master_checked_at = None
+        self.master_pid = None
+
+    def __str__(self):
+        return str('SSH connection to "{}" with control path "{}"'.format(self.destination, self.control_path))
+
+    @property
+    def destination(self):
+        if self.user:
+            return '{}@{}'.format(self.user, self.host)
+        else:
+            return self.host
+
+    @property
+    def options(self):
+        control_persist = 'yes' if self.persistent else self.idle_timeout
+        options = '-4 -o StrictHostKeyChecking=no -o ControlMaster=auto -o ControlPath={} -o ControlPersist={}'.format(self.control_path, control_persist)
+        if self.key_file:
+            options = '-i {} {}'.format(self.key_file, options)
+        return options
+
+    @property
+    def command_prefix(self):
+        return 'ssh {} {} '.format(self.options, self.destination)
+
+    def check_master(self):
+        '''Check if the master connection is alive, and get its pid.'''
+        if not os.path.exists(self.control_path):
+            return False
+        out = executor.run('ssh -o ControlPath={} -O check {}'.format(self.control_path, self.destination), host=self.host, timeout=10)
+        if out.exit_code != 0:
+            return False
+        # i.e. "Master running (pid=1234)"
+        match = re.search(r'pid=(\d+)', out.stderr)
+        self.master_pid = int(match.group(1)) if match else None
+        return True
+
+    def ensure_master(self):
+        '''Ensure that the master connection is alive, (re)building it if stale or missing.'''
+        with self.lock:
+
+            # Do not check too often, the master is also re-checked if a command fails at the SSH level
+            if self.master_checked_at and (time.time() - self.master_checked_at) < self.master_check_interval:
+                return
+
+            if not self.check_master():
+
+                # Remove the stale control socket, if any
+                if os.path.exists(self.control_path):
+                    logger.debug('Removing stale SSH control socket "{}"'.format(self.control_path))
+                    try:
+                        os.remove(self.control_path)
+                    except OSError:
+                        pass
+
+                # Open the master connection in background. Its output is redirected as the backgrounded
+                # master would otherwise keep the capture pipes open, and the executor waiting on them.
+                logger.debug('Opening SSH master connection to "{}"'.format(self.destination))
+                out = executor.run('ssh {} -fN {} < /dev/null > /dev/null 2> {}.err'.format(self.options, self.destination, self.control_path), host=self.host)
+                if out.exit_code != 0:
+                    try:
+                        with open('{}.err'.format(self.control_path)) as f:
+                            raise Exception(f.read().strip() or out.stderr)
+                    except IOError:
+                        raise Exception(out.stderr)
+
+                # Get the pid of the new master
+                self.check_master()
+
+            self.master_checked_at = time.time()
+
+    def run(self, command, timeout=None):
+        '''Run a command over the master connection and wait for its result (a CommandResult).'''
+        self.ensure_master()
+        out = executor.run(self.command_prefix + command, host=self.host, timeout=timeout, semaphore=self.sessions)
+
+        # Exit code 255 is an SSH-level error: force a master check (and rebuild) on next run
+        if out.exit_code == 255:
+            self.master_checked_at = None
+
+        return out
+
+    def submit(self, command, timeout=None):
+        '''Submit a command to be run over the master connection, returning its (awaitable) handle.'''
+        self.ensure_master()
+        return executor.submit(self.command_prefix + command, host=self.host, timeout=timeout, semaphore=self.sessions)
+
+    def stream(self, command):
+        '''Start a long-running command over the master connection and return its output stream.'''
+        self.ensure_master()
+        return executor.stream(self.command_prefix + command, host=self.host, semaphores=[self.streams, self.sessions])
+
+    def forward(self, spec):
+        '''Set up a local port forwarding (in the "-L" format) over the master connection. Forwarding
+        an already existing spec is a no-op for the master. Returns the pid of the master.'''
+        self.ensure_master()
+        out = executor.run('ssh -o ControlPath={} -O forward -L {} {}'.format(self.control_path, spec, self.destination), host=self.host)
+        if out.exit_code != 0:
+            raise Exception(out.stderr)
+        return self.master_pid
+
+    def cancel_forward(self, spec):
+        '''Cancel a local port forwarding over the master connection. Does not open a master if there is none.'''
+        if not self.check_master():
+            return
+        out = executor.run('ssh -o ControlPath={} -O cancel -L {} {}'.format(self.control_path, spec, self.destination), host=self.host)
+        if out.exit_code != 0:
+            logger.debug('Could not cancel forwarding "{}" on {}: "{}"'.format(spec, self, out.stderr))
+
+    def close(self):
+        '''Close the master connection.'''
+        with self.lock:
+            executor.run('ssh -o ControlPath={} -O exit {}'.format(self.control_path, self.destination), host=self.host, timeout=10)
+            self.master_checked_at = None
+            self.master_pid = None
+
+
+
+class SSHConnectionPool(object):
+    '''Pool of persistent SSH connections, one per (computing, user, key) and host. The ones carrying
+    port forwardings are kept apart from the ones running commands, as their masters never expire.'''
+
+    def __init__(self, control_dir=None, idle_timeout=None, max_sessions=None, max_streams=None):
+        self.control_dir = control_dir if control_dir else settings.SSH_POOL_CONTROL_DIR
+        self.idle_timeout = idle_timeout if idle_timeout else settings.SSH_POOL_IDLE_TIMEOUT
+        self.max_sessions = max_sessions if max_sessions else settings.SSH_POOL_MAX_SESSIONS
+        self.max_streams = max_streams if max_streams else settings.SSH_POOL_MAX_STREAMS
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get_connection(self, host, user=None, key_file=None, computing=None, persistent=False):
+
+        computing_uuid = str(computing.uuid) if computing else None
+        pool_key = (computing_uuid, user, key_file, host, persistent)
+
+        with self.lock:
+            try:
+                return self.connections[pool_key]
+            except KeyError:
+                pass
+
+            # Create the control sockets dir if not already present (must not be accessible by others)
+            if not os.path.exists(self.control_dir):
+                os.makedirs(self.control_dir, mode=0o700)
+
+            # Use a hash for the control socket name, as unix socket paths are limited to ~100 chars
+            control_path = os.path.join(self.control_dir, get_md5(str(pool_key))[:16])
+
+            connection = SSHConnection(host = host,
+                                       user = user,
+                                       key_file = key_file,
+                                       control_path = control_path,
+                                       idle_timeout = self.idle_timeout,
+                                       max_sessions = self.max_sessions,
+                                       max_streams = self.max_streams,
+                                       persistent = persistent)
+            self.connections[pool_key] = connection
+            logger.debug('Created {}'.format(connection))
+            return connection
+
+    def close_all(self):
+        with self.lock:
+            for connection in self.connections.values():
+                connection.close()
+            self.connections = {}
+
+
+def cancel_forward(control_path, spec, host=None):
+    '''Cancel a local port forwarding over the master connection listening on a control path
+    (the destination is only used for the per-host limits, as the control path is given explicitly).'''
+    out = executor.run('ssh -o ControlPath={} -O cancel -L {} {}'.format(control_path, spec, host if host else 'localhost'), host=host, timeout=10)
+    if out.exit_code != 0:
+        logger.debug('Could not cancel forwarding "{}" on "{}": "{}"'.format(spec, control_path, out.stderr))
+
+
+# Pool instance (per process)
+ssh_pool = SSHConnectionPool()
@@ -0,0 +1,76 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import TaskStatuses
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Conf
+TERMINAL_STATUSES = [TaskStatuses.stopped, TaskStatuses.exited]
+
+
+def get_task_log_cache_key(task):
+    return 'task_log_{}'.format(task.uuid)
+
+
+def _read_task_log(task, cached_log):
+
+    # Read only the new bytes, if we have something already (and they can be read from an offset)
+    if cached_log and not task.computing.manager.supports_log_offsets:
+        cached_log = None
+    if cached_log:
+        new_log, size = task.computing.manager.get_task_log(task, offset=cached_log['end'])
+        if size >= cached_log['end']:
+            log = cached_log['log'] + new_log
+        else:
+            # The log got truncated (i.e. the task was re-started), start over
+            logger.debug('Log of task "{}" got truncated, reading it again'.format(task.uuid))
+            cached_log = None
+
+    # Otherwise, read just its tail
+    if not cached_log:
+        log, size = task.computing.manager.get_task_log(task, tail=settings.TASK_LOG_TAIL_LINES)
+
+    # Keep at most TASK_LOG_CACHE_MAX_BYTES (the most recent ones)
+    log_data = log.encode('utf-8')
+    if len(log_data) > settings.TASK_LOG_CACHE_MAX_BYTES:
+        log = log_data[-settings.TASK_LOG_CACHE_MAX_BYTES:].decode('utf-8', errors='ignore')
+        log_data = log.encode('utf-8')
+
+    return {'log': log,
+            'start': size - len(log_data),
+            'end': size,
+            'time': time.time()}
+
+
+def get_task_log(task, offset=None):
+    '''Get the log of a task, from a given byte offset or, if not set, its last TASK_LOG_TAIL_LINES lines.
+    Logs are cached on the webapp side, and only the bytes written since the last read are transferred
+    from the computing resource, at most once every TASK_LOG_CACHE_TTL seconds (or never again, once the
+    task is over). Returns a (log, offset) tuple, where offset is the one to read from next time.'''
+
+    cache_key = get_task_log_cache_key(task)
+    cached_log = cache.get(cache_key)
+
+    # Update the cached log, unless fresh enough (or not changing anymore) and covering the offset asked for
+    if (not cached_log
+        or (task.status not in TERMINAL_STATUSES and (time.time() - cached_log['time']) > settings.TASK_LOG_CACHE_TTL)
+        or (offset is not None and offset > cached_log['end'])):
+        cached_log = _read_task_log(task, cached_log)
+        cache.set(cache_key, cached_log, settings.TASK_LOG_CACHE_TIMEOUT)
+
+    if offset is None:
+        return cached_log['log'], cached_log['end']
+
+    if offset < cached_log['start']:
+        # Older than what is cached, read it directly
+        log, size = task.computing.manager.get_task_log(task, offset=offset)
+        return log, max(size, offset)
+
+    if offset > cached_log['end']:
+        # Beyond the end of the log (truncated in the meantime), nothing new
+        return '', cached_log['end']
+
+    return cached_log['log'].encode('utf-8')[offset-cached_log['start']:].decode('utf-8', errors='replace'), cached_log['end']
@@ -1,4 +1,11 @@
+import os
 import json
+import shutil
+import tempfile
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 from django.test import TestCase
 from rest_framework.test import APIClient as Client
 from django.test.client import MULTIPART_CONTENT
@@ -86,8 +93,101 @@ class BaseAPITestCase(TestCase):
 
 
 
-
-
-
-
-
+class FakeDockerDaemon(object):
+    '''Stand-in for the Docker daemon, serving (a minimal subset of) the Docker Engine API on a unix socket.'''
+
+    def __init__(self):
+        self.containers = {}
+        self.created_count = 0
+        self.network = 'rosetta_default'
+        self.requests = []
+        self.connections = 0
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'docker.sock')
+
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                daemon.connections += 1
+                super(Handler, self).setup()
+
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+                daemon.requests.append((method, url.path))
+                path = url.path.split('/')[1:]
+                # Versioned (i.e. "/v1.43/containers/json") or not (i.e. "/version")
+                if path[0].startswith('v') and path[0][1:2].isdigit():
+                    path = path[1:]
+                status, content = daemon.handle(method, path, parse_qs(url.query), body)
+                if not isinstance(content, bytes):
+                    content = json.dumps(content).encode('utf-8') if content is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def handle(self, method, path, query, body):
+        not_found = (404, {'message': 'No such container'})
+
+        if path == ['version']:
+            return 200, {'ApiVersion': '1.43', 'MinAPIVersion': '1.24'}
+
+        if path == ['containers', 'create']:
+            self.created_count += 1
+            container_id = '{:064x}'.format(self.created_count)
+            self.containers[container_id] = {'Id': container_id, 'Name': query['name'][0], 'State': 'created',
+                                             'Config': body, 'Logs': b'Hello from ' + query['name'][0].encode('utf-8') + b'\n'}
+            return 201, {'Id': container_id}
+
+        if path == ['containers', 'json']:
+            ids = json.loads(query['filters'][0])['id'] if 'filters' in query else self.containers.keys()
+            return 200, [{'Id': container_id, 'State': self.containers[container_id]['State']} for container_id in ids if container_id in self.containers]
+
+        if path[0] != 'containers' or path[1] not in self.containers:
+            return not_found
+        container = self.containers[path[1]]
+        action = path[2] if len(path) > 2 else None
+
+        if method == 'DELETE':
+            self.containers.pop(path[1])
+            return 204, None
+        elif action == 'start':
+            container['State'] = 'running'
+            return 204, None
+        elif action == 'stop':
+            container['State'] = 'exited'
+            return 204, None
+        elif action == 'json':
+            return 200, {'Id': container['Id'], 'State': {'Status': container['State']},
+                         'NetworkSettings': {'Networks': {self.network: {'IPAddress': '172.18.0.{}'.format(int(container['Id'], 16) + 1)}} if self.network else {}}}
+        elif action == 'logs':
+            if 'tail' in query and query['tail'][0] != 'all':
+                return 200, b''.join(container['Logs'].splitlines(keepends=True)[-int(query['tail'][0]):])
+            return 200, container['Logs']
+        return not_found
@@ -1,9 +1,16 @@
+import io
 import json
+import socket
+from unittest import mock
 
 from django.contrib.auth.models import User
         
 from .common import BaseAPITestCase
-from ..models import Profile
+from django.contrib.sessions.models import Session
+from ..models import Profile, Task, TaskStatuses, Container, Computing, OutboxEmail
+from ..auth_tokens import authtoken_cache
+from ..agent import PORT_RANGE
+from ..utils import get_agent_version
 
 class ApiTests(BaseAPITestCase):
 
@@ -15,6 +22,7 @@ class ApiTests(BaseAPITestCase):
 
         # Create test profile
         Profile.objects.create(user=self.user, authtoken='ync719tce917tec197t29cn712eg')
+        authtoken_cache.clear()
 
 
     def test_api_web_auth(self):
@@ -46,4 +54,95 @@ class ApiTests(BaseAPITestCase):
 
 
 
-        
\ No newline at end of file
+        
+
+
+    def test_api_token_auth(self):
+        '''Test stateless auth using the auth token'''
+
+        # Wrong token
+        resp = self.post('/api/v1/base/login/', data={'authtoken': 'wrongtoken'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json.loads(resp.content), {"detail": "Wrong auth token"})
+
+        # Correct token, no sessions involved
+        resp = self.post('/api/v1/base/login/', data={'authtoken': 'ync719tce917tec197t29cn712eg'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content), {"results": {"authtoken": "ync719tce917tec197t29cn712eg"}})
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertNotIn('sessionid', resp.cookies)
+
+        # Then from the cache
+        with self.assertNumQueries(0):
+            resp = self.post('/api/v1/base/login/', data={'authtoken': 'ync719tce917tec197t29cn712eg'})
+        self.assertEqual(resp.status_code, 200)
+
+        # Changed token
+        profile = Profile.objects.get(user=self.user)
+        profile.authtoken = 'cb18c1f2e8a7461c9f0b1ad8e3c3e5e6'
+        profile.save()
+        resp = self.post('/api/v1/base/login/', data={'authtoken': 'ync719tce917tec197t29cn712eg'})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.post('/api/v1/base/login/', data={'authtoken': 'cb18c1f2e8a7461c9f0b1ad8e3c3e5e6'})
+        self.assertEqual(resp.status_code, 200)
+
+
+    def test_api_agent(self):
+        '''Test the agent download, port triplet reservation and reporting'''
+
+        container = Container.objects.create(name='MyCont', image='myimage', type='singularity', registry='docker_hub', supports_dynamic_ports=True)
+        computing = Computing.objects.create(name='MyCluster', type='cluster')
+        task = Task.objects.create(uuid='00000000-0000-0000-0000-000000001000', user=self.user, name='MyTask',
+                                   status=TaskStatuses.sumbitted, computing=computing, container=container)
+        start_port = PORT_RANGE[0] + 4096
+
+        # Versioned download, cacheable
+        agent_version = get_agent_version()
+        resp = self.client.get('/api/v1/base/agent/?version={}'.format(agent_version))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['ETag'], '"{}"'.format(agent_version))
+        self.assertIn('immutable', resp['Cache-Control'])
+        agent_code = resp.content.decode('utf-8')
+        allocate_ports_code = agent_code[agent_code.index('def allocate_ports'):agent_code.index('def get_host_stats')]
+        self.assertNotIn('sleep', allocate_ports_code)
+
+        # Unversioned download, to be revalidated
+        resp = self.client.get('/api/v1/base/agent/')
+        self.assertEqual(resp['Cache-Control'], 'no-cache')
+        self.assertEqual(resp.content.decode('utf-8'), agent_code)
+        resp = self.client.get('/api/v1/base/agent/', HTTP_IF_NONE_MATCH='"{}"'.format(agent_version))
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b'')
+
+        # Run the agent, reporting back to this webapp
+        def urlopen(url):
+            return io.BytesIO(self.client.get(url[url.index('/api/'):]).content)
+
+        busy_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        busy_sock.bind(('', start_port+1))
+        try:
+            with mock.patch('urllib.request.urlopen', urlopen), mock.patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                 mock.patch('sys.argv', ['agent.py', str(task.uuid), 'http://webapp']), mock.patch.dict('os.environ', {'ROSETTA_HEARTBEAT_INTERVAL': '0'}):
+                exec(compile(agent_code, 'agent.py', 'exec'), {'__name__': '__main__'})
+        finally:
+            busy_sock.close()
+
+        # The busy port was skipped, and the triplet released
+        port = int(stdout.getvalue())
+        self.assertEqual(port, start_port+2)
+        for i in range(3):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('', port+i))
+            sock.close()
+
+        task = Task.objects.get(uuid=task.uuid)
+        self.assertEqual(task.status, TaskStatuses.running)
+        self.assertEqual(task.port, port)
+
+        # The user notification is queued, not sent right away
+        self.assertEqual(OutboxEmail.objects.get().subject, 'Your Task "MyCont" is up and running')
+
+        # Legacy per-task download, with the arguments set
+        resp = self.client.get('/api/v1/base/agent/?task_uuid={}'.format(task.uuid))
+        self.assertIn('"{}"'.format(task.uuid), resp.content.decode('utf-8'))
+        self.assertEqual(resp['Cache-Control'], 'no-store')
@@ -0,0 +1,61 @@
+from datetime import timedelta
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Profile, Task, TaskStatuses, TaskHistory, Container, Computing, TunnelPort
+from ..archiver import archive_tasks
+
+
+class ArchiverTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, container and computing
+        self.user = User.objects.create_user('testuser', password='testpass')
+        Profile.objects.create(user=self.user)
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MySlurm', type='slurm')
+
+    def create_task(self, name, status, age):
+        return Task.objects.create(user=self.user, name=name, status=status, computing=self.computing, container=self.container,
+                                   created=timezone.now()-timedelta(days=age), tid='42', computing_options={'partition': 'gpu'})
+
+    def test_archive(self):
+        '''Test moving the old terminal tasks to the history, in batches'''
+
+        for i in range(5):
+            self.create_task('old{}'.format(i), TaskStatuses.exited, 40+i)
+        old_stopped_task = self.create_task('oldstopped', TaskStatuses.stopped, 60)
+        TunnelPort.objects.create(port=7000, task=old_stopped_task)
+        self.create_task('oldrunning', TaskStatuses.running, 60)
+        self.create_task('recent', TaskStatuses.exited, 1)
+
+        self.assertEqual(archive_tasks(max_age=30, batch_size=2), 6)
+        self.assertEqual(sorted(Task.objects.values_list('name', flat=True)), ['oldrunning', 'recent'])
+        self.assertEqual(TaskHistory.objects.count(), 6)
+        self.assertEqual(TunnelPort.objects.count(), 0)
+
+        archived_task = TaskHistory.objects.get(uuid=old_stopped_task.uuid)
+        self.assertEqual(archived_task.status, TaskStatuses.stopped)
+        self.assertEqual(archived_task.tid, '42')
+        self.assertEqual(archived_task.created, old_stopped_task.created)
+        self.assertEqual(archived_task.computing_options, {'partition': 'gpu'})
+        self.assertEqual((archived_task.computing_name, archived_task.container_image), ('MySlurm', 'myimage'))
+
+        # Nothing left to do
+        self.assertEqual(archive_tasks(max_age=30), 0)
+
+        # Still there for accounting, once the computing is gone
+        self.computing.delete()
+        archived_task = TaskHistory.objects.get(uuid=old_stopped_task.uuid)
+        self.assertEqual((archived_task.computing, archived_task.computing_name), (None, 'MySlurm'))
+
+    def test_history_view(self):
+        '''Test the read-only view of the archived tasks'''
+        self.create_task('oldtask', TaskStatuses.exited, 40)
+        archive_tasks(max_age=30)
+        self.client.login(username='testuser', password='testpass')
+        resp = self.client.get('/task_history/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([task.name for task in resp.context['data']['tasks']], ['oldtask'])
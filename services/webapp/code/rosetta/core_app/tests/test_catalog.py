@@ -0,0 +1,76 @@
+from django.core.cache import cache
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Container, Computing
+from ..catalog import get_containers, get_computings, get_container, get_computing
+
+
+class CatalogTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test users, with their own and platform containers and computings
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.anotheruser = User.objects.create_user('anotheruser', password='anotherpass')
+        self.platform_container = Container.objects.create(name='PlatformCont', image='myimage', type='docker', registry='docker_hub')
+        self.user_container = Container.objects.create(user=self.user, name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        self.another_container = Container.objects.create(user=self.anotheruser, name='TheirCont', image='myimage', type='docker', registry='docker_hub')
+        Computing.objects.create(name='PlatformComp', type='local')
+        self.user_computing = Computing.objects.create(user=self.user, name='AMyComp', type='remote')
+        cache.clear()
+
+    def test_catalog(self):
+        '''Test the (cached) lists of containers and computings visible to a user'''
+
+        with self.assertNumQueries(1):
+            self.assertEqual([container.name for container in get_containers(self.user)], ['PlatformCont', 'MyCont'])
+        with self.assertNumQueries(1):
+            self.assertEqual([computing.name for computing in get_computings(self.user)], ['PlatformComp', 'AMyComp'])
+
+        # Then from the cache, including the lookups
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_containers(self.user)), 2)
+            self.assertEqual(get_container(self.user, self.user_container.uuid).name, 'MyCont')
+            self.assertEqual(get_container(self.user, str(self.platform_container.uuid)).name, 'PlatformCont')
+            self.assertEqual(get_container(self.user, self.another_container.uuid), None)
+            self.assertEqual(get_computing(self.user, self.user_computing.uuid).name, 'AMyComp')
+            self.assertEqual(get_container(self.user, 'notauuid'), None)
+
+    def test_invalidation(self):
+        '''Test that adding and deleting containers invalidates the cached lists'''
+
+        self.assertEqual(len(get_containers(self.user)), 2)
+        self.assertEqual(len(get_containers(self.anotheruser)), 2)
+
+        # User's own
+        Container.objects.create(user=self.user, name='MyOtherCont', image='myimage', type='docker', registry='docker_hub')
+        self.assertEqual(len(get_containers(self.user)), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_containers(self.anotheruser)), 2)
+        self.user_container.delete()
+        self.assertEqual([container.name for container in get_containers(self.user)], ['PlatformCont', 'MyOtherCont'])
+
+        # Platform ones, for everyone
+        Container.objects.create(name='NewPlatformCont', image='myimage', type='docker', registry='docker_hub')
+        self.assertEqual(len(get_containers(self.user)), 3)
+        self.assertEqual(len(get_containers(self.anotheruser)), 3)
+
+    def test_bulk_invalidation(self):
+        '''Test that bulk updates and deletes, and cascade deletes, invalidate the cached lists as well'''
+
+        self.assertEqual(len(get_containers(self.user)), 2)
+        self.assertEqual(len(get_computings(self.user)), 2)
+
+        # i.e. the admin "delete selected" action
+        Container.objects.filter(uuid=self.platform_container.uuid).delete()
+        self.assertEqual(get_container(self.user, self.platform_container.uuid), None)
+
+        # Moved to another user
+        Container.objects.filter(uuid=self.user_container.uuid).update(user=self.anotheruser)
+        self.assertEqual(get_containers(self.user), [])
+        self.assertEqual(len(get_containers(self.anotheruser)), 2)
+
+        # The user is deleted, with their computings
+        self.user.delete()
+        self.assertEqual(get_computing(self.user, self.user_computing.uuid), None)
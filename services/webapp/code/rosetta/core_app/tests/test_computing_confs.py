@@ -0,0 +1,103 @@
+from django.core.cache import cache
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Computing, ComputingSysConf, ComputingUserConf, Task, TaskStatuses, Container
+from ..computing_confs import attach_user_conf_data, attach_tasks_user_conf_data
+
+
+class ComputingConfsTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user and computing, with its confs
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.computing = Computing.objects.create(name='MyHop', type='remotehop')
+        ComputingSysConf.objects.create(computing=self.computing, data={'first_host': 'hop.example.com', 'binds': '/data'})
+        ComputingUserConf.objects.create(computing=self.computing, user=self.user, data={'first_host': 'mine.example.com', 'first_user': 'me'})
+        cache.clear()
+
+    def get_computing(self):
+        computing = Computing.objects.get(uuid=self.computing.uuid)
+        computing.attach_user_conf_data(self.user)
+        return computing
+
+    def test_conf_params(self):
+        '''Test that the confs are read only once, and with the sys conf taking precedence'''
+
+        with self.assertNumQueries(3):
+            computing = self.get_computing()
+            self.assertEqual(computing.get_conf_param('first_host'), 'hop.example.com')
+            self.assertEqual(computing.get_conf_param('first_user'), 'me')
+            self.assertEqual(computing.get_conf_param('binds', from_sys_only=True), '/data')
+            self.assertEqual(computing.get_conf_param('second_host'), None)
+            self.assertEqual(computing.get_conf_param('first_user', from_sys_only=True), None)
+
+        # Then served from the cache
+        with self.assertNumQueries(1):
+            computing = self.get_computing()
+            self.assertEqual(computing.sys_conf_data_json, '{"first_host": "hop.example.com", "binds": "/data"}')
+            self.assertEqual(computing.get_conf_param('first_user'), 'me')
+
+    def test_invalidation(self):
+        '''Test that saving the confs invalidates them'''
+
+        self.assertEqual(self.get_computing().get_conf_param('first_user'), 'me')
+
+        computingUserConf = ComputingUserConf.objects.get(computing=self.computing, user=self.user)
+        computingUserConf.data = {'first_user': 'someoneelse'}
+        computingUserConf.save()
+        self.assertEqual(self.get_computing().get_conf_param('first_user'), 'someoneelse')
+
+        computingSysConf = ComputingSysConf.objects.get(computing=self.computing)
+        computingSysConf.data = {'first_user': 'shared'}
+        computingSysConf.save()
+        computing = self.get_computing()
+        self.assertEqual(computing.get_conf_param('first_user'), 'shared')
+        self.assertEqual(computing.get_conf_param('first_host'), None)
+
+    def test_bulk_invalidation(self):
+        '''Test that bulk updates and deletes invalidate the confs as well'''
+
+        self.assertEqual(self.get_computing().get_conf_param('first_user'), 'me')
+        ComputingUserConf.objects.filter(computing=self.computing).update(data={'first_user': 'someoneelse'})
+        self.assertEqual(self.get_computing().get_conf_param('first_user'), 'someoneelse')
+        ComputingUserConf.objects.filter(computing=self.computing).delete()
+        self.assertEqual(self.get_computing().get_conf_param('first_user'), None)
+
+        self.assertEqual(self.get_computing().get_conf_param('first_host'), 'hop.example.com')
+        ComputingSysConf.objects.filter(computing=self.computing).delete()
+        self.assertEqual(self.get_computing().get_conf_param('first_host'), None)
+
+    def test_bulk_attach(self):
+        '''Test attaching the user confs to many computings (and tasks) at once'''
+
+        computings = [Computing.objects.create(name='MyComp{}'.format(i), type='remote') for i in range(10)]
+        for computing in computings[:5]:
+            ComputingUserConf.objects.create(computing=computing, user=self.user, data={'user': computing.name})
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            attach_user_conf_data(computings, self.user)
+        self.assertEqual([computing.get_conf_param('user') for computing in computings],
+                         ['MyComp{}'.format(i) for i in range(5)] + [None]*5)
+
+        # Then from the cache
+        computings = list(Computing.objects.filter(name__startswith='MyComp'))
+        with self.assertNumQueries(0):
+            attach_user_conf_data(computings, self.user)
+        self.assertEqual(computings[0].user_conf_data, {'user': 'MyComp0'})
+
+        # Not for computings of other users
+        anotheruser = User.objects.create_user('anotheruser', password='anotherpass')
+        with self.assertRaises(Exception):
+            attach_user_conf_data([Computing.objects.create(user=anotheruser, name='TheirComp', type='remote')], self.user)
+
+        # Tasks
+        container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        tasks = [Task.objects.create(user=self.user, name='MyTask{}'.format(i), status=TaskStatuses.created, computing=computing, container=container) for i, computing in enumerate(computings)]
+        cache.clear()
+        tasks = list(Task.objects.filter(user=self.user).select_related('user', 'computing'))
+        with self.assertNumQueries(1):
+            attach_tasks_user_conf_data(tasks)
+        self.assertEqual(sorted(task.computing.get_conf_param('user') or '' for task in tasks), ['']*5 + ['MyComp{}'.format(i) for i in range(5)])
@@ -0,0 +1,103 @@
+from unittest import mock
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase, FakeDockerDaemon
+from ..models import Task, TaskStatuses, Container, Computing
+from ..docker_client import DockerClient, DockerAPIError, demultiplex_stream
+from .. import computing_managers
+
+class DockerClientTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Start the stand-in Docker daemon
+        self.daemon = FakeDockerDaemon()
+        self.docker_client = DockerClient(socket_path=self.daemon.socket_path, api_version='1.24', timeout=5)
+
+        # Create test user, container and local computing
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub', ports='8590')
+        self.computing = Computing.objects.create(name='MyLocal', type='local')
+
+
+    def tearDown(self):
+        self.docker_client.close()
+        self.daemon.stop()
+
+
+    def test_client(self):
+        '''Test the Docker Engine API client over a kept-alive unix socket connection'''
+
+        container_info = self.docker_client.run_container('myimage', name='mycontainer', Tty=True)
+        self.assertEqual(container_info['State']['Status'], 'running')
+        self.assertEqual(self.daemon.requests, [('POST', '/v1.24/containers/create'),
+                                                ('POST', '/v1.24/containers/{}/start'.format(container_info['Id'])),
+                                                ('GET', '/v1.24/containers/{}/json'.format(container_info['Id']))])
+
+        self.assertEqual(self.docker_client.container_logs(container_info['Id']), 'Hello from mycontainer\n')
+        self.assertEqual(len(self.docker_client.list_containers(ids=[container_info['Id'], 'nonexistent'])), 1)
+
+        with self.assertRaises(DockerAPIError) as context:
+            self.docker_client.inspect_container('nonexistent')
+        self.assertEqual(context.exception.status_code, 404)
+
+        # All on the same connection
+        self.assertEqual(self.daemon.connections, 1)
+
+        # Multiplexed (non-TTY) log streams
+        self.assertEqual(demultiplex_stream(b'\x01\x00\x00\x00\x00\x00\x00\x03out\x02\x00\x00\x00\x00\x00\x00\x03err'), b'outerr')
+        self.assertEqual(demultiplex_stream(b'plain tty output'), b'plain tty output')
+
+
+    def test_api_version_negotiation(self):
+        '''Test negotiating the API version with the daemon, once'''
+
+        with mock.patch('rosetta.core_app.docker_client.settings.DOCKER_API_VERSION', None):
+            docker_client = DockerClient(socket_path=self.daemon.socket_path, timeout=5)
+        docker_client.list_containers()
+        docker_client.list_containers()
+        docker_client.close()
+        self.assertEqual(self.daemon.requests, [('GET', '/version'), ('GET', '/v1.43/containers/json'), ('GET', '/v1.43/containers/json')])
+
+
+    def test_local_computing_manager(self):
+        '''Test starting, reconciling, getting the logs of and stopping local tasks via the Docker Engine API'''
+
+        with mock.patch.object(computing_managers, 'docker_client', self.docker_client):
+
+            tasks = []
+            for i in range(3):
+                task = Task.objects.create(user=self.user, name='task{}'.format(i), status=TaskStatuses.created, computing=self.computing, container=self.container)
+                self.computing.manager.start_task(task)
+                tasks.append(task)
+
+            task = Task.objects.get(uuid=tasks[0].uuid)
+            self.assertEqual(task.status, TaskStatuses.running)
+            self.assertEqual(task.ip, '172.18.0.2')
+            self.assertEqual(task.port, 8590)
+            self.assertEqual(self.daemon.containers[task.tid]['Config']['HostConfig']['NetworkMode'], 'rosetta_default')
+            self.assertEqual(self.computing.manager.get_task_log(task), ('Hello from rosetta-task-{}\n'.format(task.id), 33))
+            self.assertEqual(self.computing.manager.get_task_log(task, offset=11), ('rosetta-task-{}\n'.format(task.id), 33))
+            self.daemon.containers[task.tid]['Logs'] += b'Bye\n'
+            self.assertEqual(self.computing.manager.get_task_log(task, tail=1), ('Bye\n', 4))
+
+            # A container exits: a single call to check all of them
+            self.daemon.containers[tasks[1].tid]['State'] = 'exited'
+            requests_count = len(self.daemon.requests)
+            self.assertEqual(self.computing.manager.reconcile_tasks(tasks), {tasks[1].uuid: TaskStatuses.exited})
+            self.assertEqual(len(self.daemon.requests), requests_count + 1)
+
+            # Stop (and remove) the task, also if already removed
+            self.computing.manager.stop_task(task)
+            self.assertNotIn(task.tid, self.daemon.containers)
+            self.computing.manager.stop_task(task)
+            self.assertEqual(Task.objects.get(uuid=task.uuid).status, TaskStatuses.stopped)
+
+            # A container with no IP address: an error, and no leftovers clashing with the next attempt
+            self.daemon.network = None
+            task = Task.objects.create(user=self.user, name='noip', status=TaskStatuses.created, computing=self.computing, container=self.container)
+            containers_count = len(self.daemon.containers)
+            with self.assertRaises(Exception) as context:
+                self.computing.manager.start_task(task)
+            self.assertIn('Cannot get the IP address', str(context.exception))
+            self.assertEqual(len(self.daemon.containers), containers_count)
@@ -0,0 +1,81 @@
+import time
+import asyncio
+import threading
+from django.test import TestCase
+
+from ..executor import CommandExecutor
+
+class ExecutorTests(TestCase):
+
+    def setUp(self):
+        self.executor = CommandExecutor(max_workers=2, max_per_host=1, default_timeout=5, max_output_bytes=10)
+
+
+    def test_run(self):
+        '''Test running a command and getting its result'''
+
+        out = self.executor.run('echo hello && echo world >&2 && exit 3')
+        self.assertEqual(out.stdout, 'hello')
+        self.assertEqual(out.stderr, 'world')
+        self.assertEqual(out.exit_code, 3)
+        self.assertFalse(out.timed_out)
+
+
+    def test_timeout_and_caps(self):
+        '''Test command timeouts and output byte caps'''
+
+        out = self.executor.run('sleep 10', timeout=0.2)
+        self.assertTrue(out.timed_out)
+        self.assertNotEqual(out.exit_code, 0)
+
+        out = self.executor.run('printf 0123456789ABCDEF')
+        self.assertEqual(out.stdout, '0123456789')
+        self.assertTrue(out.stdout_truncated)
+
+
+    def test_submit_and_cancel(self):
+        '''Test submitting, awaiting and cancelling commands'''
+
+        handle = self.executor.submit('sleep 10')
+        time.sleep(0.2)
+        handle.cancel()
+        out = handle.result(timeout=5)
+        self.assertTrue(out.cancelled)
+
+        async def await_command():
+            return await self.executor.submit('echo async')
+        self.assertEqual(asyncio.new_event_loop().run_until_complete(await_command()).stdout, 'async')
+
+
+    def test_limits(self):
+        '''Test the per-host and extra concurrency limits'''
+
+        # Waiting on the extra limit does not hold the slot of the host
+        sessions = threading.BoundedSemaphore(1)
+        sessions.acquire()
+        handle = self.executor.submit('echo waiting', host='myhost', semaphore=sessions)
+        time.sleep(0.2)
+        self.assertEqual(self.executor.run('echo hello', host='myhost', timeout=1).stdout, 'hello')
+        sessions.release()
+        self.assertEqual(handle.result(timeout=5).stdout, 'waiting')
+
+        # While a host slot is busy, local commands (with no host) are not limited
+        handle = self.executor.submit('sleep 0.5', host='myhost')
+        time.sleep(0.1)
+        self.assertEqual(self.executor.run('echo local', timeout=1).stdout, 'local')
+        handle.result(timeout=5)
+
+
+    def test_stream(self):
+        '''Test streaming a command, holding its semaphores while open'''
+
+        sessions = threading.BoundedSemaphore(1)
+        stream = self.executor.stream('echo hello && sleep 10', semaphores=[sessions])
+        self.assertEqual(stream.readline(), b'hello\n')
+        with self.assertRaises(Exception):
+            self.executor.stream('echo hello', semaphores=[sessions], wait_timeout=0.1)
+
+        stream.close()
+        stream.close()
+        self.assertTrue(sessions.acquire(blocking=False))
+        sessions.release()
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..fields import JSONText
+from ..models import Task, TaskStatuses, Container, Computing, ComputingSysConf
+
+
+class JSONFieldTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, container and computing
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MySlurm', type='slurm')
+
+    def create_task(self, name, computing_options):
+        return Task.objects.create(user=self.user, name=name, status=TaskStatuses.created, computing=self.computing,
+                                   container=self.container, computing_options=computing_options)
+
+    def test_lazy_decoding(self):
+        '''Test that JSON values are decoded only when accessed, and saved as they are otherwise'''
+
+        self.create_task('mytask', {'partition': 'gpu', 'cpus': 4})
+
+        task = Task.objects.get(name='mytask')
+        self.assertIsInstance(task.__dict__['computing_options'], JSONText)
+        task.name = 'renamed'
+        task.save()
+
+        task = Task.objects.get(name='renamed')
+        self.assertEqual(task.computing_options, {'partition': 'gpu', 'cpus': 4})
+        self.assertEqual(task.__dict__['computing_options'], {'partition': 'gpu', 'cpus': 4})
+        task.computing_options['cpus'] = 8
+        task.save()
+        self.assertEqual(Task.objects.get(name='renamed').computing_options, {'partition': 'gpu', 'cpus': 8})
+
+        # Deferred, and not set
+        self.assertEqual(Task.objects.only('name').get(name='renamed').computing_options, {'partition': 'gpu', 'cpus': 8})
+        self.assertEqual(self.create_task('another', None).computing_options, None)
+        self.assertEqual(Task.objects.get(name='another').computing_options, None)
+
+    def test_key_lookups(self):
+        '''Test filtering on keys of JSON objects, on the database side'''
+
+        self.create_task('task1', {'partition': 'gpu', 'cpus': 4})
+        self.create_task('task2', {'partition': 'cpu', 'cpus': 16, 'extra': {'account': 'astro'}})
+        self.create_task('task3', None)
+
+        def names(**filters):
+            return sorted(Task.objects.filter(**filters).values_list('name', flat=True))
+
+        self.assertEqual(names(computing_options__partition='gpu'), ['task1'])
+        self.assertEqual(names(computing_options__cpus__gt=8), ['task2'])
+        self.assertEqual(names(computing_options__partition__in=['gpu', 'cpu']), ['task1', 'task2'])
+        self.assertEqual(names(computing_options__extra__account='astro'), ['task2'])
+        self.assertEqual(names(computing_options__partition__isnull=True), ['task3'])
+
+        ComputingSysConf.objects.create(computing=self.computing, data={'master': 'slurm.example.com'})
+        self.assertEqual(ComputingSysConf.objects.get(data__master='slurm.example.com').data, {'master': 'slurm.example.com'})
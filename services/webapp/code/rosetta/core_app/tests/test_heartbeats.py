@@ -0,0 +1,157 @@
+import io
+import time
+import subprocess
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .common import BaseAPITestCase
+from .test_reconciler import FakeSSHConnection
+from ..models import Task, TaskStatuses, Container, Computing, ComputingSysConf, ComputingUserConf, KeyPair
+from ..computing_managers import SlurmComputingManager
+from ..heartbeats import HeartbeatBuffer, heartbeat_buffer
+from ..reconciler import reconcile_task_statuses
+from .. import agent
+
+
+class HeartbeatsTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user with keys
+        self.user = User.objects.create_user('testuser', password='testpass')
+        KeyPair.objects.create(user=self.user, default=True, private_key_file='/tmp/id_rsa', public_key_file='/tmp/id_rsa.pub')
+
+        # Create test container and Slurm computing
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='singularity', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MySlurm', type='slurm', requires_user_keys=True)
+        ComputingSysConf.objects.create(computing=self.computing, data={'master': 'slurmclustermaster-main'})
+        ComputingUserConf.objects.create(computing=self.computing, user=self.user, data={'user': 'slurmtestuser'})
+        heartbeat_buffer.heartbeats.clear()
+
+
+    def create_task(self, name, pid, status=TaskStatuses.running):
+        return Task.objects.create(user=self.user, name=name, status=status, pid=pid, computing=self.computing, container=self.container)
+
+
+    def test_heartbeat_api(self):
+        '''Test receiving heartbeats, buffered'''
+
+        task = self.create_task('mytask', 1)
+
+        resp = self.client.get('/api/v1/base/agent/heartbeat/?task_uuid={}&load=1.50&mem=42.00'.format(task.uuid))
+        self.assertEqual(resp.content, b'OK')
+        self.assertIsNone(Task.objects.get(uuid=task.uuid).last_heartbeat)
+
+        self.assertEqual(heartbeat_buffer.flush(), 1)
+        task = Task.objects.get(uuid=task.uuid)
+        self.assertIsNotNone(task.last_heartbeat)
+        self.assertEqual(task.heartbeat_load, 1.5)
+        self.assertEqual(task.heartbeat_mem, 42.0)
+
+        # Invalid ones
+        resp = self.client.get('/api/v1/base/agent/heartbeat/?task_uuid=wrong')
+        self.assertEqual(resp.content, b'Task uuid not valid (got "wrong")')
+        resp = self.client.get('/api/v1/base/agent/heartbeat/?task_uuid={}&load=high'.format(task.uuid))
+        self.assertEqual(resp.content, b'Load not valid (got "high")')
+
+
+    def test_heartbeat_api_not_running(self):
+        '''Test refusing the heartbeats of unknown or not running tasks, so that their agents stop'''
+
+        stopped = self.create_task('stopped', 1, status=TaskStatuses.stopped)
+        exited = self.create_task('exited', 2, status=TaskStatuses.exited)
+
+        resp = self.client.get('/api/v1/base/agent/heartbeat/?task_uuid=00000000-0000-0000-0000-000000001000')
+        self.assertEqual(resp.content, b'Unknown task uuid "00000000-0000-0000-0000-000000001000"')
+        resp = self.client.get('/api/v1/base/agent/heartbeat/?task_uuid={}'.format(stopped.uuid))
+        self.assertEqual(resp.content, b'Task not running (got status "stopped")')
+        resp = self.client.get('/api/v1/base/agent/heartbeat/?task_uuid={}'.format(exited.uuid))
+        self.assertEqual(resp.content, b'Task not running (got status "exited")')
+        self.assertEqual(heartbeat_buffer.heartbeats, {})
+
+
+    def test_batched_writes(self):
+        '''Test writing the heartbeats in batches'''
+
+        tasks = [self.create_task('task{}'.format(i), i) for i in range(5)]
+        stopped = self.create_task('stopped', 5, status=TaskStatuses.stopped)
+        buffer = HeartbeatBuffer(flush_interval=3600, max_size=6)
+
+        with self.assertNumQueries(0):
+            for task in tasks:
+                buffer.add(task.uuid, load=1.0)
+
+        # The sixth triggers the flush, in a single query (in a transaction)
+        with self.assertNumQueries(1):
+            buffer.add(stopped.uuid, load=1.0)
+        self.assertEqual(Task.objects.filter(last_heartbeat__isnull=False).count(), 5)
+        self.assertIsNone(Task.objects.get(uuid=stopped.uuid).last_heartbeat)
+
+
+    def test_timer_flush(self):
+        '''Test writing the heartbeats once the flush interval passed, even with no more coming'''
+
+        task = self.create_task('mytask', 1)
+        buffer = HeartbeatBuffer(flush_interval=0.1, max_size=10)
+
+        # The timer thread has its own database connection (which does not see the test transaction)
+        with mock.patch.object(buffer, 'flush') as flush:
+            buffer.add(task.uuid, load=1.0)
+            self.assertFalse(flush.called)
+            for _ in range(50):
+                if flush.called:
+                    break
+                time.sleep(0.1)
+            self.assertTrue(flush.called)
+        buffer.stopped.set()
+
+
+    def test_stopped_heartbeats(self):
+        '''Test polling the tasks whose heartbeats stopped (before setting them as exited), and not the others'''
+
+        alive = self.create_task('alive', 1)
+        stale_running = self.create_task('stale_running', 2)
+        stale_done = self.create_task('stale_done', 3)
+        silent = self.create_task('silent', 4)
+        Task.objects.filter(uuid=alive.uuid).update(last_heartbeat=timezone.now())
+        Task.objects.filter(uuid__in=[stale_running.uuid, stale_done.uuid]).update(last_heartbeat=timezone.now() - timedelta(seconds=600))
+
+        # The heartbeats might have stopped because of an outage of the webapp: only the task done is set as exited
+        ssh_connection = FakeSSHConnection(stdout='2 RUNNING\n4 RUNNING\n#0\n3|COMPLETED\n')
+        with mock.patch.object(SlurmComputingManager, '_get_ssh_connection', return_value=ssh_connection):
+            self.assertEqual(reconcile_task_statuses(), 1)
+        job_ids = ssh_connection.commands[0].split('-j ')[1].split(';')[0].split(',')
+        self.assertEqual(sorted(job_ids), ['2', '3', '4'])
+
+        self.assertEqual(Task.objects.get(uuid=alive.uuid).status, TaskStatuses.running)
+        self.assertEqual(Task.objects.get(uuid=stale_running.uuid).status, TaskStatuses.running)
+        self.assertEqual(Task.objects.get(uuid=stale_done.uuid).status, TaskStatuses.exited)
+        self.assertEqual(Task.objects.get(uuid=silent.uuid).status, TaskStatuses.running)
+
+
+    def test_agent_heartbeats(self):
+        '''Test the agent sending heartbeats until the task container exits'''
+
+        self.assertIn('load', agent.get_host_stats())
+        self.assertIn('mem', agent.get_host_stats())
+
+        urls = []
+        def urlopen(url):
+            urls.append(url)
+            return io.BytesIO(b'OK')
+
+        with mock.patch.object(agent, 'urlopen', urlopen), mock.patch.object(agent.time, 'sleep'), \
+             mock.patch.object(agent, 'is_alive', side_effect=[True, True, False]):
+            agent.send_heartbeats('00000000-0000-0000-0000-000000001000', 'http://webapp', 42, 60)
+
+        self.assertEqual(len(urls), 2)
+        self.assertTrue(urls[0].startswith('http://webapp/api/v1/base/agent/heartbeat/?task_uuid=00000000-0000-0000-0000-000000001000&load='))
+        self.assertFalse(agent.is_alive(subprocess_pid()))
+
+
+def subprocess_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
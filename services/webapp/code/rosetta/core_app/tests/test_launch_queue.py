@@ -0,0 +1,146 @@
+from unittest import mock
+from datetime import timedelta
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Task, TaskStatuses, TaskLaunch, TaskLaunchStatuses, Container, Computing, ComputingSysConf, ComputingUserConf, KeyPair
+from ..computing_managers import LocalComputingManager, SlurmComputingManager
+from ..launch_queue import TaskLauncher, enqueue_task_launch, enqueue_task_launches
+from .test_reconciler import FakeSSHConnection
+
+def start_task(task):
+    task.tid = 'tid'
+    task.status = TaskStatuses.running
+    task.save()
+
+
+class LaunchQueueTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, container and local computing
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MyLocal', type='local')
+        self.launcher = TaskLauncher(workers=4, max_per_computing=2, max_attempts=2, retry_delay=10, timeout=600)
+
+
+    def create_task(self, name):
+        task = Task.objects.create(user=self.user, name=name, status=TaskStatuses.created, computing=self.computing, container=self.container)
+        enqueue_task_launch(task)
+        return task
+
+
+    def test_launch(self):
+        '''Test launching queued tasks, within the per-computing limits'''
+
+        tasks = [self.create_task('task{}'.format(i)) for i in range(3)]
+
+        # Only two at a time on the same computing
+        launches = self.launcher.claim()
+        self.assertEqual(len(launches), 2)
+        self.assertEqual(self.launcher.claim(), [])
+
+        with mock.patch.object(LocalComputingManager, '_start_task', side_effect=start_task):
+            for launch in launches:
+                self.launcher.execute(launch)
+            launches = self.launcher.claim()
+            self.assertEqual(len(launches), 1)
+            self.launcher.execute(launches[0])
+
+        for task in tasks:
+            self.assertEqual(Task.objects.get(uuid=task.uuid).status, TaskStatuses.running)
+        self.assertEqual(TaskLaunch.objects.filter(status=TaskLaunchStatuses.done).count(), 3)
+
+
+    def test_retries(self):
+        '''Test retrying failed launches, and giving up'''
+
+        task = self.create_task('mytask')
+
+        with mock.patch.object(LocalComputingManager, '_start_task', side_effect=Exception('Docker is down')):
+            self.launcher.execute(self.launcher.claim()[0])
+            launch = TaskLaunch.objects.get(task=task)
+            self.assertEqual(launch.status, TaskLaunchStatuses.queued)
+            self.assertEqual(launch.error, 'Docker is down')
+
+            # Not before its next attempt time
+            self.assertEqual(self.launcher.claim(), [])
+            TaskLaunch.objects.update(next_attempt_at=timezone.now())
+            self.launcher.execute(self.launcher.claim()[0])
+
+        self.assertEqual(TaskLaunch.objects.get(task=task).status, TaskLaunchStatuses.failed)
+        self.assertEqual(Task.objects.get(uuid=task.uuid).status, TaskStatuses.exited)
+
+
+    def test_stale(self):
+        '''Test requeueing stale launches, but not the ones still being executed, and never starting a task twice'''
+
+        task = self.create_task('mytask')
+        launch = self.launcher.claim()[0]
+        self.launcher.running.add(launch.uuid)
+        TaskLaunch.objects.update(started=timezone.now() - timedelta(seconds=3600))
+
+        # Still being executed by this launcher
+        self.assertEqual(self.launcher.requeue_stale(), 0)
+
+        # Lost, for another one (i.e. after a restart)
+        other_launcher = TaskLauncher(workers=4, max_per_computing=2, max_attempts=2, retry_delay=10, timeout=600)
+        other_launcher.name = 'otherhost:1234'
+        self.assertEqual(other_launcher.requeue_stale(), 1)
+        other_launch = other_launcher.claim()[0]
+
+        with mock.patch.object(LocalComputingManager, '_start_task', side_effect=start_task) as mock_start_task:
+            other_launcher.execute(other_launch)
+            self.launcher.execute(launch)
+            self.assertEqual(mock_start_task.call_count, 1)
+
+        self.assertEqual(Task.objects.get(uuid=task.uuid).status, TaskStatuses.running)
+        self.assertEqual(TaskLaunch.objects.get(task=task).status, TaskLaunchStatuses.done)
+
+
+    def test_cancel(self):
+        '''Test stopping a task still queued for launch'''
+
+        task = self.create_task('mytask')
+        with mock.patch.object(LocalComputingManager, '_stop_task') as stop_task:
+            self.computing.manager.stop_task(task)
+            self.assertFalse(stop_task.called)
+        self.assertEqual(Task.objects.get(uuid=task.uuid).status, TaskStatuses.stopped)
+        self.assertEqual(self.launcher.claim(), [])
+
+
+    def test_batch(self):
+        '''Test launching a batch of identical tasks at once, as a Slurm job array'''
+
+        KeyPair.objects.create(user=self.user, default=True, private_key_file='/tmp/id_rsa', public_key_file='/tmp/id_rsa.pub')
+        container = Container.objects.create(name='MySingCont', image='myimage', type='singularity', registry='docker_hub')
+        computing = Computing.objects.create(name='MySlurm', type='slurm', requires_user_keys=True)
+        ComputingSysConf.objects.create(computing=computing, data={'master': 'slurmclustermaster-main'})
+        ComputingUserConf.objects.create(computing=computing, user=self.user, data={'user': 'slurmtestuser'})
+
+        tasks = [Task.objects.create(user=self.user, name='task_{}'.format(i+1), status=TaskStatuses.created, computing=computing, container=container) for i in range(3)]
+        launches = enqueue_task_launches(tasks)
+        self.assertEqual(len(set([launch.batch for launch in launches])), 1)
+
+        # The whole batch is claimed at once, and counts as a single launch
+        launcher = TaskLauncher(workers=1, max_per_computing=1, max_attempts=2, retry_delay=10, timeout=600)
+        other_task = self.create_task('other')
+        launches = launcher.claim()
+        self.assertEqual(len(launches), 3)
+
+        # And its tasks are started with a single submission
+        ssh_connection = FakeSSHConnection(stdout='Submitted batch job 42')
+        with mock.patch.object(SlurmComputingManager, '_get_ssh_connection', return_value=ssh_connection):
+            launcher.execute_batch(launches)
+        self.assertEqual(len(ssh_connection.commands), 1)
+        self.assertIn('--array=0-2', ssh_connection.commands[0])
+
+        for i, task in enumerate(tasks):
+            task = Task.objects.get(uuid=task.uuid)
+            self.assertEqual(task.status, TaskStatuses.sumbitted)
+            self.assertEqual(task.pid, 42)
+            self.assertEqual(task.tid, '42_{}'.format(i))
+        self.assertEqual(TaskLaunch.objects.filter(status=TaskLaunchStatuses.done).count(), 3)
+        self.assertEqual(TaskLaunch.objects.get(task=other_task).status, TaskLaunchStatuses.queued)
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+import tempfile
+from unittest import mock
+from django.core.cache import cache
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Task, TaskStatuses, Container, Computing
+from ..executor import executor
+from ..computing_managers import ComputingManager, SlurmComputingManager
+from ..log_streams import TaskLogStreams, stream_events, format_event
+
+class LogStreamsTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, container, Slurm computing and task
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='singularity', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MySlurm', type='slurm')
+        self.task = Task.objects.create(user=self.user, name='mytask', status=TaskStatuses.running, pid=1, computing=self.computing, container=self.container)
+
+        # Task log file
+        self.log_file = tempfile.NamedTemporaryFile(delete=False)
+        self.log_file.write(b'line 1\n')
+        self.log_file.close()
+        cache.clear()
+
+        self.upstreams = []
+
+
+    def tearDown(self):
+        os.remove(self.log_file.name)
+
+
+    def read_log(self, task, offset=0, tail=None):
+        # Run the log read command locally
+        manager = ComputingManager()
+        out = executor.run(manager._get_log_read_command(self.log_file.name, offset, tail))
+        return manager._parse_log_read_output(out, offset, tail)
+
+
+    def follow_log(self, task, offset=0):
+        # Run the log follow command locally
+        upstream = executor.stream(ComputingManager()._get_log_follow_command(self.log_file.name, offset))
+        self.upstreams.append(upstream)
+        return upstream
+
+
+    def test_shared_stream(self):
+        '''Test that all the viewers of a task log share a single upstream'''
+
+        with mock.patch.object(SlurmComputingManager, '_get_task_log', side_effect=self.read_log), \
+             mock.patch.object(SlurmComputingManager, '_follow_task_log', side_effect=self.follow_log):
+
+            task_log_streams = TaskLogStreams()
+            subscriptions = [task_log_streams.subscribe(self.task) for _ in range(10)]
+            self.assertEqual(len(self.upstreams), 1)
+            self.assertEqual(subscriptions[0].backlog, 'line 1\n')
+
+            # New lines reach all the viewers
+            with open(self.log_file.name, 'ab') as f:
+                f.write(b'line 2\nline 3\n')
+            for subscription in subscriptions:
+                self.assertEqual(subscription.get(timeout=5), 'line 2\n')
+                self.assertEqual(subscription.get(timeout=5), 'line 3\n')
+
+            # The backlog is kept up to date for new viewers
+            subscription = task_log_streams.subscribe(self.task)
+            self.assertEqual(subscription.backlog, 'line 1\nline 2\nline 3\n')
+            subscriptions.append(subscription)
+
+            # As server-sent events
+            events = stream_events(subscription)
+            self.assertEqual(next(events), 'event: backlog\ndata: line 1\ndata: line 2\ndata: line 3\ndata: \n\n')
+            with open(self.log_file.name, 'ab') as f:
+                f.write(b'line 4\n')
+            self.assertEqual(next(events), 'data: line 4\n\n')
+            events.close()
+
+            # The upstream is closed with the last viewer (and the remote follow command exits)
+            for subscription in subscriptions[:-1]:
+                subscription.close()
+            self.assertEqual(self.upstreams[0].process.wait(timeout=5), -9)
+            self.assertEqual(task_log_streams.streams, {})
+
+            # And restarted by the next one
+            task_log_streams.subscribe(self.task).close()
+            self.assertEqual(len(self.upstreams), 2)
+
+
+    def test_slow_start(self):
+        '''Test that starting a stream does not hold up the viewers of the other tasks'''
+
+        other_task = Task.objects.create(user=self.user, name='othertask', status=TaskStatuses.running, pid=2, computing=self.computing, container=self.container)
+
+        def slow_read_log(task, offset=0, tail=None):
+            # An unreachable host, for the first task only
+            if task.uuid == self.task.uuid:
+                time.sleep(1)
+            return self.read_log(task, offset, tail)
+
+        with mock.patch.object(SlurmComputingManager, '_get_task_log', side_effect=slow_read_log), \
+             mock.patch.object(SlurmComputingManager, '_follow_task_log', side_effect=self.follow_log):
+
+            task_log_streams = TaskLogStreams()
+            subscriptions = []
+            threads = [threading.Thread(target=lambda: subscriptions.append(task_log_streams.subscribe(self.task))) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+
+            start_t = time.time()
+            other_subscription = task_log_streams.subscribe(other_task)
+            self.assertLess(time.time() - start_t, 0.5)
+
+            # The viewers of the slow one waited for it, and share its upstream
+            for thread in threads:
+                thread.join(timeout=5)
+            self.assertEqual(len(subscriptions), 2)
+            self.assertIs(subscriptions[0].stream, subscriptions[1].stream)
+            self.assertEqual(len(self.upstreams), 2)
+
+            for subscription in subscriptions + [other_subscription]:
+                subscription.close()
+            self.assertEqual(task_log_streams.streams, {})
+
+
+    def test_format_event(self):
+        '''Test server-sent events formatting'''
+        self.assertEqual(format_event('a\nb\rc', event='backlog'), 'event: backlog\ndata: a\ndata: b\ndata: c\n\n')
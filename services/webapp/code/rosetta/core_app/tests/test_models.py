@@ -1,9 +1,10 @@
 import json
+import uuid
 
 from django.contrib.auth.models import User
         
 from .common import BaseAPITestCase
-from ..models import Profile, Computing, ComputingSysConf
+from ..models import Profile, Computing, ComputingSysConf, Container, Task, TaskStatuses
 
 class Modeltest(BaseAPITestCase):
 
@@ -27,3 +28,20 @@ class Modeltest(BaseAPITestCase):
         self.assertEqual(ComputingSysConf.objects.all()[0].data, {'myvar':42})
         
 
+
+    def test_short_ids(self):
+        '''Test the stored short IDs, unique even when the UUID prefixes clash'''
+
+        container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        computing = Computing.objects.create(name='MyComp', type='local')
+        task = Task.objects.create(user=self.user, name='MyTask', status=TaskStatuses.created, computing=computing, container=container,
+                                   uuid=uuid.UUID('12345678-aaaa-1111-2222-333344445555'))
+        self.assertEqual(task.id, '12345678')
+        self.assertEqual(container.id, str(container.uuid).split('-')[0])
+
+        another_task = Task.objects.create(user=self.user, name='MyTask', status=TaskStatuses.created, computing=computing, container=container,
+                                           uuid=uuid.UUID('12345678-bbbb-1111-2222-333344445555'))
+        self.assertEqual(another_task.id, '12345678-bbbb')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Task.objects.get(short_id='12345678-bbbb').uuid, another_task.uuid)
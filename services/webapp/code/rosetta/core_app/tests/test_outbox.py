@@ -0,0 +1,80 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import override_settings
+from django.utils import timezone
+
+from .common import BaseAPITestCase
+from ..models import OutboxEmail, OutboxEmailStatuses
+from ..outbox import EmailSender, queue_email
+from ..utils import email_sink
+
+
+@override_settings(DJANGO_EMAIL_SERVICE='Sink')
+class OutboxTests(BaseAPITestCase):
+
+    def setUp(self):
+        del email_sink[:]
+        self.sender = EmailSender(batch_size=2, rate=1000, max_attempts=2, retry_delay=10, timeout=300)
+
+
+    def test_send(self):
+        '''Test sending the queued emails, in batches'''
+
+        for i in range(3):
+            queue_email(to='user{}@rosetta.local'.format(i), subject='Subject {}'.format(i), text='Text')
+        self.assertEqual(email_sink, [])
+
+        self.assertEqual(self.sender.process(), 2)
+        self.assertEqual(self.sender.process(), 1)
+        self.assertEqual(self.sender.process(), 0)
+
+        self.assertEqual([email['to'] for email in email_sink], ['user0@rosetta.local', 'user1@rosetta.local', 'user2@rosetta.local'])
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+
+
+    def test_retries(self):
+        '''Test retrying failed deliveries, and giving up'''
+
+        queue_email(to='user@rosetta.local', subject='Subject', text='Text')
+
+        with mock.patch('rosetta.core_app.outbox.send_email', side_effect=Exception('Mail service is down')):
+            self.sender.process()
+            email = OutboxEmail.objects.get()
+            self.assertEqual(email.status, OutboxEmailStatuses.queued)
+            self.assertEqual(email.error, 'Mail service is down')
+
+            # Not before its next attempt time
+            self.assertEqual(self.sender.process(), 0)
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+            self.sender.process()
+
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmailStatuses.failed)
+        self.assertEqual(email_sink, [])
+
+
+    def test_rate_limit(self):
+        '''Test keeping the deliveries within the rate limit'''
+
+        sender = EmailSender(batch_size=10, rate=2)
+        for i in range(3):
+            queue_email(to='user{}@rosetta.local'.format(i), subject='Subject', text='Text')
+
+        with mock.patch('rosetta.core_app.outbox.time.sleep') as sleep:
+            sender.process()
+        self.assertEqual(sleep.call_count, 2)
+        for call in sleep.call_args_list:
+            self.assertGreater(call[0][0], 0.4)
+        self.assertEqual(len(email_sink), 3)
+
+
+    def test_requeue_stale(self):
+        '''Test queuing again the emails whose sender died'''
+
+        queue_email(to='user@rosetta.local', subject='Subject', text='Text')
+        self.assertEqual(len(self.sender.claim()), 1)
+        self.assertEqual(self.sender.requeue_stale(), 0)
+
+        OutboxEmail.objects.update(started=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(self.sender.requeue_stale(), 1)
+        self.sender.process()
+        self.assertEqual(len(email_sink), 1)
@@ -0,0 +1,111 @@
+from unittest import mock
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase, FakeDockerDaemon
+from ..models import Task, TaskStatuses, Container, Computing, ComputingSysConf, ComputingUserConf, KeyPair
+from ..executor import CommandResult
+from ..computing_managers import SlurmComputingManager
+from ..reconciler import reconcile_task_statuses
+from ..docker_client import DockerClient
+from .. import computing_managers
+
+class FakeSSHConnection(object):
+
+    def __init__(self, stdout, stderr='', exit_code=0):
+        self.commands = []
+        self.out = CommandResult('', stdout=stdout, stderr=stderr, exit_code=exit_code)
+
+    def run(self, command, timeout=None):
+        self.commands.append(command)
+        return self.out
+
+
+class ReconcilerTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user with keys
+        self.user = User.objects.create_user('testuser', password='testpass')
+        KeyPair.objects.create(user=self.user, default=True, private_key_file='/tmp/id_rsa', public_key_file='/tmp/id_rsa.pub')
+
+        # Create test container and Slurm computing
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='singularity', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MySlurm', type='slurm', requires_user_keys=True)
+        ComputingSysConf.objects.create(computing=self.computing, data={'master': 'slurmclustermaster-main'})
+        ComputingUserConf.objects.create(computing=self.computing, user=self.user, data={'user': 'slurmtestuser'})
+
+
+    def test_slurm_reconcile(self):
+        '''Test batched Slurm task status reconciliation'''
+
+        pending = Task.objects.create(user=self.user, name='pending', status=TaskStatuses.running, pid=1, computing=self.computing, container=self.container)
+        running = Task.objects.create(user=self.user, name='running', status=TaskStatuses.running, pid=2, computing=self.computing, container=self.container)
+        finished = Task.objects.create(user=self.user, name='finished', status=TaskStatuses.running, pid=3, computing=self.computing, container=self.container)
+        vanished = Task.objects.create(user=self.user, name='vanished', status=TaskStatuses.sumbitted, pid=4, computing=self.computing, container=self.container)
+
+        ssh_connection = FakeSSHConnection(stdout='1 PENDING\n2 RUNNING\n#0\n3|CANCELLED by 1000\n')
+        with mock.patch.object(SlurmComputingManager, '_get_ssh_connection', return_value=ssh_connection):
+            self.assertEqual(reconcile_task_statuses(), 3)
+
+        # A single query for all the jobs
+        self.assertEqual(len(ssh_connection.commands), 1)
+        self.assertIn('-j 4,3,2,1', ssh_connection.commands[0])
+
+        self.assertEqual(Task.objects.get(uuid=pending.uuid).status, TaskStatuses.sumbitted)
+        self.assertEqual(Task.objects.get(uuid=running.uuid).status, TaskStatuses.running)
+        self.assertEqual(Task.objects.get(uuid=finished.uuid).status, TaskStatuses.exited)
+        self.assertEqual(Task.objects.get(uuid=vanished.uuid).status, TaskStatuses.exited)
+
+        # Controller down: nothing touched
+        Task.objects.filter(uuid=finished.uuid).update(status=TaskStatuses.running)
+        ssh_connection = FakeSSHConnection(stdout='#1', stderr='slurm_load_jobs error: Unable to contact slurm controller')
+        with mock.patch.object(SlurmComputingManager, '_get_ssh_connection', return_value=ssh_connection):
+            self.assertEqual(reconcile_task_statuses(), 0)
+        self.assertEqual(Task.objects.get(uuid=finished.uuid).status, TaskStatuses.running)
+
+
+    def test_local_reconcile(self):
+        '''Test batched local task status reconciliation, writing only the changed ones'''
+
+        daemon = FakeDockerDaemon()
+        docker_client = DockerClient(socket_path=daemon.socket_path, api_version='1.24', timeout=5)
+        daemon.containers = {'aaa': {'Id': 'aaa', 'State': 'running'}, 'bbb': {'Id': 'bbb', 'State': 'running'}}
+
+        computing = Computing.objects.create(name='MyLocal', type='local')
+        running = Task.objects.create(user=self.user, name='running', status=TaskStatuses.running, tid='aaa', computing=computing, container=self.container)
+        started = Task.objects.create(user=self.user, name='started', status=TaskStatuses.created, tid='bbb', computing=computing, container=self.container)
+        vanished = Task.objects.create(user=self.user, name='vanished', status=TaskStatuses.running, tid='ccc', computing=computing, container=self.container)
+        never_started = Task.objects.create(user=self.user, name='never_started', status=TaskStatuses.created, computing=computing, container=self.container)
+
+        try:
+            with mock.patch.object(computing_managers, 'docker_client', docker_client):
+                self.assertEqual(reconcile_task_statuses(), 2)
+        finally:
+            docker_client.close()
+            daemon.stop()
+
+        # A single listing for all the containers
+        self.assertEqual(daemon.requests, [('GET', '/v1.24/containers/json')])
+
+        self.assertEqual(Task.objects.get(uuid=running.uuid).status, TaskStatuses.running)
+        self.assertEqual(Task.objects.get(uuid=started.uuid).status, TaskStatuses.running)
+        self.assertEqual(Task.objects.get(uuid=vanished.uuid).status, TaskStatuses.exited)
+        self.assertEqual(Task.objects.get(uuid=never_started.uuid).status, TaskStatuses.created)
+
+
+    def test_slurm_reconcile_job_array(self):
+        '''Test Slurm task status reconciliation for the elements of a job array'''
+
+        running = Task.objects.create(user=self.user, name='task_1', status=TaskStatuses.running, pid=5, tid='5_0', computing=self.computing, container=self.container)
+        finished = Task.objects.create(user=self.user, name='task_2', status=TaskStatuses.running, pid=5, tid='5_1', computing=self.computing, container=self.container)
+
+        ssh_connection = FakeSSHConnection(stdout='5_0 RUNNING\n#0\n5_1|COMPLETED\n')
+        with mock.patch.object(SlurmComputingManager, '_get_ssh_connection', return_value=ssh_connection):
+            self.assertEqual(reconcile_task_statuses(), 1)
+
+        # Array elements are listed one by one
+        self.assertIn('-r', ssh_connection.commands[0])
+        self.assertIn('5_1,5_0', ssh_connection.commands[0])
+
+        self.assertEqual(Task.objects.get(uuid=running.uuid).status, TaskStatuses.running)
+        self.assertEqual(Task.objects.get(uuid=finished.uuid).status, TaskStatuses.exited)
@@ -0,0 +1,47 @@
+import os
+import tempfile
+from unittest import mock
+from django.test import TestCase
+
+from ..executor import CommandResult
+from ..ssh_pool import SSHConnectionPool
+
+class SSHPoolTests(TestCase):
+
+    def setUp(self):
+        self.control_dir = os.path.join(tempfile.mkdtemp(), 'ssh')
+        self.pool = SSHConnectionPool(control_dir=self.control_dir, idle_timeout=60, max_sessions=2)
+
+
+    def test_get_connection(self):
+        '''Test getting pooled connections, with persistent masters for the port forwardings'''
+
+        connection = self.pool.get_connection(host='slurmclustermaster', user='testuser', key_file='/tmp/id_rsa')
+        self.assertIs(self.pool.get_connection(host='slurmclustermaster', user='testuser', key_file='/tmp/id_rsa'), connection)
+        self.assertEqual(os.stat(self.control_dir).st_mode & 0o777, 0o700)
+        self.assertIn('-o ControlPersist=60', connection.command_prefix)
+        self.assertTrue(connection.command_prefix.endswith(' testuser@slurmclustermaster '))
+
+        # Connections carrying forwardings get their own master, which does not expire when idle
+        tunnel_connection = self.pool.get_connection(host='slurmclustermaster', user='testuser', key_file='/tmp/id_rsa', persistent=True)
+        self.assertIsNot(tunnel_connection, connection)
+        self.assertNotEqual(tunnel_connection.control_path, connection.control_path)
+        self.assertIn('-o ControlPersist=yes', tunnel_connection.command_prefix)
+
+
+    def test_run(self):
+        '''Test running commands over the master, which is re-checked after SSH-level errors'''
+
+        connection = self.pool.get_connection(host='slurmclustermaster', user='testuser')
+        with mock.patch.object(connection, 'check_master', return_value=True) as check_master:
+            with mock.patch('rosetta.core_app.ssh_pool.executor') as executor:
+                executor.run.return_value = CommandResult('', stdout='hello', exit_code=0)
+                self.assertEqual(connection.run('echo hello').stdout, 'hello')
+                self.assertEqual(connection.run('echo hello').stdout, 'hello')
+                self.assertEqual(check_master.call_count, 1)
+                self.assertEqual(executor.run.call_args[1]['semaphore'], connection.sessions)
+
+                executor.run.return_value = CommandResult('', stderr='Connection reset', exit_code=255)
+                connection.run('echo hello')
+                connection.run('echo hello')
+                self.assertEqual(check_master.call_count, 2)
@@ -0,0 +1,92 @@
+import os
+import tempfile
+from unittest import mock
+from django.core.cache import cache
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Task, TaskStatuses, Container, Computing
+from ..executor import executor
+from ..computing_managers import ComputingManager, SlurmComputingManager
+from ..task_logs import get_task_log
+
+class TaskLogsTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, container and Slurm computing
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='singularity', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MySlurm', type='slurm')
+        self.task = Task.objects.create(user=self.user, name='mytask', status=TaskStatuses.running, pid=1, computing=self.computing, container=self.container)
+
+        # Task log file
+        self.log_file = tempfile.NamedTemporaryFile(delete=False)
+        self.log_file.write(b'line 1\nline 2\nline 3\n')
+        self.log_file.close()
+        cache.clear()
+
+
+    def tearDown(self):
+        os.remove(self.log_file.name)
+
+
+    def read_log(self, task, offset=0, tail=None):
+        # Run the log read command locally
+        manager = ComputingManager()
+        out = executor.run(manager._get_log_read_command(self.log_file.name, offset, tail))
+        return manager._parse_log_read_output(out, offset, tail)
+
+
+    def test_log_read_command(self):
+        '''Test reading logs from an offset or their tail'''
+
+        self.assertEqual(self.read_log(self.task), ('line 1\nline 2\nline 3\n', 21))
+        self.assertEqual(self.read_log(self.task, tail=2), ('line 2\nline 3\n', 21))
+        self.assertEqual(self.read_log(self.task, offset=14), ('line 3\n', 21))
+        self.assertEqual(self.read_log(self.task, offset=21), ('', 21))
+        self.assertEqual(self.read_log(self.task, offset=100), ('', 21))
+
+
+    def test_cached_log(self):
+        '''Test that only the new log bytes are read, and repeated views are served from the cache'''
+
+        with mock.patch.object(SlurmComputingManager, '_get_task_log', side_effect=self.read_log) as get_task_log_mock:
+
+            # First read is a tail
+            with self.settings(TASK_LOG_TAIL_LINES=2, TASK_LOG_CACHE_TTL=60):
+                self.assertEqual(get_task_log(self.task), ('line 2\nline 3\n', 21))
+                self.assertEqual(get_task_log_mock.call_args[1], {'offset': 0, 'tail': 2})
+
+                # Served from the cache
+                self.assertEqual(get_task_log(self.task, offset=14), ('line 3\n', 21))
+                self.assertEqual(get_task_log_mock.call_count, 1)
+
+            # Only the new bytes are read
+            with open(self.log_file.name, 'ab') as f:
+                f.write(b'line 4\n')
+            with self.settings(TASK_LOG_CACHE_TTL=-1):
+                self.assertEqual(get_task_log(self.task, offset=21), ('line 4\n', 28))
+                self.assertEqual(get_task_log_mock.call_args[1], {'offset': 21, 'tail': None})
+                self.assertEqual(get_task_log(self.task), ('line 2\nline 3\nline 4\n', 28))
+                self.assertEqual(get_task_log_mock.call_count, 3)
+
+            # Once the task is over, the log is never read again
+            self.task.status = TaskStatuses.exited
+            with self.settings(TASK_LOG_CACHE_TTL=-1):
+                get_task_log(self.task)
+                self.assertEqual(get_task_log_mock.call_count, 3)
+
+
+    def test_cached_log_tail_only(self):
+        '''Test that the logs of computings which cannot read them from an offset are refreshed by their tail'''
+
+        with mock.patch.object(SlurmComputingManager, '_get_task_log', side_effect=self.read_log) as get_task_log_mock, \
+             mock.patch.object(SlurmComputingManager, 'supports_log_offsets', False):
+
+            with self.settings(TASK_LOG_TAIL_LINES=2, TASK_LOG_CACHE_TTL=-1):
+                self.assertEqual(get_task_log(self.task), ('line 2\nline 3\n', 21))
+                with open(self.log_file.name, 'ab') as f:
+                    f.write(b'line 4\n')
+                self.assertEqual(get_task_log(self.task), ('line 3\nline 4\n', 28))
+                self.assertEqual(get_task_log_mock.call_args_list[1][1], {'offset': 0, 'tail': 2})
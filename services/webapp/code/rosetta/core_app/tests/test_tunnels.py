@@ -0,0 +1,171 @@
+import os
+import socket
+import tempfile
+import subprocess
+from unittest import mock
+from django.contrib.auth.models import User
+
+from .common import BaseAPITestCase
+from ..models import Task, TaskStatuses, Container, Computing, Tunnel, TunnelPort
+from ..tunnels import TunnelRegistry, allocate_tunnel_port
+from ..exceptions import ErrorMessage
+from ..reconciler import reconcile_task_statuses
+
+class FakeSSHConnection(object):
+
+    def __init__(self, control_path, master_pid):
+        self.host = 'localhost'
+        self.control_path = control_path
+        self.master_pid = master_pid
+        self.forwarded = []
+        self.cancelled = []
+
+        self.listeners = {}
+
+    def forward(self, spec):
+        self.forwarded.append(spec)
+        # Listen on the tunnel port, as the master does
+        if spec not in self.listeners:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(('127.0.0.1', int(spec.split(':')[1])))
+            listener.listen(128)
+            self.listeners[spec] = listener
+        return self.master_pid
+
+    def cancel_forward(self, spec):
+        self.cancelled.append(spec)
+        self.drop(spec)
+
+    def drop(self, spec):
+        self.listeners.pop(spec).close()
+
+
+class TunnelsTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, container, computing and task
+        self.user = User.objects.create_user('testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MyLocal', type='local')
+        self.task = Task.objects.create(user=self.user, name='mytask', status=TaskStatuses.running, tid='aaa',
+                                        ip='172.18.0.2', port=8590, tunnel_port=7000, computing=self.computing, container=self.container)
+
+        # Stand-in for the SSH master connection (its control socket and process)
+        self.control_file = tempfile.NamedTemporaryFile(delete=False)
+        self.master = subprocess.Popen(['sleep', '30'])
+        self.connection = FakeSSHConnection(self.control_file.name, self.master.pid)
+
+
+    def tearDown(self):
+        for spec in list(self.connection.listeners):
+            self.connection.drop(spec)
+        self.master.kill()
+        self.master.wait()
+        os.remove(self.control_file.name)
+
+
+    def test_registry(self):
+        '''Test opening, checking and closing tunnels, also across restarts'''
+
+        with mock.patch('rosetta.core_app.tunnels.get_task_tunnel_connection', return_value=self.connection):
+
+            tunnel_registry = TunnelRegistry()
+            self.assertFalse(tunnel_registry.is_up(self.task))
+            tunnel_registry.open(self.task)
+            self.assertTrue(tunnel_registry.is_up(self.task))
+            self.assertEqual(self.connection.forwarded, ['0.0.0.0:7000:172.18.0.2:8590'])
+
+            # Already up, not forwarded again
+            tunnel_registry.open(self.task)
+            self.assertEqual(len(self.connection.forwarded), 1)
+
+            # After a restart
+            tunnel_registry = TunnelRegistry()
+            self.assertTrue(tunnel_registry.is_up(self.task))
+
+            # The forwarding is gone (i.e. cancelled by someone else) while the master is alive: the
+            # tunnel is down, and gets re-opened (cancelling the forwarding first, for the master)
+            self.connection.drop('0.0.0.0:7000:172.18.0.2:8590')
+            self.assertFalse(tunnel_registry.is_up(self.task))
+            with mock.patch('rosetta.core_app.tunnels.cancel_forward', side_effect=lambda control_path, spec, host: self.connection.cancelled.append(spec)):
+                tunnel_registry.open(self.task)
+            self.assertTrue(tunnel_registry.is_up(self.task))
+            self.assertEqual(self.connection.cancelled, ['0.0.0.0:7000:172.18.0.2:8590'])
+            self.assertEqual(len(self.connection.forwarded), 2)
+
+            # The master dies: the tunnel is down, and gets re-opened
+            self.master.kill()
+            self.master.wait()
+            self.assertFalse(tunnel_registry.is_up(self.task))
+            tunnel_registry.open(self.task)
+            self.assertEqual(len(self.connection.forwarded), 3)
+            self.assertEqual(Tunnel.objects.count(), 1)
+
+            # Close it (the master is gone, so there is nothing to cancel)
+            tunnel_registry.close(self.task)
+            self.assertFalse(tunnel_registry.is_up(self.task))
+            self.assertEqual(len(self.connection.cancelled), 1)
+            self.assertEqual(Tunnel.objects.count(), 0)
+
+
+    def test_registry_across_processes(self):
+        '''Test opening tunnels registered by other processes after this one loaded the registry'''
+
+        with mock.patch('rosetta.core_app.tunnels.get_task_tunnel_connection', return_value=self.connection):
+
+            tunnel_registry = TunnelRegistry()
+            other_tunnel_registry = TunnelRegistry()
+            self.assertFalse(tunnel_registry.is_up(self.task))
+
+            # Opened by the other process: used as it is
+            other_tunnel_registry.open(self.task)
+            self.assertEqual(tunnel_registry.open(self.task).master_pid, self.master.pid)
+            self.assertEqual(len(self.connection.forwarded), 1)
+
+            # Re-opened by the other process after this one cached it: the one in the database is used
+            dead_process = subprocess.Popen(['true'])
+            dead_process.wait()
+            tunnel_registry.tunnels[self.task.uuid].master_pid = dead_process.pid
+            self.assertEqual(tunnel_registry.open(self.task).master_pid, self.master.pid)
+            self.assertEqual(len(self.connection.forwarded), 1)
+
+            # Down for both: re-opened, and replaced in the database
+            Tunnel.objects.filter(task=self.task).update(master_pid=dead_process.pid)
+            other_tunnel_registry.tunnels[self.task.uuid].master_pid = dead_process.pid
+            self.assertEqual(other_tunnel_registry.open(self.task).master_pid, self.master.pid)
+            self.assertEqual(len(self.connection.forwarded), 2)
+            self.assertEqual(Tunnel.objects.get(task=self.task).master_pid, self.master.pid)
+
+
+    def test_port_allocation(self):
+        '''Test allocating and freeing tunnel ports'''
+
+        with self.settings(TUNNEL_PORTS_FROM=8000, TUNNEL_PORTS_TO=8001):
+
+            tasks = [Task.objects.create(user=self.user, name='task{}'.format(i), status=TaskStatuses.running, tid='tid{}'.format(i),
+                                         computing=self.computing, container=self.container) for i in range(3)]
+
+            self.assertEqual(allocate_tunnel_port(tasks[0]), 8000)
+            self.assertEqual(allocate_tunnel_port(tasks[0]), 8000)
+            self.assertEqual(allocate_tunnel_port(tasks[1]), 8001)
+            self.assertEqual(Task.objects.get(uuid=tasks[1].uuid).tunnel_port, 8001)
+
+            # Set on stale instances of the task as well (i.e. allocated by a concurrent request)
+            stale_task = Task.objects.get(uuid=tasks[1].uuid)
+            stale_task.tunnel_port = None
+            self.assertEqual(allocate_tunnel_port(stale_task), 8001)
+            self.assertEqual(stale_task.tunnel_port, 8001)
+            with self.assertRaises(ErrorMessage):
+                allocate_tunnel_port(tasks[2])
+
+            # Freed when the task is stopped
+            tasks[0].status = TaskStatuses.stopped
+            tasks[0].save()
+            self.assertEqual(allocate_tunnel_port(tasks[2]), 8000)
+
+            # Or when it exits
+            with mock.patch('rosetta.core_app.computing_managers.LocalComputingManager._reconcile_tasks', return_value={tasks[1].uuid: TaskStatuses.exited}):
+                reconcile_task_statuses()
+            self.assertEqual(list(TunnelPort.objects.values_list('port', flat=True)), [8000])
@@ -0,0 +1,120 @@
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .common import BaseAPITestCase
+from ..api import UserViewSet
+from ..models import Profile, Task, TaskStatuses, Container, Computing, ComputingUserConf
+
+# Queries allowed for rendering a listing page (session, user, profile, the listing itself and its filters)
+LISTING_QUERY_BUDGET = 8
+
+
+class ListingViewsTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, logged in
+        self.user = User.objects.create_user('testuser', password='testpass')
+        Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+
+    def create_tasks(self, count):
+        for i in range(count):
+            container = Container.objects.create(user=self.user, name='MyCont{}'.format(i), image='myimage', type='docker', registry='docker_hub')
+            computing = Computing.objects.create(user=self.user, name='MyComp{}'.format(i), type='local')
+            ComputingUserConf.objects.create(computing=computing, user=self.user, data={'user': 'me{}'.format(i)})
+            Task.objects.create(user=self.user, name='MyTask{}'.format(i), status=TaskStatuses.running, container=container, computing=computing)
+
+    def get_query_count(self, url):
+        with CaptureQueriesContext(connection) as context:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url):
+        '''Check that a listing page runs the same number of queries, within budget, regardless of the rows.'''
+        self.create_tasks(1)
+        query_count = self.get_query_count(url)
+        self.assertLessEqual(query_count, LISTING_QUERY_BUDGET)
+        self.create_tasks(10)
+        self.assertEqual(self.get_query_count(url), query_count)
+
+    def test_tasks_queries(self):
+        self.assertConstantQueries('/tasks/')
+
+    def test_containers_queries(self):
+        self.assertConstantQueries('/containers/')
+
+    def test_computings_queries(self):
+        self.assertConstantQueries('/computings/')
+
+
+class TasksPaginationTests(BaseAPITestCase):
+
+    def setUp(self):
+
+        # Create test user, logged in, with some tasks
+        self.user = User.objects.create_user('testuser', password='testpass')
+        Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+        self.container = Container.objects.create(name='MyCont', image='myimage', type='docker', registry='docker_hub')
+        self.computing = Computing.objects.create(name='MyComp', type='local')
+        another_computing = Computing.objects.create(name='AnotherComp', type='local')
+        now = timezone.now()
+        for i in range(7):
+            Task.objects.create(user=self.user, name='MyTask{}'.format(i), status=TaskStatuses.exited if i < 4 else TaskStatuses.running,
+                                container=self.container, computing=self.computing if i % 2 else another_computing,
+                                created=now - timedelta(hours=7-i))
+
+    def get_pages(self, url):
+        pages = []
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            pages.append([task.name for task in resp.context['data']['tasks']])
+            url = resp.context['data'].get('next_page_url', None)
+        return pages
+
+    @override_settings(TASKS_PAGE_SIZE=3)
+    def test_pagination(self):
+        '''Test walking through the task pages, newest first'''
+        self.assertEqual(self.get_pages('/tasks/'), [['MyTask6', 'MyTask5', 'MyTask4'], ['MyTask3', 'MyTask2', 'MyTask1'], ['MyTask0']])
+
+        # Same created date, still in a stable order and without skipping any
+        Task.objects.update(created=timezone.now())
+        pages = self.get_pages('/tasks/')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sorted(sum(pages, [])), ['MyTask{}'.format(i) for i in range(7)])
+
+    @override_settings(TASKS_PAGE_SIZE=3)
+    def test_filters(self):
+        '''Test filtering the tasks by status and computing'''
+        self.assertEqual(self.get_pages('/tasks/?status=running'), [['MyTask6', 'MyTask5', 'MyTask4']])
+        self.assertEqual(self.get_pages('/tasks/?status=exited&computing={}'.format(self.computing.uuid)), [['MyTask3', 'MyTask1']])
+        self.assertEqual(self.get_pages('/tasks/?container={}'.format(self.container.uuid))[-1], ['MyTask0'])
+
+        # Invalid filters and cursors
+        self.assertIn('Invalid task filters', self.client.get('/tasks/?computing=notauuid').content.decode('utf-8'))
+        self.assertIn('Invalid page cursor', self.client.get('/tasks/?cursor=notacursor').content.decode('utf-8'))
+
+    def test_users_api(self):
+        '''Test the keyset pagination of the users API'''
+        for i in range(5):
+            User.objects.create_user('user{}'.format(i), password='testpass')
+        # The viewset is not routed (nor its serializer usable), so use its paginator directly
+        usernames = []
+        url = '/api/v1/users/?page_size=2'
+        while url:
+            paginator = UserViewSet.pagination_class()
+            users = paginator.paginate_queryset(UserViewSet.queryset.all(), Request(APIRequestFactory().get(url)))
+            self.assertLessEqual(len(users), 2)
+            usernames += [user.username for user in users]
+            url = paginator.get_next_link()
+        self.assertEqual(sorted(usernames), sorted(['testuser'] + ['user{}'.format(i) for i in range(5)]))
@@ -0,0 +1,176 @@
+import os
+import socket
+import threading
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from .models import Tunnel, TunnelPort
+from .utils import get_task_tunnel_connection, get_task_tunnel_spec
+from .ssh_pool import cancel_forward
+from .exceptions import ErrorMessage
+
+# Setup logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def pid_alive(pid):
+    '''Check if a process is alive, without forking anything.'''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, just not ours
+        return True
+    return True
+
+
+def port_listening(port, timeout=1):
+    '''Check if something is listening on a local port, by connecting to it.'''
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=timeout).close()
+    except OSError:
+        return False
+    return True
+
+
+
+class TunnelRegistry(object):
+    '''Registry of the task tunnels, which are port forwardings over the pooled SSH master connections.
+    It is persisted in the database, so that it survives restarts (as the masters do), and looked up
+    in memory. Tunnels are up as long as their master connection process is alive and their forwarding
+    is listening (as it could have been cancelled, or failed to bind, on a master shared with others).'''
+
+    def __init__(self):
+        self._tunnels = None
+        self.lock = threading.RLock()
+
+    @property
+    def tunnels(self):
+        # Load the registry lazily, once per process
+        with self.lock:
+            if self._tunnels is None:
+                self._tunnels = {tunnel.task_id: tunnel for tunnel in Tunnel.objects.all()}
+            return self._tunnels
+
+    def get(self, task):
+        return self.tunnels.get(task.uuid, None)
+
+    def is_up(self, task):
+        '''Check if the tunnel of a task is up.'''
+        tunnel = self.get(task)
+        if not tunnel or not tunnel.master_pid:
+            return False
+        if tunnel.spec != get_task_tunnel_spec(task):
+            return False
+        if not os.path.exists(tunnel.control_path) or not pid_alive(tunnel.master_pid):
+            return False
+        return port_listening(tunnel.port)
+
+    def open(self, task):
+        '''Open the tunnel of a task, if not already up. Returns the tunnel.'''
+        with self.lock:
+            if self.is_up(task):
+                logger.debug('Task "{}" has a running tunnel, using it'.format(task))
+                return self.get(task)
+
+            # Look it up in the database as well, as it might have been opened (or closed) by another process
+            tunnel = Tunnel.objects.filter(task=task).first()
+            if tunnel:
+                self.tunnels[task.uuid] = tunnel
+                if self.is_up(task):
+                    logger.debug('Task "{}" has a running tunnel, using it'.format(task))
+                    return tunnel
+            else:
+                self.tunnels.pop(task.uuid, None)
+
+            logger.debug('Task "{}" has no running tunnel, creating it'.format(task))
+
+            # Close any leftover tunnel on the same port (i.e. of a task which exited in the meantime), and the
+            # one of the task itself if not working, as for the master the forwarding might still be there
+            for stale_tunnel in Tunnel.objects.filter(port=task.tunnel_port).exclude(task=task):
+                self._close(stale_tunnel)
+            if tunnel:
+                self._close(tunnel)
+
+            tunnel_connection = get_task_tunnel_connection(task)
+            tunnel_spec = get_task_tunnel_spec(task)
+
+            # Log
+            logger.debug('Opening tunnel "{}" over {}'.format(tunnel_spec, tunnel_connection))
+
+            # Execute
+            master_pid = tunnel_connection.forward(tunnel_spec)
+
+            # Register (replacing the one registered by another process in the meantime, if any)
+            tunnel, _ = Tunnel.objects.update_or_create(task=task, defaults={'port': task.tunnel_port,
+                                                                             'spec': tunnel_spec,
+                                                                             'control_path': tunnel_connection.control_path,
+                                                                             'master_pid': master_pid,
+                                                                             'host': tunnel_connection.host})
+            self.tunnels[task.uuid] = tunnel
+            return tunnel
+
+    def close(self, task):
+        '''Close the tunnel of a task, if any.'''
+        with self.lock:
+            tunnel = self.tunnels.get(task.uuid, None) or Tunnel.objects.filter(task=task).first()
+            if tunnel:
+                self._close(tunnel)
+
+    def _close(self, tunnel):
+        logger.debug('Closing tunnel "{}" for task "{}"'.format(tunnel.spec, tunnel.task_id))
+        self.tunnels.pop(tunnel.task_id, None)
+
+        # Cancel the forwarding only if its master is still alive (otherwise it is gone already)
+        if os.path.exists(tunnel.control_path) and tunnel.master_pid and pid_alive(tunnel.master_pid):
+            cancel_forward(tunnel.control_path, tunnel.spec, tunnel.host)
+        tunnel.delete()
+
+
+
+def allocate_tunnel_port(task):
+    '''Allocate a tunnel port to a task (if not already allocated), within the TUNNEL_PORTS range. Ports
+    are claimed atomically, as a port can be allocated only once, and freed when tasks are over.'''
+
+    # Already allocated? (the task instance might be stale, i.e. if allocated by a concurrent request)
+    try:
+        return _set_task_tunnel_port(task, task.tunnel_port_allocation.port)
+    except TunnelPort.DoesNotExist:
+        pass
+
+    # Get the allocated ports (only the ones of the active tasks are there), and try to claim a free one
+    allocated_ports = set(TunnelPort.objects.values_list('port', flat=True))
+    for port in range(settings.TUNNEL_PORTS_FROM, settings.TUNNEL_PORTS_TO+1):
+        if port in allocated_ports:
+            continue
+        try:
+            with transaction.atomic():
+                TunnelPort.objects.create(port=port, task=task)
+        except IntegrityError:
+            # Claimed in the meantime by someone else (or this task got one concurrently)
+            try:
+                return _set_task_tunnel_port(task, TunnelPort.objects.get(task=task).port)
+            except TunnelPort.DoesNotExist:
+                continue
+        return _set_task_tunnel_port(task, port)
+
+    logger.error('Cannot find a free port for the tunnel for task "{}"'.format(task))
+    raise ErrorMessage('Cannot find a free port for the tunnel to the task')
+
+
+def _set_task_tunnel_port(task, port):
+    '''Set the (allocated) tunnel port on a task, saving it only if changed. Returns the port.'''
+    if task.tunnel_port != port:
+        task.tunnel_port = port
+        task.save(update_fields=['tunnel_port'])
+    return port
+
+
+def release_tunnel_ports(task_uuids):
+    '''Free the tunnel ports of a set of tasks, in a single query.'''
+    TunnelPort.objects.filter(task__in=task_uuids).delete()
+
+
+# Registry instance (per process)
+tunnel_registry = TunnelRegistry()
@@ -6,6 +6,7 @@ import random
 import subprocess
 import logging
 from collections import namedtuple
+from functools import lru_cache
 import datetime, calendar, pytz
 from dateutil.tz import tzoffset
 
@@ -15,6 +16,10 @@ from .exceptions import ErrorMessage
 logger = logging.getLogger(__name__)
 
 
+# Output of the os_shell
+Output = namedtuple('Output', 'stdout stderr exit_code')
+
+
 # Colormap (See https://bhaskarvk.github.io/colormap/reference/colormap.html)
 color_map = ["#440154", "#440558", "#450a5c", "#450e60", "#451465", "#461969",
              "#461d6d", "#462372", "#472775", "#472c7a", "#46307c", "#45337d",
@@ -59,7 +64,11 @@ def booleanize(*args, **kwargs):
             return False
 
 
+# Emails sent with the "Sink" email service, a local stand-in for the real one (i.e. for testing)
+email_sink = []
+
 def send_email(to, subject, text):
+    '''Send an email right away (raising on errors). Better to queue it in the outbox instead (see queue_email).'''
 
     # Importing here instead of on top avoids circular dependencies problems when loading booleanize in settings
     from django.conf import settings
@@ -74,17 +83,10 @@ def send_email(to, subject, text):
         subject = subject
         content = Content('text/plain', text)
         mail = Mail(from_email, subject, to_email, content)
-        
-        try:
-            response = sg.client.mail.send.post(request_body=mail.get())
+        sg.client.mail.send.post(request_body=mail.get())
 
-            #logger.debug(response.status_code)
-            #logger.debug(response.body)
-            #logger.debug(response.headers)
-        except Exception as e:
-            logger.error(e)
-        
-        #logger.debug(response)
+    elif settings.DJANGO_EMAIL_SERVICE == 'Sink':
+        email_sink.append({'to': to, 'subject': subject, 'text': text})
     
 
 def format_exception(e, debug=False):
@@ -215,9 +217,6 @@ def os_shell(command, capture=False, verbose=False, interactive=False, silent=Fa
     stdout = stdout[:-1] if (stdout and stdout[-1] == '\n') else stdout
     stderr = stderr[:-1] if (stderr and stderr[-1] == '\n') else stderr
 
-    # Output namedtuple
-    Output = namedtuple('Output', 'stdout stderr exit_code')
-
     if exit_code != 0:
         if capture:
             return Output(stdout, stderr, exit_code)
@@ -508,6 +507,17 @@ def get_tunnel_host():
     tunnel_host = os.environ.get('ROSETTA_TUNNEL_HOST', 'localhost')
     return tunnel_host
 
+@lru_cache(maxsize=None)
+def get_agent_code():
+    '''Get the code of the task agent (the same for all the tasks).'''
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agent.py')) as f:
+        return f.read()
+
+@lru_cache(maxsize=None)
+def get_agent_version():
+    '''Get the version of the task agent, as the (short) hash of its code.'''
+    return hashlib.sha1(get_agent_code().encode('utf8')).hexdigest()[0:12]
+
 def hash_string_to_int(string):
     #int_hash = 0 
     #for char in string:
@@ -524,73 +534,70 @@ def hash_string_to_int(string):
 def setup_tunnel(task):
 
     # Importing here instead of on top avoids circular dependencies problems when loading booleanize in settings
-    from .models import Task, KeyPair, TaskStatuses
-    
-    # If there is no tunnel port allocated yet, find one
-    if not task.tunnel_port:
+    from .tunnels import tunnel_registry, allocate_tunnel_port
 
-        # Get a free port fot the tunnel:
-        allocated_tunnel_ports = []
-        for other_task in Task.objects.all():
-            if other_task.tunnel_port and not other_task.status in [TaskStatuses.exited, TaskStatuses.stopped]:
-                allocated_tunnel_ports.append(other_task.tunnel_port)
+    # Allocate a port for the tunnel, if not already done
+    allocate_tunnel_port(task)
 
-        for port in range(7000, 7021):
-            if not port in allocated_tunnel_ports:
-                tunnel_port = port
-                break
-        if not tunnel_port:
-            logger.error('Cannot find a free port for the tunnel for task "{}"'.format(task))
-            raise ErrorMessage('Cannot find a free port for the tunnel to the task')
+    # Open the tunnel, if not already up
+    tunnel_registry.open(task)
 
-        task.tunnel_port = tunnel_port
-        task.save()
 
+def get_task_tunnel_spec(task):
+    return '0.0.0.0:{}:{}:{}'.format(task.tunnel_port, task.ip, task.port)
 
-    # Check if the tunnel is active and if not create it
-    logger.debug('Checking if task "{}" has a running tunnel'.format(task))
 
-    out = os_shell('ps -ef | grep ":{}:{}:{}" | grep -v grep'.format(task.tunnel_port, task.ip, task.port), capture=True)
+def get_task_tunnel_connection(task):
 
-    if out.exit_code == 0:
-        logger.debug('Task "{}" has a running tunnel, using it'.format(task))
-    else:
-        logger.debug('Task "{}" has no running tunnel, creating it'.format(task))
+    # Importing here instead of on top avoids circular dependencies problems when loading booleanize in settings
+    from .models import KeyPair
+    from .ssh_pool import ssh_pool
+
+    if task.computing.type == 'remotehop':
 
         # Get user keys
         user_keys = KeyPair.objects.get(user=task.user, default=True)
 
-        # Tunnel command
-        if task.computing.type == 'remotehop':           
-            
-            # Get computing params
-            first_host = task.computing.get_conf_param('first_host')
-            first_user = task.computing.get_conf_param('first_user')
-            #second_host = task.computing.get_conf_param('second_host')
-            #second_user = task.computing.get_conf_param('second_user')
-            #setup_command = task.computing.get_conf_param('setup_command')
-            #base_port = task.computing.get_conf_param('base_port')
-                     
-            tunnel_command= 'ssh -4 -i {} -o StrictHostKeyChecking=no -nNT -L 0.0.0.0:{}:{}:{} {}@{} & '.format(user_keys.private_key_file, task.tunnel_port, task.ip, task.port, first_user, first_host)
-
-        else:
-            tunnel_command= 'ssh -4 -o StrictHostKeyChecking=no -nNT -L 0.0.0.0:{}:{}:{} localhost & '.format(task.tunnel_port, task.ip, task.port)
-        
-        background_tunnel_command = 'nohup {} >/dev/null 2>&1 &'.format(tunnel_command)
-
-        # Log
-        logger.debug('Opening tunnel with command: {}'.format(background_tunnel_command))
-
-        # Execute
-        subprocess.Popen(background_tunnel_command, shell=True)
-
-
-
-
-
+        # Get computing params
+        first_host = task.computing.get_conf_param('first_host')
+        first_user = task.computing.get_conf_param('first_user')
+        #second_host = task.computing.get_conf_param('second_host')
+        #second_user = task.computing.get_conf_param('second_user')
+        #setup_command = task.computing.get_conf_param('setup_command')
+        #base_port = task.computing.get_conf_param('base_port')
 
+        return ssh_pool.get_connection(computing=task.computing, host=first_host, user=first_user, key_file=user_keys.private_key_file, persistent=True)
 
+    else:
+        # Tunnel through localhost, to bind on all interfaces
+        return ssh_pool.get_connection(host='localhost', persistent=True)
 
 
+def paginate_by_keyset(queryset, cursor=None, page_size=50):
+    '''Get a page of a queryset, newest first, using keyset pagination on the (created, uuid) pair
+    rather than offsets, so that any page costs the same (an index seek) however deep it is.
+    The cursor is the one returned with the previous page. Returns an (items, next_cursor)
+    tuple, where next_cursor is None on the last page.'''
 
+    # Importing here instead of on top avoids circular dependencies problems when loading booleanize in settings
+    import base64
+    from django.db.models import Q
+    from django.utils.dateparse import parse_datetime
 
+    if cursor:
+        try:
+            created_str, uuid_str = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+            created = parse_datetime(created_str)
+        except Exception:
+            raise ErrorMessage('Invalid page cursor')
+        if not created:
+            raise ErrorMessage('Invalid page cursor')
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, uuid__lt=uuid_str))
+
+    items = list(queryset.order_by('-created', '-uuid')[:page_size+1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    last_item = items[-1]
+    next_cursor = base64.urlsafe_b64encode('{}|{}'.format(last_item.created.isoformat(), last_item.uuid).encode('ascii')).decode('ascii')
+    return items, next_cursor
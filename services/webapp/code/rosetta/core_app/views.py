@@ -2,14 +2,22 @@ import os
 import uuid
 import json
 import subprocess
+from urllib.parse import urlencode
 from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth import authenticate, login, logout
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.shortcuts import redirect
-from .models import Profile, LoginToken, Task, TaskStatuses, Container, Computing, KeyPair, ComputingSysConf, ComputingUserConf
-from .utils import send_email, format_exception, timezonize, os_shell, booleanize, debug_param, get_tunnel_host, random_username, setup_tunnel, finalize_user_creation
+from .models import Profile, LoginToken, Task, TaskStatuses, TaskHistory, Container, Computing, KeyPair, ComputingSysConf, ComputingUserConf
+from .utils import format_exception, timezonize, os_shell, booleanize, debug_param, get_tunnel_host, random_username, setup_tunnel, finalize_user_creation, paginate_by_keyset
+from .task_logs import get_task_log
+from .computing_confs import attach_user_conf_data
+from .catalog import get_containers, get_computings, get_container, get_computing
+from .launch_queue import enqueue_task_launch, enqueue_task_launches
+from .outbox import queue_email
+from .log_streams import task_log_streams, stream_events
 from .decorators import public_view, private_view
 from .exceptions import ErrorMessage
 
@@ -79,7 +87,7 @@ def login_view(request):
                     loginToken.token = token
                     loginToken.save()
                 try:
-                    send_email(to=user.email, subject='Rosetta login link', text='Hello,\n\nhere is your login link: {}/login/?token={}\n\nOnce logged in, you can go to "My Account" and change password (or just keep using the login link feature).\n\nThe Rosetta Team.'.format(settings.DJANGO_PUBLIC_HTTP_HOST, token))
+                    queue_email(to=user.email, subject='Rosetta login link', text='Hello,\n\nhere is your login link: {}/login/?token={}\n\nOnce logged in, you can go to "My Account" and change password (or just keep using the login link feature).\n\nThe Rosetta Team.'.format(settings.DJANGO_PUBLIC_HTTP_HOST, token))
                 except Exception as e:
                     logger.error(format_exception(e))
                     raise ErrorMessage('Something went wrong. Please retry later.')
@@ -367,25 +375,67 @@ def tasks(request):
         #  Task list
         #----------------
     
-        # Get all tasks
+        # Filters, if any
+        filters = {}
+        for filter_name in ['status', 'computing', 'container']:
+            filter_value = request.GET.get(filter_name, None)
+            if filter_value:
+                filters[filter_name] = filter_value
+        cursor = request.GET.get('cursor', None)
+
+        # Get a page of tasks, newest first. Their statuses are kept up to date in background
+        # by the reconciler, and are at most TASK_STATUS_RECONCILE_INTERVAL seconds old.
         try:
-            tasks = Task.objects.filter(user=request.user).order_by('created') 
+            tasks = Task.objects.filter(user=request.user, **filters).select_related('container', 'computing')
+            tasks, next_cursor = paginate_by_keyset(tasks, cursor=cursor, page_size=settings.TASKS_PAGE_SIZE)
+        except (ValidationError, ValueError):
+            raise ErrorMessage('Invalid task filters')
+        except ErrorMessage:
+            raise
         except Exception as e:
             data['error'] = 'Error in getting Tasks info'
             logger.error('Error in getting Virtual Devices: "{}"'.format(e))
             return render(request, 'error.html', {'data': data})
     
-        # Update task statuses
-        for task in tasks:
-            task.update_status()
-    
         # Set task and tasks variables
         data['task']  = None   
         data['tasks'] = tasks
+        data['filters'] = filters
+        data['statuses'] = [TaskStatuses.created, TaskStatuses.sumbitted, TaskStatuses.running, TaskStatuses.stopped, TaskStatuses.exited]
+        data['computings'] = get_computings(request.user)
+        data['containers'] = get_containers(request.user)
+        if next_cursor:
+            data['next_page_url'] = '/tasks/?{}'.format(urlencode(dict(filters, cursor=next_cursor)))
+        if cursor:
+            data['first_page_url'] = '/tasks/?{}'.format(urlencode(filters))
 
     return render(request, 'tasks.html', {'data': data})
 
 
+#=========================
+#  Task history view
+#=========================
+
+@private_view
+def task_history(request):
+
+    # Init data
+    data={}
+    data['user']  = request.user
+    data['profile'] = Profile.objects.get(user=request.user)
+    data['title'] = 'Task history'
+
+    # Get a page of archived tasks (read-only), newest first
+    cursor = request.GET.get('cursor', None)
+    data['tasks'], next_cursor = paginate_by_keyset(TaskHistory.objects.filter(user=request.user), cursor=cursor, page_size=settings.TASKS_PAGE_SIZE)
+    if next_cursor:
+        data['next_page_url'] = '/task_history/?{}'.format(urlencode({'cursor': next_cursor}))
+    if cursor:
+        data['first_page_url'] = '/task_history/'
+
+    return render(request, 'task_history.html', {'data': data})
+
+
 #=========================
 #  Create Task view
 #=========================
@@ -405,16 +455,15 @@ def create_task(request):
     # Container uuid if any
     container_uuid = request.GET.get('task_container_uuid', None)
     if container_uuid:
-        try:
-            data['task_container'] = Container.objects.get(uuid=container_uuid, user=request.user)
-        except Container.DoesNotExist:
-            data['task_container'] = Container.objects.get(uuid=container_uuid, user=None)
+        data['task_container'] = get_container(request.user, container_uuid)
+        if not data['task_container']:
+            raise ErrorMessage('Container does not exists or no access rights')
     else:
         # Get containers
-        data['containers'] = list(Container.objects.filter(user=None)) + list(Container.objects.filter(user=request.user))
+        data['containers'] = get_containers(request.user)
     
     # Get computings 
-    data['computings'] = list(Computing.objects.filter(user=None)) + list(Computing.objects.filter(user=request.user))
+    data['computings'] = get_computings(request.user)
 
 
     # Handle step
@@ -428,24 +477,16 @@ def create_task(request):
 
         # Task container
         task_container_uuid = request.POST.get('task_container_uuid', None)
-        try:
-            task_container = Container.objects.get(uuid=task_container_uuid, user=None)
-        except Container.DoesNotExist:
-            try:
-                task_container =  Container.objects.get(uuid=task_container_uuid, user=request.user)
-            except Container.DoesNotExist:
-                raise Exception('Consistency error, container with uuid "{}" does not exists or user "{}" does not have access rights'.format(task_container_uuid, request.user.email))
+        task_container = get_container(request.user, task_container_uuid)
+        if not task_container:
+            raise Exception('Consistency error, container with uuid "{}" does not exists or user "{}" does not have access rights'.format(task_container_uuid, request.user.email))
         data['task_container'] = task_container
 
         # Task computing
         task_computing_uuid = request.POST.get('task_computing_uuid', None)
-        try:
-            task_computing = Computing.objects.get(uuid=task_computing_uuid, user=None)
-        except Computing.DoesNotExist:
-            try:
-                task_computing =  Computing.objects.get(uuid=task_computing_uuid, user=request.user)
-            except Computing.DoesNotExist:
-                raise Exception('Consistency error, computing with uuid "{}" does not exists or user "{}" does not have access rights'.format(task_computing_uuid, request.user.email))
+        task_computing = get_computing(request.user, task_computing_uuid)
+        if not task_computing:
+            raise Exception('Consistency error, computing with uuid "{}" does not exists or user "{}" does not have access rights'.format(task_computing_uuid, request.user.email))
         data['task_computing'] = task_computing
             
         # Handle step one/two
@@ -456,6 +497,20 @@ def create_task(request):
             
         elif step == 'two':
 
+            # Number of (identical) tasks to create, all at once on Slurm (as a job array)
+            task_count = request.POST.get('task_count', None)
+            try:
+                task_count = int(task_count) if task_count else 1
+            except ValueError:
+                raise ErrorMessage('Invalid number of tasks')
+            if task_count < 1 or task_count > settings.TASK_BULK_MAX_COUNT:
+                raise ErrorMessage('The number of tasks must be between 1 and {}'.format(settings.TASK_BULK_MAX_COUNT))
+            if task_count > 1:
+                if task_computing.type != 'slurm':
+                    raise ErrorMessage('Creating more tasks at once is supported only on Slurm computing resources')
+                if len('{}_{}'.format(task_name, task_count)) > Task._meta.get_field('name').max_length:
+                    raise ErrorMessage('Task name too long')
+
             # Generate the task uuid
             task_uuid = str(uuid.uuid4())
 
@@ -514,18 +569,26 @@ def create_task(request):
             # Set extra binds if any:
             task.extra_binds = extra_binds
 
-            # Save the task before starting it, or the computing manager will not be able to work properly
-            task.save()
-    
-            # Start the task
-            try:
-                task.computing.manager.start_task(task)
-            except:
-                # Delete the task if could not start it
-                task.delete()
-                
-                # ..and re-raise
-                raise
+            if task_count == 1:
+
+                # Save the task before starting it, or the computing manager will not be able to work properly
+                task.save()
+
+                # Queue the task launch: it will be started in background by the launcher workers
+                enqueue_task_launch(task)
+
+            else:
+
+                # Create the tasks as copies of this one, named after their number, and queue their launches all
+                # together: they will be started at once by a launcher worker
+                tasks = []
+                for i in range(task_count):
+                    array_task = Task(uuid = uuid.uuid4(), name = '{}_{}'.format(task_name, i+1),
+                                      **{field: getattr(task, field) for field in ['user', 'status', 'container', 'computing', 'auth_user', 'auth_pass',
+                                                                                   'access_method', 'port', 'computing_options', 'extra_binds']})
+                    array_task.save()
+                    tasks.append(array_task)
+                enqueue_task_launches(tasks)
 
             # Set step        
             data['step'] = 'created'
@@ -568,10 +631,9 @@ def task_log(request):
     # Attach user conf in any
     task.computing.attach_user_conf_data(request.user) 
 
-    # Get the log
+    # Get the log (its last part, the live follow is streamed by task_log_stream)
     try:
-
-        data['log'] = task.computing.manager.get_task_log(task)
+        data['log'], _ = get_task_log(task)
 
     except Exception as e:
         data['error'] = 'Error in viewing task log'
@@ -581,6 +643,30 @@ def task_log(request):
     return render(request, 'task_log.html', {'data': data})
 
 
+@private_view
+def task_log_stream(request):
+
+    # Get uuid
+    uuid = request.GET.get('uuid', None)
+    if not uuid:
+        return render(request, 'error.html', {'data': 'uuid not set'})
+
+    # Get the task (raises if none available including no permission)
+    task = Task.objects.get(user=request.user, uuid=uuid)
+
+    # Attach user conf in any
+    task.computing.attach_user_conf_data(request.user)
+
+    # Subscribe to the log stream of the task, which is shared among all of its viewers
+    subscription = task_log_streams.subscribe(task)
+
+    # Stream it as server-sent events
+    response = StreamingHttpResponse(stream_events(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 
 
 
@@ -606,12 +692,9 @@ def containers(request):
         try:
 
             # Get the container (raises if none available including no permission)
-            try:
-                container = Container.objects.get(uuid=uuid)
-            except Container.DoesNotExist:
+            container = get_container(request.user, uuid)
+            if not container:
                 raise ErrorMessage('Container does not exists or no access rights')                
-            if container.user and container.user != request.user:
-                raise ErrorMessage('Container does not exists or no access rights')
             data['container'] = container
 
             #-------------------
@@ -633,7 +716,7 @@ def containers(request):
     #----------------
 
     # Get containers
-    data['containers'] = list(Container.objects.filter(user=None)) + list(Container.objects.filter(user=request.user))
+    data['containers'] = get_containers(request.user)
 
     return render(request, 'containers.html', {'data': data})
 
@@ -754,21 +837,19 @@ def computings(request):
     data['action'] = action
     
     if details and computing_uuid:
-        try:
-            data['computing'] = Computing.objects.get(uuid=computing_uuid, user=request.user)
-        except Computing.DoesNotExist:
-            data['computing'] = Computing.objects.get(uuid=computing_uuid, user=None)
+        data['computing'] = get_computing(request.user, computing_uuid)
+        if not data['computing']:
+            raise ErrorMessage('Computing does not exists or no access rights')
 
         # Attach user conf in any
         data['computing'].attach_user_conf_data(request.user)
             
     
     else:
-        data['computings'] = list(Computing.objects.filter(user=None)) + list(Computing.objects.filter(user=request.user))
+        data['computings'] = get_computings(request.user)
         
-        # Attach user conf in any
-        for computing in data['computings']:
-            computing.attach_user_conf_data(request.user)
+        # Attach user conf in any (all at once)
+        attach_user_conf_data(data['computings'], request.user)
 
     return render(request, 'computings.html', {'data': data})
 
@@ -895,7 +976,7 @@ def edit_computing_conf(request):
 def sharable_link_handler(request, id):
 
     # Get the task     
-    task = Task.objects.get(uuid__startswith=id)
+    task = Task.objects.get(short_id=id)
 
     # First ensure that the tunnel is setu up
     setup_tunnel(task)
@@ -139,7 +139,7 @@ STATIC_URL = '/static/'
 # REST framework settings
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 100000
+    'PAGE_SIZE': 100
 }
 
 # Swagger settings
@@ -155,6 +155,127 @@ DATA_PATH  = '/data/'
 TMP_PATH   = '/tmp/'
 
 
+#===============================
+#  Command executor
+#===============================
+
+# Number of workers for the commands submitted in background
+EXECUTOR_MAX_WORKERS = int(os.environ.get('EXECUTOR_MAX_WORKERS', 16))
+
+# Maximum number of concurrent commands per target host, across all the connections to it (should
+# be greater than SSH_POOL_MAX_SESSIONS, which limits the ones over a single connection)
+EXECUTOR_MAX_PER_HOST = int(os.environ.get('EXECUTOR_MAX_PER_HOST', 16))
+
+# Default command timeout, in seconds
+EXECUTOR_DEFAULT_TIMEOUT = int(os.environ.get('EXECUTOR_DEFAULT_TIMEOUT', 120))
+
+# Maximum bytes captured for each of stdout and stderr
+EXECUTOR_MAX_OUTPUT_BYTES = int(os.environ.get('EXECUTOR_MAX_OUTPUT_BYTES', 16*1024*1024))
+
+
+#===============================
+#  SSH connection pool
+#===============================
+
+# Where to keep the control sockets of the multiplexed SSH master connections
+SSH_POOL_CONTROL_DIR = os.environ.get('SSH_POOL_CONTROL_DIR', os.path.join(TMP_PATH, 'rosetta_ssh'))
+
+# Seconds a master connection is kept alive after its last session (the ones carrying the task tunnels never expire)
+SSH_POOL_IDLE_TIMEOUT = int(os.environ.get('SSH_POOL_IDLE_TIMEOUT', 600))
+
+# Maximum number of concurrent sessions over a master connection
+SSH_POOL_MAX_SESSIONS = int(os.environ.get('SSH_POOL_MAX_SESSIONS', 8))
+
+# Maximum number of these sessions taken by long-running streams (i.e. the task log followers)
+SSH_POOL_MAX_STREAMS = int(os.environ.get('SSH_POOL_MAX_STREAMS', 4))
+
+
+#===============================
+#  Docker
+#===============================
+
+# Docker Engine API unix socket, used to manage the local tasks
+DOCKER_SOCKET_PATH = os.environ.get('DOCKER_SOCKET_PATH', '/var/run/docker.sock')
+
+# Docker Engine API version (if not set, the one of the daemon is used, as negotiated on the first request)
+DOCKER_API_VERSION = os.environ.get('DOCKER_API_VERSION', None)
+
+# Docker Engine API requests timeout, in seconds
+DOCKER_TIMEOUT = int(os.environ.get('DOCKER_TIMEOUT', 60))
+
+
+#===============================
+#  Tasks
+#===============================
+
+# Range of ports (inclusive) for the task tunnels. Must be exposed by the webapp container (see the docker-compose file)
+TUNNEL_PORTS_FROM = int(os.environ.get('TUNNEL_PORTS_FROM', 7000))
+TUNNEL_PORTS_TO = int(os.environ.get('TUNNEL_PORTS_TO', 7020))
+
+# Number of workers launching the tasks in background
+TASK_LAUNCH_WORKERS = int(os.environ.get('TASK_LAUNCH_WORKERS', 8))
+
+# Maximum number of concurrent task launches per computing resource
+TASK_LAUNCH_MAX_PER_COMPUTING = int(os.environ.get('TASK_LAUNCH_MAX_PER_COMPUTING', 4))
+
+# Maximum number of attempts for a task launch, and seconds before the first retry (then doubling)
+TASK_LAUNCH_MAX_ATTEMPTS = int(os.environ.get('TASK_LAUNCH_MAX_ATTEMPTS', 3))
+TASK_LAUNCH_RETRY_DELAY = int(os.environ.get('TASK_LAUNCH_RETRY_DELAY', 10))
+
+# Seconds after which a task launch still running is considered lost (i.e. its worker died) and queued again.
+# Must be longer than a launch can take, i.e. pulling a Docker image (up to one hour) and then starting it.
+TASK_LAUNCH_TIMEOUT = int(os.environ.get('TASK_LAUNCH_TIMEOUT', 4500))
+
+# Seconds between polls of the task launch queue
+TASK_LAUNCH_POLL_INTERVAL = float(os.environ.get('TASK_LAUNCH_POLL_INTERVAL', 1))
+
+# Maximum number of (identical) tasks created at once. On Slurm they are started all together, as a job array
+TASK_BULK_MAX_COUNT = int(os.environ.get('TASK_BULK_MAX_COUNT', 100))
+
+# Number of tasks per page in the tasks list
+TASKS_PAGE_SIZE = int(os.environ.get('TASKS_PAGE_SIZE', 50))
+
+# Seconds between task status reconciliations with the computing resources
+TASK_STATUS_RECONCILE_INTERVAL = int(os.environ.get('TASK_STATUS_RECONCILE_INTERVAL', 60))
+
+# Seconds between the heartbeats sent by the task agents, and without them after which a running task is checked
+# on its computing resource again (as the status of those sending them is not), and seconds or number of
+# heartbeats after which the received ones are written to the database
+TASK_HEARTBEAT_INTERVAL = int(os.environ.get('TASK_HEARTBEAT_INTERVAL', 60))
+TASK_HEARTBEAT_TIMEOUT = int(os.environ.get('TASK_HEARTBEAT_TIMEOUT', 300))
+TASK_HEARTBEAT_FLUSH_INTERVAL = int(os.environ.get('TASK_HEARTBEAT_FLUSH_INTERVAL', 10))
+TASK_HEARTBEAT_FLUSH_MAX_SIZE = int(os.environ.get('TASK_HEARTBEAT_FLUSH_MAX_SIZE', 1000))
+
+# The stored heartbeats lag behind by up to the flush interval, and a heartbeat can be late
+if TASK_HEARTBEAT_TIMEOUT < 2*TASK_HEARTBEAT_INTERVAL + TASK_HEARTBEAT_FLUSH_INTERVAL:
+    raise ImproperlyConfigured('TASK_HEARTBEAT_TIMEOUT must be at least twice TASK_HEARTBEAT_INTERVAL plus TASK_HEARTBEAT_FLUSH_INTERVAL')
+
+# Days after which terminal (stopped or exited) tasks are moved to the task history, how many at a time, and how often
+TASK_ARCHIVE_AGE = int(os.environ.get('TASK_ARCHIVE_AGE', 30))
+TASK_ARCHIVE_BATCH_SIZE = int(os.environ.get('TASK_ARCHIVE_BATCH_SIZE', 1000))
+TASK_ARCHIVE_INTERVAL = int(os.environ.get('TASK_ARCHIVE_INTERVAL', 3600))
+
+# Number of lines of a task log shown at first
+TASK_LOG_TAIL_LINES = int(os.environ.get('TASK_LOG_TAIL_LINES', 1000))
+
+# Seconds during which a (cached) task log is served without checking for new output
+TASK_LOG_CACHE_TTL = int(os.environ.get('TASK_LOG_CACHE_TTL', 3))
+
+# Seconds a task log is kept in the cache after its last read
+TASK_LOG_CACHE_TIMEOUT = int(os.environ.get('TASK_LOG_CACHE_TIMEOUT', 3600))
+
+# Maximum bytes of a task log kept in the cache (the most recent ones)
+TASK_LOG_CACHE_MAX_BYTES = int(os.environ.get('TASK_LOG_CACHE_MAX_BYTES', 1024*1024))
+
+# Seconds the lists of containers and computings visible to each user are cached (they are invalidated
+# on changes, and other processes see the changes after at most this time)
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+
+# Seconds the computing sys and user confs are cached (they are invalidated on save, and
+# other processes see the changes after at most this time)
+COMPUTING_CONF_CACHE_TIMEOUT = int(os.environ.get('COMPUTING_CONF_CACHE_TIMEOUT', 60))
+
+
 #===============================
 #  Email settings
 #===============================
@@ -162,11 +283,27 @@ TMP_PATH   = '/tmp/'
 DJANGO_PUBLIC_HTTP_HOST = os.environ.get('DJANGO_PUBLIC_HTTP_HOST', 'http://localhost')
 
 DJANGO_EMAIL_SERVICE = os.environ.get('DJANGO_EMAIL_SERVICE', 'Sendgrid')
-if not DJANGO_EMAIL_SERVICE in ['Sendgrid', None]:
+if not DJANGO_EMAIL_SERVICE in ['Sendgrid', 'Sink', None]:
     raise ImproperlyConfigured('Invalid EMAIL_METHOD ("{}")'.format(DJANGO_EMAIL_SERVICE))
 DJANGO_EMAIL_FROM = os.environ.get('DJANGO_EMAIL_FROM', 'Rosetta <notifications@rosetta.local')
 DJANGO_EMAIL_APIKEY = os.environ.get('DJANGO_EMAIL_APIKEY', None)
 
+# Emails are queued in the outbox and sent in background. Maximum number of emails sent per second,
+# and how many are taken from the outbox at a time
+EMAIL_SEND_RATE = float(os.environ.get('EMAIL_SEND_RATE', 5))
+EMAIL_SEND_BATCH_SIZE = int(os.environ.get('EMAIL_SEND_BATCH_SIZE', 100))
+
+# Maximum number of delivery attempts for an email, and seconds before the first retry (then doubling)
+EMAIL_SEND_MAX_ATTEMPTS = int(os.environ.get('EMAIL_SEND_MAX_ATTEMPTS', 5))
+EMAIL_SEND_RETRY_DELAY = int(os.environ.get('EMAIL_SEND_RETRY_DELAY', 60))
+
+# Seconds after which an email still being sent is considered lost (i.e. its sender died) and queued
+# again. It might then be delivered twice, if the sender died right after delivering it.
+EMAIL_SEND_TIMEOUT = int(os.environ.get('EMAIL_SEND_TIMEOUT', 300))
+
+# Seconds between polls of the outbox
+EMAIL_SEND_POLL_INTERVAL = float(os.environ.get('EMAIL_SEND_POLL_INTERVAL', 2))
+
 
 #===============================
 #  Logging
@@ -231,6 +368,10 @@ LOGGING = {
 #  Auth
 #===============================
 
+# Size of the (per process) cache of the API auth tokens, and seconds its entries are valid for
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 60))
+
 OIDC_RP_CLIENT_ID  = os.environ.get('OIDC_RP_CLIENT_ID', None)
 
 if OIDC_RP_CLIENT_ID:
@@ -42,8 +42,10 @@ urlpatterns = [
     url(r'^register/$', core_app_views.register_view),
     url(r'^account/$', core_app_views.account),
     url(r'^tasks/$', core_app_views.tasks),
+    url(r'^task_history/$', core_app_views.task_history),
     url(r'^create_task/$', core_app_views.create_task),
     url(r'^task_log/$', core_app_views.task_log),
+    url(r'^task_log/stream/$', core_app_views.task_log_stream),
     url(r'^computings/$', core_app_views.computings),
     url(r'^add_computing/$', core_app_views.add_computing),
     url(r'^edit_computing_conf/$', core_app_views.edit_computing_conf),
@@ -51,7 +53,7 @@ urlpatterns = [
     url(r'^add_container/$', core_app_views.add_container),
 
     # Sharable link for tasks
-    url(r'^t/(?P<id>\w{0,36})/$', core_app_views.sharable_link_handler),
+    url(r'^t/(?P<id>[\w-]{0,36})/$', core_app_views.sharable_link_handler),
 
     # Modules
     path('admin/', admin.site.urls),
@@ -63,6 +65,7 @@ urlpatterns = [
 
     # Custom APIs
     path('api/v1/base/agent/', core_app_api.agent_api.as_view(), name='agent_api'),
+    path('api/v1/base/agent/heartbeat/', core_app_api.agent_heartbeat_api.as_view(), name='agent_heartbeat_api'),
 
     # Open ID Connect Auth
     path('oidc/', include('mozilla_django_oidc.urls')),
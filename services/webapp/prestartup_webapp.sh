@@ -8,3 +8,12 @@ chown rosetta:rosetta /var/log/webapp
 mkdir -p /data/resources 
 chown rosetta:rosetta /data/resources
 
+# Give the rosetta user access to the Docker socket (for the local tasks),
+# using a group with the same id of the one owning the socket on the host
+if [ -S /var/run/docker.sock ]; then
+    DOCKER_SOCKET_GID=$(stat -c '%g' /var/run/docker.sock)
+    if ! getent group $DOCKER_SOCKET_GID > /dev/null; then
+        groupadd -g $DOCKER_SOCKET_GID dockerhost
+    fi
+    usermod -a -G $(getent group $DOCKER_SOCKET_GID | cut -d: -f1) rosetta
+fi
@@ -0,0 +1,28 @@
+#!/bin/bash
+
+DATE=$(date)
+
+echo ""
+echo "==================================================="
+echo "  Starting task archiver @ $DATE"
+echo "==================================================="
+echo ""
+
+echo "Loading/sourcing env and settings..."
+echo ""
+
+# Load env
+source /env.sh
+
+# Database conf
+source /db_conf.sh
+
+# Stay quiet on Python warnings
+export PYTHONWARNINGS=ignore
+
+# To Python3 (unbuffered). P.s. "python3 -u" does not work..
+export PYTHONUNBUFFERED=on
+
+# Run the archiver (the interval is set by TASK_ARCHIVE_INTERVAL)
+echo "Now starting the archiver and logging in /var/log/webapp/archiver.log."
+cd /opt/code && exec python3 manage.py core_app_archive_tasks 2>> /var/log/webapp/archiver.log
@@ -0,0 +1,28 @@
+#!/bin/bash
+
+DATE=$(date)
+
+echo ""
+echo "==================================================="
+echo "  Starting task launcher @ $DATE"
+echo "==================================================="
+echo ""
+
+echo "Loading/sourcing env and settings..."
+echo ""
+
+# Load env
+source /env.sh
+
+# Database conf
+source /db_conf.sh
+
+# Stay quiet on Python warnings
+export PYTHONWARNINGS=ignore
+
+# To Python3 (unbuffered). P.s. "python3 -u" does not work..
+export PYTHONUNBUFFERED=on
+
+# Run the launcher (the workers are set by TASK_LAUNCH_WORKERS)
+echo "Now starting the launcher and logging in /var/log/webapp/launcher.log."
+cd /opt/code && exec python3 manage.py core_app_launch_tasks 2>> /var/log/webapp/launcher.log
@@ -0,0 +1,28 @@
+#!/bin/bash
+
+DATE=$(date)
+
+echo ""
+echo "==================================================="
+echo "  Starting email sender @ $DATE"
+echo "==================================================="
+echo ""
+
+echo "Loading/sourcing env and settings..."
+echo ""
+
+# Load env
+source /env.sh
+
+# Database conf
+source /db_conf.sh
+
+# Stay quiet on Python warnings
+export PYTHONWARNINGS=ignore
+
+# To Python3 (unbuffered). P.s. "python3 -u" does not work..
+export PYTHONUNBUFFERED=on
+
+# Run the email sender (the rate limit is set by EMAIL_SEND_RATE)
+echo "Now starting the email sender and logging in /var/log/webapp/mailer.log."
+cd /opt/code && exec python3 manage.py core_app_send_emails 2>> /var/log/webapp/mailer.log
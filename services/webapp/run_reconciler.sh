@@ -0,0 +1,28 @@
+#!/bin/bash
+
+DATE=$(date)
+
+echo ""
+echo "==================================================="
+echo "  Starting task status reconciler @ $DATE"
+echo "==================================================="
+echo ""
+
+echo "Loading/sourcing env and settings..."
+echo ""
+
+# Load env
+source /env.sh
+
+# Database conf
+source /db_conf.sh
+
+# Stay quiet on Python warnings
+export PYTHONWARNINGS=ignore
+
+# To Python3 (unbuffered). P.s. "python3 -u" does not work..
+export PYTHONUNBUFFERED=on
+
+# Run the reconciler (the interval is set by TASK_STATUS_RECONCILE_INTERVAL)
+echo "Now starting the reconciler and logging in /var/log/webapp/reconciler.log."
+cd /opt/code && exec python3 manage.py core_app_reconcile_statuses 2>> /var/log/webapp/reconciler.log